@@ -0,0 +1,142 @@
+import contextlib
+import io
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from support_classes import *
+from map import Map
+from generation import bounded_map
+from serialization import TERRAIN_CODES, TERRAIN_INDEX
+
+# Chunked generation for very large maps.
+#
+# Global structures (rivers, deserts, bridges, castle) are laid down once on the whole map.  The local stages
+# (buildings, lava, forests, tree scatter) then run per tile: each worker gets the tile's core plus a margin of
+# surrounding terrain, places buildings entirely inside the core, and lets lava streams and forests that start
+# in the core spill into the margin.  Results are merged back in tile order; a margin cell only takes a tile's
+# change if no earlier tile (or building) already changed it.  Every tile seeds its own RNG from (seed, tile),
+# so the result depends on the seed alone, never on how many workers ran or in which order they finished.
+# Vaults, items and hazards are placed last on the whole map.  Workers only ever hold one window of terrain.
+
+def tile_grid(width, height, tile_size):
+    index = 0
+    for min_y in range(0, height, tile_size):
+        for min_x in range(0, width, tile_size):
+            yield index, (min_x, min_y, min(min_x + tile_size, width), min(min_y + tile_size, height))
+            index += 1
+
+def intersect(a, b):
+    bounds = (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+    return bounds if bounds[0] < bounds[2] and bounds[1] < bounds[3] else None
+
+def area(bounds):
+    return (bounds[2] - bounds[0]) * (bounds[3] - bounds[1])
+
+def scaled_count(count, fraction):
+    # expected count * fraction, rounded up or down at random so the map-wide total comes out right on average
+    expected = count * fraction
+    return int(expected) + (random.random() < expected - int(expected))
+
+def window_task(game_map, base_terrain, seed, index, core, margin):
+    # windows are cut from the terrain as it was before any tile was merged
+    width = game_map.width
+    window = (max(core[0] - margin, 0), max(core[1] - margin, 0), min(core[2] + margin, width), min(core[3] + margin, game_map.height))
+    terrain = b''.join(base_terrain[y * width + window[0]:y * width + window[2]] for y in range(window[1], window[3]))
+    return (seed, index, core, window, terrain, width, game_map.height, game_map.config)
+
+def generate_tile(task):
+    seed, index, core, window, terrain, map_width, map_height, config = task
+    random.seed('{}:tile:{}'.format(seed, index))
+    origin_x, origin_y = window[0], window[1]
+    window_width, window_height = window[2] - window[0], window[3] - window[1]
+    local_core = (core[0] - origin_x, core[1] - origin_y, core[2] - origin_x, core[3] - origin_y)
+
+    window_map = Map(window_width, window_height, config)
+    window_map.cells = [[TERRAIN_CODES[terrain[y * window_width + x]] for x in range(window_width)] for y in range(window_height)]
+
+    # buildings: generated on a map of just the core, so they never cross into another tile
+    core_width, core_height = core[2] - core[0], core[3] - core[1]
+    core_map = Map(core_width, core_height, config)
+    core_map.cells = [row[local_core[0]:local_core[2]] for row in window_map.cells[local_core[1]:local_core[3]]]
+    buildable = sum(1 for row in core_map.cells for cell in row if cell not in [TerrType.BUILDING, TerrType.CASTLE, TerrType.WATER])
+    density = config.building_density_min + (config.building_density_max - config.building_density_min) * random.random()
+    core_map.generate_buildings(desired_size=buildable * density) # relative to buildable land, so a tile the castle covers stays empty
+    rooms = []
+    for y in range(core_height):
+        for x in range(core_width):
+            if core_map.room_numbers[y][x]:
+                rooms.append((core[0] + x, core[1] + y, core_map.room_numbers[y][x]))
+                window_map.set_cell(local_core[0] + x, local_core[1] + y, core_map.cells[y][x])
+    doors = [(c1.x + core[0], c1.y + core[1], c2.x + core[0], c2.y + core[1]) for c1, c2 in core_map.doors]
+
+    # lava: the share of the map-wide lava that falls in this tile's part of the bottom-right quarter
+    lava_region = intersect(core, (map_width // 2, map_height // 2, map_width, map_height))
+    if lava_region is not None:
+        density = config.lava_density_min + (config.lava_density_max - config.lava_density_min) * random.random()
+        local_lava_region = (lava_region[0] - origin_x, lava_region[1] - origin_y, lava_region[2] - origin_x, lava_region[3] - origin_y)
+        window_map.generate_lava(bounds=local_lava_region, desired_lava_count=map_width * map_height * density * area(lava_region) / area((map_width // 2, map_height // 2, map_width, map_height)))
+
+    forest_region = intersect(core, (round(map_width * 0.1), round(map_height * 0.1), round(map_width * 0.9), round(map_height * 0.9)))
+    if forest_region is not None:
+        num_forests = scaled_count(random.randint(config.forest_count_min, config.forest_count_max), area(forest_region) / (map_width * map_height * 0.64))
+        local_forest_region = (forest_region[0] - origin_x, forest_region[1] - origin_y, forest_region[2] - origin_x, forest_region[3] - origin_y)
+        window_map.generate_forests(bounds=local_forest_region, num_forests=num_forests)
+
+    window_map.scatter_trees(bounds=local_core)
+
+    changes = []
+    for y in range(window_height):
+        for x in range(window_width):
+            old = terrain[y * window_width + x]
+            new = TERRAIN_INDEX[window_map.cells[y][x]]
+            if new != old:
+                changes.append((origin_x + x, origin_y + y, old, new))
+    retries = dict(window_map.retry_counts)
+    for stage, count in core_map.retry_counts.items():
+        retries[stage] = retries.get(stage, 0) + count
+    return index, changes, rooms, core_map.next_room_number - 1, doors, retries
+
+def merge_tile(game_map, result):
+    index, changes, rooms, room_count, doors, retries = result
+    room_offset = game_map.next_room_number - 1
+    for x, y, room in rooms:
+        game_map.set_room_number(x, y, room + room_offset)
+    game_map.next_room_number += room_count
+    for x1, y1, x2, y2 in doors:
+        game_map.add_door(Coordinates(x1, y1), Coordinates(x2, y2))
+    for x, y, old, new in changes:
+        # cells another tile already changed keep that change; a tile's own buildings always win
+        if game_map.room_numbers[y][x] > room_offset or game_map.cells[y][x] == TERRAIN_CODES[old]:
+            game_map.set_cell(x, y, TERRAIN_CODES[new])
+    for stage, count in retries.items():
+        game_map.retry_counts[stage] = game_map.retry_counts.get(stage, 0) + count
+
+def generate_chunked_map(seed, width, height, config=None, tile_size=128, margin=8, max_workers=None, quiet=True):
+    # max_workers=0 runs every tile in this process; the map is the same either way
+    output = contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext()
+    with output:
+        random.seed(seed)
+        game_map = Map(width, height, config)
+        game_map.generate_rivers()
+        game_map.generate_deserts()
+        game_map.generate_bridges()
+        game_map.generate_castle()
+
+        base_terrain = bytes(TERRAIN_INDEX[cell] for row in game_map.cells for cell in row)
+        tasks = (window_task(game_map, base_terrain, seed, index, core, margin) for index, core in tile_grid(width, height, tile_size))
+        if max_workers == 0:
+            for task in tasks:
+                merge_tile(game_map, generate_tile(task))
+        else:
+            workers = max_workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for result in bounded_map(executor, generate_tile, tasks, 2 * workers):
+                    merge_tile(game_map, result)
+
+        random.seed('{}:final'.format(seed))
+        game_map.place_vaults()
+        game_map.place_items()
+        if game_map.config.hazards:
+            game_map.place_hazards()
+    return game_map
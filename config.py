@@ -0,0 +1,90 @@
+from dataclasses import dataclass, fields, replace
+
+# Tuning constants for Map.generate_map.  Densities are fractions of the map area, counts are inclusive ranges.
+@dataclass(frozen=True)
+class GenerationConfig:
+    # rivers
+    river_meander_coeff: float = 0.5
+    river_widen_iterations: int = 2
+    river_widen_coeff: float = 0.15
+    tributary_meander_coeff: float = 0.5
+    tributary_widen_iterations: int = 2
+    tributary_widen_coeff: float = 0.08
+    island_min_distance_to_land: int = 3
+    island_growth_probability: float = 0.8
+
+    # deserts
+    desert_spread_probability: float = 0.8
+    large_desert_size_min: int = 14
+    large_desert_size_max: int = 16
+    large_desert_subcenters_min: int = 1
+    large_desert_subcenters_max: int = 3
+    small_desert_count_min: int = 1
+    small_desert_count_max: int = 3
+    small_desert_size_min: int = 9
+    small_desert_size_max: int = 11
+
+    # bridges
+    bridge_count_min: int = 1
+    bridge_count_max: int = 3
+    bridge_max_length: int = 5
+
+    # buildings
+    building_density_min: float = 0.05
+    building_density_max: float = 0.10
+    building_max_size: int = 8
+
+    # lava
+    lava_density_min: float = 0.03
+    lava_density_max: float = 0.04
+    lava_meander_coeff: float = 0.2
+    lava_speckle_probability: float = 0.02
+
+    # forests
+    forest_count_min: int = 3
+    forest_count_max: int = 5
+    forest_size_min: int = 3
+    forest_size_max: int = 6
+    tree_scatter_probability: float = 0.01
+
+    # hazards, off unless asked for so that seeded maps stay as they were
+    hazards: bool = False
+    lava_snake_count_min: int = 1
+    lava_snake_count_max: int = 3
+    sawblade_count_min: int = 2
+    sawblade_count_max: int = 4
+    sawblade_corridor_min: int = 3
+    sawblade_corridor_max: int = 6
+    sawblade_loop_size_min: int = 3
+    sawblade_loop_size_max: int = 5
+
+    def with_overrides(self, **overrides):
+        return replace(self, **overrides)
+
+    def as_dict(self):
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    @classmethod
+    def field_names(cls):
+        return [f.name for f in fields(cls)]
+
+    @classmethod
+    def from_strings(cls, overrides):
+        # {'building_density_max': '0.12'} -> config, converting each value to its field's type
+        defaults = cls().as_dict()
+        converted = {}
+        for name, value in overrides.items():
+            if name not in defaults:
+                raise ValueError("Unknown config field: {}".format(name))
+            converted[name] = parse_bool(value) if isinstance(defaults[name], bool) else type(defaults[name])(value)
+        return cls(**converted)
+
+def parse_bool(value):
+    # bool('false') is True, so query strings and --set values are read by hand
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ['1', 'true', 'yes', 'on']:
+        return True
+    if value.lower() in ['0', 'false', 'no', 'off']:
+        return False
+    raise ValueError("Not a true/false value: {!r}".format(value))
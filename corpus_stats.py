@@ -0,0 +1,263 @@
+import itertools
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from generation import bounded_map
+import metrics
+
+# Corpus-wide statistics for generated maps.  Workers measure a chunk of maps each with metrics.map_metrics
+# (terrain shares, clear-cell reachability for the 16 item sets, distances from the start shrine, room counts,
+# retries) and fold them into a CorpusSummary; the parent merges the chunk summaries as they arrive.  Every
+# summary is mergeable and bounded in size - moments, a fixed-width histogram and a relative-error quantile
+# sketch per metric - so a run over a million maps needs no more memory than one over a hundred.
+
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+RELATIVE_ACCURACY = 0.01
+MAX_SKETCH_BUCKETS = 2048
+CHUNK_SIZE = 16
+NON_METRIC_COLUMNS = ['seed', 'file', 'width', 'height', 'error']
+
+# histogram bin width by metric name prefix; the first match wins
+HISTOGRAM_BIN_WIDTHS = [('share_', 0.01), ('reach_clear_', 25), ('dist_', 5), ('room_count', 5), ('door_count', 5), ('retries_', 5)]
+
+def bin_width_for(name):
+    for prefix, width in HISTOGRAM_BIN_WIDTHS:
+        if name.startswith(prefix):
+            return width
+    return 1
+
+class QuantileSketch:
+    # DDSketch-style: values fall in logarithmic buckets, so any quantile comes back within relative_accuracy of
+    # a true sample value.  Merging adds bucket counts.  Past max_buckets the smallest buckets are folded
+    # together, which only costs accuracy at the low end of the distribution.
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, max_buckets=MAX_SKETCH_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def key(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def value(self, key):
+        # the midpoint (in relative terms) of bucket key
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        if value > 0:
+            buckets = self.positive
+            key = self.key(value)
+        elif value < 0:
+            buckets = self.negative
+            key = self.key(-value)
+        else:
+            self.zero_count += count
+            self.count += count
+            return
+        buckets[key] = buckets.get(key, 0) + count
+        self.count += count
+        if len(buckets) > self.max_buckets:
+            self.collapse(buckets)
+
+    def collapse(self, buckets):
+        # fold the buckets nearest zero into one
+        keys = sorted(buckets)
+        folded = keys[:len(keys) - self.max_buckets + 1]
+        total = sum(buckets.pop(key) for key in folded)
+        buckets[folded[-1]] = total
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracy ({} and {})".format(self.relative_accuracy, other.relative_accuracy))
+        for mine, theirs in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+            if len(mine) > self.max_buckets:
+                self.collapse(mine)
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self.value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self.value(key)
+        return self.value(max(self.positive))
+
+class Histogram:
+    # fixed-width bins anchored at zero, stored sparsely; merging adds counts
+    def __init__(self, bin_width):
+        self.bin_width = bin_width
+        self.bins = {}
+
+    def add(self, value):
+        index = math.floor(value / self.bin_width)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other):
+        if other.bin_width != self.bin_width:
+            raise ValueError("Cannot merge histograms with bin widths {} and {}".format(self.bin_width, other.bin_width))
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def rows(self):
+        return [(index * self.bin_width, (index + 1) * self.bin_width, self.bins[index]) for index in sorted(self.bins)]
+
+class MetricSummary:
+    def __init__(self, bin_width=1):
+        self.count = 0
+        self.missing = 0     # maps where the metric is undefined, e.g. no gem is reachable
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.sketch = QuantileSketch()
+        self.histogram = Histogram(bin_width)
+
+    def add(self, value):
+        if value is None:
+            self.missing += 1
+            return
+        self.count += 1
+        self.total += value
+        self.total_squares += value * value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.sketch.add(value)
+        self.histogram.add(value)
+
+    def merge(self, other):
+        self.count += other.count
+        self.missing += other.missing
+        self.total += other.total
+        self.total_squares += other.total_squares
+        for value in [other.minimum, other.maximum]:
+            if value is not None:
+                self.minimum = value if self.minimum is None else min(self.minimum, value)
+                self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.sketch.merge(other.sketch)
+        self.histogram.merge(other.histogram)
+
+    def row(self):
+        mean = self.total / self.count if self.count else None
+        std = math.sqrt(max(self.total_squares / self.count - mean * mean, 0)) if self.count else None
+        row = {'count': self.count, 'missing': self.missing, 'mean': mean, 'std': std, 'min': self.minimum, 'max': self.maximum}
+        for q in QUANTILES:
+            row['p{:02d}'.format(round(q * 100))] = self.sketch.quantile(q)
+        return row
+
+class CorpusSummary:
+    def __init__(self):
+        self.maps = 0
+        self.failed = 0
+        self.metrics = {}
+
+    def add_row(self, row):
+        self.maps += 1
+        if row.get('error'):
+            self.failed += 1
+            return
+        for name, value in row.items():
+            if name in NON_METRIC_COLUMNS:
+                continue
+            if name not in self.metrics:
+                # a metric first seen now was missing from every earlier map
+                self.metrics[name] = MetricSummary(bin_width_for(name))
+                self.metrics[name].missing = self.maps - self.failed - 1
+            self.metrics[name].add(value)
+        for name, summary in self.metrics.items():
+            if name not in row:
+                summary.add(None)
+
+    def merge(self, other):
+        for name, summary in other.metrics.items():
+            if name not in self.metrics:
+                self.metrics[name] = MetricSummary(summary.histogram.bin_width)
+                self.metrics[name].missing = self.maps - self.failed
+            self.metrics[name].merge(summary)
+        for name, summary in self.metrics.items():
+            if name not in other.metrics:
+                summary.missing += other.maps - other.failed
+        self.maps += other.maps
+        self.failed += other.failed
+
+    def summary_rows(self):
+        return [dict({'metric': name}, **summary.row()) for name, summary in self.metrics.items()]
+
+    def histogram_rows(self):
+        return [
+            {'metric': name, 'bin_start': start, 'bin_end': end, 'count': count}
+            for name, summary in self.metrics.items() for start, end, count in summary.histogram.rows()
+        ]
+
+def measure_seed(task):
+    return metrics.seed_row(metrics.map_metrics, task)
+
+def measure_file(filename):
+    return metrics.file_row(metrics.map_metrics, filename)
+
+def summarize_chunk(task):
+    # returns the chunk's summary, with its per-map rows if they are wanted
+    measure, tasks, keep_rows = task
+    summary = CorpusSummary()
+    rows = []
+    for item in tasks:
+        row = measure(item)
+        summary.add_row(row)
+        if keep_rows or row['error']:
+            rows.append(row)
+    return summary, rows
+
+def chunked(tasks, size):
+    tasks = iter(tasks)
+    while True:
+        chunk = list(itertools.islice(tasks, size))
+        if not chunk:
+            return
+        yield chunk
+
+def histogram_filename(filename):
+    stem, ext = os.path.splitext(filename)
+    return stem + '_histograms' + (ext or '.csv')
+
+def summarize_corpus(tasks, filename, measure=measure_seed, rows_filename=None, max_workers=None, chunk_size=CHUNK_SIZE):
+    # tasks are (seed, width, height, config) for measure_seed or .bin filenames for measure_file; they may be
+    # an unbounded generator.  Writes one row per metric to filename and the histograms next to it, plus one
+    # row per map to rows_filename if given (streamed, so it does not grow memory either).
+    summary = CorpusSummary()
+    workers = max_workers or os.cpu_count() or 1
+    writer = metrics.ColumnWriter(rows_filename) if rows_filename else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = ((measure, chunk, writer is not None) for chunk in chunked(tasks, chunk_size))
+            for chunk_summary, rows in bounded_map(executor, summarize_chunk, chunks, 2 * workers):
+                summary.merge(chunk_summary)
+                for row in rows:
+                    if row['error']:
+                        print('Map {} failed: {}'.format(row.get('seed', row.get('file')), row['error']), file=sys.stderr)
+                    if writer is not None:
+                        writer.write(row)
+    finally:
+        if writer is not None:
+            writer.close()
+    metrics.write_columns(summary.summary_rows(), filename)
+    metrics.write_columns(summary.histogram_rows(), histogram_filename(filename))
+    print(f"Summarized {summary.maps} maps ({summary.failed} failed) into '{filename}' and '{histogram_filename(filename)}'.")
+    return summary
@@ -0,0 +1,347 @@
+import heapq
+import itertools
+import random
+from collections import deque
+
+from support_classes import *
+
+# Derived data that is expensive to compute from scratch.  A cache registered with Map.register_cache is told
+# about every changed cell (terrain, contents, room number, or either side of a new door or forced wall) and
+# brings itself up to date lazily, on the next read, by looking only at the touched area where it can.  Once a
+# quarter of the map is dirty it stops collecting cells and simply rebuilds on the next read, so a cache nobody
+# reads for a while (e.g. through a whole generation stage) costs next to nothing.
+
+NEIGHBOR_OFFSETS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+class DerivedCache:
+    def __init__(self):
+        self.game_map = None
+        self.dirty = set()
+        self.stale = False
+
+    def attach(self, game_map):
+        self.game_map = game_map
+        self.dirty = set()
+        self.stale = False
+        self.rebuild()
+
+    def mark_dirty(self, x, y):
+        if self.stale:
+            return
+        self.dirty.add((x, y))
+        if len(self.dirty) > self.game_map.width * self.game_map.height // 4:
+            self.dirty = set()
+            self.stale = True
+
+    def refresh(self):
+        if self.stale:
+            self.stale = False
+            self.rebuild()
+        elif self.dirty:
+            dirty = self.dirty
+            self.dirty = set()
+            self.update(dirty)
+
+    def rebuild(self):
+        raise NotImplementedError
+
+    def update(self, dirty):
+        self.rebuild()
+
+    def neighbors(self, x, y):
+        width, height = self.game_map.width, self.game_map.height
+        for dx, dy in NEIGHBOR_OFFSETS:
+            if 0 <= x + dx < width and 0 <= y + dy < height:
+                yield x + dx, y + dy
+
+class WallMaskCache(DerivedCache):
+    # per-cell bitmask of the walls export_to_excel draws as thick borders
+    TOP, BOTTOM, LEFT, RIGHT = 1, 2, 4, 8
+    SIDES = [(TOP, 0, 1), (BOTTOM, 0, -1), (LEFT, -1, 0), (RIGHT, 1, 0)]
+
+    def compute(self, x, y):
+        game_map = self.game_map
+        here = Coordinates(x, y)
+        mask = 0
+        for bit, dx, dy in self.SIDES:
+            if 0 <= x + dx < game_map.width and 0 <= y + dy < game_map.height:
+                if game_map.is_wall(here, Coordinates(x + dx, y + dy)):
+                    mask |= bit
+        return mask
+
+    def rebuild(self):
+        self.masks = [[self.compute(x, y) for x in range(self.game_map.width)] for y in range(self.game_map.height)]
+
+    def update(self, dirty):
+        touched = set(dirty)
+        for x, y in dirty:
+            touched.update(self.neighbors(x, y))
+        for x, y in touched:
+            if 0 <= x < self.game_map.width and 0 <= y < self.game_map.height:
+                self.masks[y][x] = self.compute(x, y)
+
+    def get(self, x, y):
+        self.refresh()
+        return self.masks[y][x]
+
+class DistanceToTerrainCache(DerivedCache):
+    # Manhattan distance from every cell to the closest cell of the given terrain types, as closest_terrain
+    # computes it; inf when the map has none.
+    def __init__(self, terrain_types):
+        super().__init__()
+        self.terrain_types = set(terrain_types)
+
+    def is_source(self, x, y):
+        return self.game_map.get_cell(x, y) in self.terrain_types
+
+    def rebuild(self):
+        game_map = self.game_map
+        self.distances = [[float('inf')] * game_map.width for _ in range(game_map.height)]
+        queue = deque()
+        for y in range(game_map.height):
+            for x in range(game_map.width):
+                if self.is_source(x, y):
+                    self.distances[y][x] = 0
+                    queue.append((x, y))
+        while queue:
+            x, y = queue.popleft()
+            next_distance = self.distances[y][x] + 1
+            for nx, ny in self.neighbors(x, y):
+                if next_distance < self.distances[ny][nx]:
+                    self.distances[ny][nx] = next_distance
+                    queue.append((nx, ny))
+
+    def update(self, dirty):
+        distances = self.distances
+        added = []
+        removed = []
+        for x, y in dirty:
+            if not (0 <= x < self.game_map.width and 0 <= y < self.game_map.height):
+                continue
+            if self.is_source(x, y):
+                if distances[y][x] != 0:
+                    added.append((x, y))
+            elif distances[y][x] == 0:
+                removed.append((x, y))
+
+        heap = []
+        if removed:
+            # every cell with a shortest path through a removed source loses its distance...
+            invalid = set(removed)
+            stack = list(removed)
+            while stack:
+                x, y = stack.pop()
+                for nx, ny in self.neighbors(x, y):
+                    if (nx, ny) not in invalid and distances[ny][nx] == distances[y][x] + 1:
+                        invalid.add((nx, ny))
+                        stack.append((nx, ny))
+            for x, y in invalid:
+                distances[y][x] = float('inf')
+            # ...and is refilled from the surviving cells around the invalidated region
+            for x, y in invalid:
+                for nx, ny in self.neighbors(x, y):
+                    if (nx, ny) not in invalid and distances[ny][nx] != float('inf'):
+                        heap.append((distances[ny][nx], nx, ny))
+        for x, y in added:
+            distances[y][x] = 0
+            heap.append((0, x, y))
+
+        heapq.heapify(heap)
+        while heap:
+            distance, x, y = heapq.heappop(heap)
+            if distance > distances[y][x]:
+                continue
+            for nx, ny in self.neighbors(x, y):
+                if distance + 1 < distances[ny][nx]:
+                    distances[ny][nx] = distance + 1
+                    heapq.heappush(heap, (distance + 1, nx, ny))
+
+    def get(self, x, y):
+        self.refresh()
+        return self.distances[y][x]
+
+class ReachabilityCache(DerivedCache):
+    # the cells flood_fill(start, blocking_terrain_types, blocked_walls) returns, kept as a set
+    def __init__(self, start, blocking_terrain_types, blocked_walls=True):
+        super().__init__()
+        self.start = start
+        self.blocking_terrain_types = set(blocking_terrain_types)
+        self.blocked_walls = blocked_walls
+
+    def can_step(self, current, neighbor):
+        if self.game_map.get_cell(neighbor.x, neighbor.y) in self.blocking_terrain_types:
+            return False
+        return not self.blocked_walls or not self.game_map.is_wall(current, neighbor)
+
+    def rebuild(self):
+        self.reachable = set(self.game_map.flood_fill(self.start, self.blocking_terrain_types, blocked_walls=self.blocked_walls))
+
+    def extend_from(self, frontier):
+        stack = list(frontier)
+        while stack:
+            current = stack.pop()
+            for neighbor in current.get_neighboring_coordinates():
+                if self.game_map.is_valid_coordinates(neighbor) and neighbor not in self.reachable and self.can_step(current, neighbor):
+                    self.reachable.add(neighbor)
+                    stack.append(neighbor)
+
+    def update(self, dirty):
+        gained = []
+        for x, y in dirty:
+            cell = Coordinates(x, y)
+            if not self.game_map.is_valid_coordinates(cell):
+                continue
+            if cell in self.reachable:
+                # a reachable cell that became blocked, or walled off from a reachable neighbour, may cut off
+                # anything behind it; working out exactly what is lost costs as much as starting again
+                if cell != self.start and self.game_map.get_cell(x, y) in self.blocking_terrain_types:
+                    self.rebuild()
+                    return
+                for neighbor in cell.get_neighboring_coordinates():
+                    if neighbor in self.reachable and self.blocked_walls and self.game_map.is_wall(cell, neighbor):
+                        self.rebuild()
+                        return
+                gained.append(cell)
+            else:
+                for neighbor in cell.get_neighboring_coordinates():
+                    if neighbor in self.reachable and self.can_step(neighbor, cell):
+                        self.reachable.add(cell)
+                        gained.append(cell)
+                        break
+        self.extend_from(gained)
+
+    def get(self):
+        self.refresh()
+        return self.reachable
+
+class IslandCache(DerivedCache):
+    # connected regions of cells not of the split terrain types, as split_map_by_terrain finds them
+    def __init__(self, split_terrain_types):
+        super().__init__()
+        self.split_terrain_types = set(split_terrain_types)
+        self.next_label = 0
+
+    def label_cells(self, cells):
+        # flood-fill label every open cell in `cells`, never leaving that set
+        for start in cells:
+            x, y = start
+            if self.labels[y][x] is not None or self.game_map.get_cell(x, y) in self.split_terrain_types:
+                continue
+            label = self.next_label
+            self.next_label += 1
+            members = {start}
+            self.labels[y][x] = label
+            stack = [start]
+            while stack:
+                x, y = stack.pop()
+                for n in self.neighbors(x, y):
+                    if n in cells and self.labels[n[1]][n[0]] is None and self.game_map.get_cell(n[0], n[1]) not in self.split_terrain_types:
+                        self.labels[n[1]][n[0]] = label
+                        members.add(n)
+                        stack.append(n)
+            self.islands[label] = members
+
+    def rebuild(self):
+        game_map = self.game_map
+        self.labels = [[None] * game_map.width for _ in range(game_map.height)]
+        self.islands = {}
+        self.label_cells({(x, y) for y in range(game_map.height) for x in range(game_map.width)})
+
+    def update(self, dirty):
+        # only islands touching the dirty cells can have merged or split
+        region = set()
+        affected = set()
+        for x, y in dirty:
+            if not (0 <= x < self.game_map.width and 0 <= y < self.game_map.height):
+                continue
+            region.add((x, y))
+            for nx, ny in [(x, y)] + list(self.neighbors(x, y)):
+                if self.labels[ny][nx] is not None:
+                    affected.add(self.labels[ny][nx])
+        for label in affected:
+            region.update(self.islands.pop(label))
+        for x, y in region:
+            self.labels[y][x] = None
+        self.label_cells(region)
+
+    def get_label(self, x, y):
+        self.refresh()
+        return self.labels[y][x]
+
+    def get_islands(self):
+        self.refresh()
+        return list(self.islands.values())
+
+class OccupancyIndex(DerivedCache):
+    # summed-area table of the cells a building cannot cover, so any rectangle is tested in O(1); a change only
+    # redoes the part of the table above and to the right of it.  For each size asked about it also keeps the
+    # number of free anchors (bottom-left corners) in every row; a change only recounts the rows whose anchors
+    # could cover it, and random_anchor() picks a row by its count and then the spot within it, so no list of
+    # anchors is ever built.
+    def __init__(self, blocking_terrain_types):
+        super().__init__()
+        self.blocking_terrain_types = set(blocking_terrain_types)
+
+    def rebuild(self):
+        self.table = self.game_map.summed_area_table(self.blocking_terrain_types)
+        self.row_counts = {}
+
+    def update(self, dirty):
+        # only table entries above and to the right of the lowest dirty cell can change
+        game_map = self.game_map
+        min_x = min(x for x, y in dirty)
+        min_y = min(y for x, y in dirty)
+        table = self.table
+        for y in range(min_y, game_map.height):
+            below, row, cells = table[y], table[y + 1], game_map.cells[y]
+            running = row[min_x] - below[min_x]
+            for x in range(min_x, game_map.width):
+                running += cells[x] in self.blocking_terrain_types
+                row[x + 1] = below[x + 1] + running
+        dirty_rows = {y for x, y in dirty}
+        for (x_size, y_size), counts in self.row_counts.items():
+            rows = {y for row in dirty_rows for y in range(max(row - y_size + 1, 0), min(row + 1, len(counts)))}
+            for y in rows:
+                counts[y] = sum(1 for _ in self.free_in_row(y, x_size, y_size))
+
+    def is_free(self, x, y, x_size, y_size):
+        self.refresh()
+        return self.game_map.window_count(self.table, x, y, x + x_size, y + y_size) == 0
+
+    def free_in_row(self, y, x_size, y_size):
+        # x of every free anchor in row y
+        below, above = self.table[y], self.table[y + y_size]
+        for x in range(self.game_map.width - x_size + 1):
+            if above[x + x_size] - below[x + x_size] - above[x] + below[x] == 0:
+                yield x
+
+    def counts(self, x_size, y_size):
+        self.refresh()
+        key = (x_size, y_size)
+        if key not in self.row_counts:
+            rows = max(self.game_map.height - y_size + 1, 0) if x_size <= self.game_map.width else 0
+            self.row_counts[key] = [sum(1 for _ in self.free_in_row(y, x_size, y_size)) for y in range(rows)]
+        return self.row_counts[key]
+
+    def anchor_count(self, x_size, y_size):
+        return sum(self.counts(x_size, y_size))
+
+    def anchors(self, x_size, y_size):
+        # every free anchor, row by row
+        for y, count in enumerate(self.counts(x_size, y_size)):
+            if count:
+                for x in self.free_in_row(y, x_size, y_size):
+                    yield Coordinates(x, y)
+
+    def random_anchor(self, x_size, y_size):
+        # uniform over the free anchors, or None if there are none
+        counts = self.counts(x_size, y_size)
+        total = sum(counts)
+        if not total:
+            return None
+        index = random.randrange(total)
+        for y, count in enumerate(counts):
+            if index >= count:
+                index -= count
+                continue
+            return Coordinates(next(itertools.islice(self.free_in_row(y, x_size, y_size), index, None)), y)
@@ -0,0 +1,53 @@
+import xlsxwriter
+from support_classes import *
+
+def export_to_excel(game_map, filename):
+    workbook = xlsxwriter.Workbook(filename)
+    worksheet = workbook.add_worksheet()
+    worksheet.set_column(0, game_map.width - 1, 3)
+
+    # Create a format cache to avoid duplicate formats
+    format_cache = {}
+
+    for alt_y in range(game_map.height): # we want low y to show up at the bottom...
+        y = game_map.height - 1 - alt_y
+        for x in range(game_map.width):
+            # Determine borders
+            borders = {}
+            # Check up
+            if y < game_map.height - 1:
+                if game_map.is_wall(Coordinates(x, y), Coordinates(x, y + 1)):
+                    borders['top'] = 2 # thick
+            if y > 0:
+                if game_map.is_wall(Coordinates(x, y), Coordinates(x, y - 1)):
+                    borders['bottom'] = 2
+            if x > 0:
+                if game_map.is_wall(Coordinates(x, y), Coordinates(x - 1, y)):
+                    borders['left'] = 2
+            if x < game_map.width - 1:
+                if game_map.is_wall(Coordinates(x, y), Coordinates(x + 1, y)):
+                    borders['right'] = 2
+            # Build format key
+            border_key = (borders.get('top', 0), borders.get('bottom', 0),
+                        borders.get('left', 0), borders.get('right', 0))
+
+            cell_type = game_map.get_cell(x, y)
+            cell_contents = game_map.get_cell_contents(x, y)
+            contents_key = cell_contents.label
+            fmt_key = (cell_type.color, border_key, contents_key)
+            if fmt_key not in format_cache:
+                fmt_dict = {'bg_color': cell_type.color}
+                if borders.get('top'): fmt_dict['top'] = borders['top']
+                if borders.get('bottom'): fmt_dict['bottom'] = borders['bottom']
+                if borders.get('left'): fmt_dict['left'] = borders['left']
+                if borders.get('right'): fmt_dict['right'] = borders['right']
+                fmt_dict['align'] = 'center'
+                fmt_dict['valign'] = 'vcenter'
+                if cell_contents.color: # empty cells have no symbol, and newer xlsxwriter rejects a None colour
+                    fmt_dict['font_color'] = cell_contents.color
+                format_cache[fmt_key] = workbook.add_format(fmt_dict)
+            cell_format = format_cache[fmt_key]
+
+            worksheet.write(alt_y, x, cell_contents.symbol, cell_format)
+
+    workbook.close()
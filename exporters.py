@@ -0,0 +1,18 @@
+import importlib
+
+# format name -> (module, function, file extension).  Modules are only imported when their format is used,
+# so workers that never write e.g. xlsx never pay for importing xlsxwriter.
+EXPORTERS = {
+    'bin': ('serialization', 'save_map', 'bin'),
+    'xlsx': ('excel_export', 'export_to_excel', 'xlsx'),
+    'png': ('render', 'export_png', 'png'),
+}
+
+def register_exporter(name, module_name, function_name, extension):
+    EXPORTERS[name] = (module_name, function_name, extension)
+
+def get_exporter(name):
+    if name not in EXPORTERS:
+        raise ValueError("Unknown export format: {} (known formats: {})".format(name, ', '.join(sorted(EXPORTERS))))
+    module_name, function_name, extension = EXPORTERS[name]
+    return getattr(importlib.import_module(module_name), function_name), extension
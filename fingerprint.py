@@ -0,0 +1,178 @@
+import hashlib
+import os
+import pickle
+import random
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from support_classes import *
+from derived import WallMaskCache
+from serialization import TERRAIN_INDEX, CONTENTS_INDEX
+
+# Near-duplicate detection for map corpora.  A map's features are its coarse terrain (which terrains cover a
+# good share of each block), where its shrines, items, gems, seals and boss sit (by block), and the wall layout
+# of the castle.  A MinHash signature of the feature set estimates Jaccard similarity between maps, and
+# SimilarityIndex buckets signatures by band (locality-sensitive hashing) so a query only looks at maps that
+# share a band.  Signatures are 32-bit per permutation and buckets hold plain ints, so the index stays compact
+# enough for millions of maps.  Features and band keys are hashed with blake2b rather than hash(), so a saved
+# index means the same on every interpreter.
+
+TERRAIN_BLOCK = 5
+TERRAIN_SHARE = 0.2       # a terrain counts in a block from this share of its cells
+CONTENTS_BLOCK = 5
+CASTLE_BLOCK = 3
+NUM_PERM = 64
+BANDS = 16
+MERSENNE_61 = (1 << 61) - 1
+FEATURE_MASK = (1 << 61) - 1
+INDEX_VERSION = 2  # version 1 used hash(), so its keys are not comparable
+
+TERRAIN_FEATURE, CONTENTS_FEATURE, CASTLE_FEATURE = 0, 1, 2
+
+def stable_hash(values):
+    # 64 bits of blake2b over the values packed as little-endian int64s
+    digest = hashlib.blake2b(struct.pack('<{}q'.format(len(values)), *values), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+def map_features(game_map):
+    features = set()
+    width, height = game_map.width, game_map.height
+
+    counts = {}
+    for y in range(height):
+        for x in range(width):
+            key = (x // TERRAIN_BLOCK, y // TERRAIN_BLOCK, TERRAIN_INDEX[game_map.cells[y][x]])
+            counts[key] = counts.get(key, 0) + 1
+    for (bx, by, terrain), count in counts.items():
+        block_area = (min(TERRAIN_BLOCK, width - bx * TERRAIN_BLOCK)) * (min(TERRAIN_BLOCK, height - by * TERRAIN_BLOCK))
+        if count >= TERRAIN_SHARE * block_area:
+            features.add(stable_hash((TERRAIN_FEATURE, bx, by, terrain)) & FEATURE_MASK)
+
+    walls = None
+    castle_masks = {}
+    for y in range(height):
+        for x in range(width):
+            contents = game_map.cell_contents[y][x]
+            if contents not in [CellContents.EMPTY, CellContents.FORCE_EMPTY]:
+                features.add(stable_hash((CONTENTS_FEATURE, CONTENTS_INDEX[contents], x // CONTENTS_BLOCK, y // CONTENTS_BLOCK)) & FEATURE_MASK)
+            if game_map.cells[y][x] == TerrType.CASTLE:
+                if walls is None:
+                    walls = WallMaskCache()
+                    walls.attach(game_map)
+                key = (x // CASTLE_BLOCK, y // CASTLE_BLOCK)
+                castle_masks[key] = castle_masks.get(key, 0) | walls.masks[y][x]
+    for (bx, by), mask in castle_masks.items():
+        features.add(stable_hash((CASTLE_FEATURE, bx, by, mask)) & FEATURE_MASK)
+    return features
+
+_permutations = {}
+
+def permutations(num_perm, seed=1):
+    if (num_perm, seed) not in _permutations:
+        rng = random.Random(seed)
+        _permutations[(num_perm, seed)] = [(rng.randrange(1, MERSENNE_61), rng.randrange(0, MERSENNE_61)) for _ in range(num_perm)]
+    return _permutations[(num_perm, seed)]
+
+def minhash(features, num_perm=NUM_PERM):
+    signature = array('I')
+    for a, b in permutations(num_perm):
+        signature.append(min(((a * f + b) % MERSENNE_61) & 0xffffffff for f in features) if features else 0xffffffff)
+    return signature
+
+def fingerprint(game_map, num_perm=NUM_PERM):
+    return minhash(map_features(game_map), num_perm)
+
+def similarity(signature_a, signature_b):
+    # estimated Jaccard similarity of the two maps' feature sets
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+class SimilarityIndex:
+    # bands * rows = signature length; two maps with similarity s share at least one band with probability
+    # 1 - (1 - s ** rows) ** bands, so 16 bands of 4 rows catch nearly every pair above 0.7 and few below 0.3
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm ({}) must be a multiple of bands ({})".format(num_perm, bands))
+        self.version = INDEX_VERSION
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def band_keys(self, signature):
+        rows = self.rows
+        return [stable_hash(signature[i * rows:(i + 1) * rows]) for i in range(self.bands)]
+
+    def add(self, key, signature):
+        if key in self.signatures:
+            raise ValueError("Map {} is already in the index".format(key))
+        self.signatures[key] = signature
+        for bucket, band_key in zip(self.buckets, self.band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def candidates(self, signature):
+        found = set()
+        for bucket, band_key in zip(self.buckets, self.band_keys(signature)):
+            found.update(bucket.get(band_key, ()))
+        return found
+
+    def query(self, signature, threshold=0.8):
+        # [(key, similarity)] for indexed maps at or above threshold, most similar first
+        matches = []
+        for key in self.candidates(signature):
+            score = similarity(signature, self.signatures[key])
+            if score >= threshold:
+                matches.append((key, score))
+        matches.sort(key=lambda match: -match[1])
+        return matches
+
+    def add_unless_duplicate(self, key, signature, threshold=0.8):
+        # returns (closest near-duplicate key, similarity), or None after adding the map as a new layout
+        matches = self.query(signature, threshold)
+        if matches:
+            return matches[0]
+        self.add(key, signature)
+        return None
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as f:
+            index = pickle.load(f)
+        if getattr(index, 'version', 1) != INDEX_VERSION:
+            raise ValueError("{} was built by an older version of the similarity index; rebuild it".format(filename))
+        return index
+
+def fingerprint_seed(task):
+    from generation import generate_seeded_map
+    seed, width, height, config, num_perm = task
+    return seed, fingerprint(generate_seeded_map(seed, width, height, config), num_perm)
+
+def fingerprint_file(task):
+    from serialization import load_map
+    filename, num_perm = task
+    return filename, fingerprint(load_map(filename), num_perm)
+
+def iter_fingerprints(tasks, worker=fingerprint_seed, max_workers=None):
+    # (key, signature) in task order; tasks may be an unbounded generator
+    from generation import bounded_map
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from bounded_map(executor, worker, tasks, 4 * workers)
+
+def group_near_duplicates(keyed_signatures, index=None, threshold=0.8):
+    # one row per map: the first map of each layout is kept, later near-duplicates point at it
+    index = index if index is not None else SimilarityIndex()
+    for key, signature in keyed_signatures:
+        match = index.add_unless_duplicate(key, signature, threshold)
+        if match is None:
+            yield {'map': key, 'duplicate_of': None, 'similarity': None}
+        else:
+            yield {'map': key, 'duplicate_of': match[0], 'similarity': match[1]}
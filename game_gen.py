@@ -0,0 +1,228 @@
+import argparse
+import os
+import sys
+import time
+
+from config import GenerationConfig
+from exporters import EXPORTERS, get_exporter
+
+def parse_seeds(spec):
+    # "42", "42-45" and "1,5,10-12" are all accepted; ranges are inclusive
+    seeds = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part[1:]:
+            start, end = part[1:].split('-', 1)
+            seeds.extend(range(int(part[0] + start), int(end) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+def parse_overrides(pairs, hazards=False):
+    # --set building_density_max=0.12 style overrides; --hazards is short for --set hazards=true
+    overrides = dict(pair.partition('=')[::2] for pair in pairs)
+    if hazards:
+        overrides['hazards'] = 'true'
+    return GenerationConfig.from_strings(overrides)
+
+def generate(args):
+    from generation import iter_maps
+    config = parse_overrides(args.set, args.hazards)
+    seeds = parse_seeds(args.seeds)
+    os.makedirs(args.out_dir, exist_ok=True)
+    if args.format == 'bin':
+        export, extension = None, EXPORTERS['bin'][2]
+    else:
+        export, extension = get_exporter(args.format)
+        from serialization import map_from_bytes
+
+    if args.tile_size:
+        # very large maps: one map at a time, its tiles spread over the workers
+        from chunked import generate_chunked_map
+        from serialization import map_to_bytes
+        maps = (map_to_bytes(generate_chunked_map(seed, args.width, args.height, config, args.tile_size, args.margin, args.workers)) for seed in seeds)
+    else:
+        maps = iter_maps(seeds, args.width, args.height, config, prefetch=args.prefetch, serialized=True, max_workers=args.workers)
+
+    start = time.time()
+    for seed, data in zip(seeds, maps):
+        filename = os.path.join(args.out_dir, 'game_map_{}.{}'.format(seed, extension))
+        if export is None:
+            with open(filename, 'wb') as f:
+                f.write(data)
+        else:
+            export(map_from_bytes(data, config), filename)
+        if not args.quiet:
+            print(f"Map {seed} exported to '{filename}'.")
+    print(f"Generated {len(seeds)} maps of {args.width}x{args.height} in {time.time() - start:.1f}s.", file=sys.stderr)
+
+def contact_sheet(args):
+    from render import write_contact_sheet
+    if args.inputs:
+        from serialization import load_map
+        maps = (load_map(filename) for filename in args.inputs)
+    else:
+        from generation import iter_maps
+        maps = iter_maps(parse_seeds(args.seeds), args.width, args.height, parse_overrides(args.set, args.hazards), prefetch=args.prefetch, max_workers=args.workers)
+    start = time.time()
+    write_contact_sheet(maps, args.out, args.width, args.height, columns=args.columns, tile_size=args.tile_size)
+    print(f"Contact sheet written to '{args.out}' in {time.time() - start:.1f}s.", file=sys.stderr)
+
+def glitches(args):
+    from glitches import analyze_corpus, analyze_seed, analyze_file
+    start = time.time()
+    if args.inputs:
+        analyze_corpus(args.inputs, args.out, analyze=analyze_file, max_workers=args.workers)
+    else:
+        config = parse_overrides(args.set, args.hazards)
+        tasks = ((seed, args.width, args.height, config) for seed in parse_seeds(args.seeds))
+        analyze_corpus(tasks, args.out, analyze=analyze_seed, max_workers=args.workers)
+    print(f"Glitch analysis took {time.time() - start:.1f}s.", file=sys.stderr)
+
+def stats(args):
+    from corpus_stats import summarize_corpus, measure_seed, measure_file
+    start = time.time()
+    if args.inputs:
+        summarize_corpus(args.inputs, args.out, measure=measure_file, rows_filename=args.rows, max_workers=args.workers)
+    else:
+        config = parse_overrides(args.set, args.hazards)
+        tasks = ((seed, args.width, args.height, config) for seed in parse_seeds(args.seeds))
+        summarize_corpus(tasks, args.out, measure=measure_seed, rows_filename=args.rows, max_workers=args.workers)
+    print(f"Corpus statistics took {time.time() - start:.1f}s.", file=sys.stderr)
+
+def dedupe(args):
+    import metrics
+    from fingerprint import SimilarityIndex, iter_fingerprints, fingerprint_seed, fingerprint_file, group_near_duplicates
+    index = SimilarityIndex.load(args.index) if args.index and os.path.exists(args.index) else SimilarityIndex()
+    if args.inputs:
+        signatures = iter_fingerprints(((filename, index.num_perm) for filename in args.inputs), fingerprint_file, args.workers)
+    else:
+        config = parse_overrides(args.set, args.hazards)
+        tasks = ((seed, args.width, args.height, config, index.num_perm) for seed in parse_seeds(args.seeds))
+        signatures = iter_fingerprints(tasks, fingerprint_seed, args.workers)
+    start = time.time()
+    rows = list(group_near_duplicates(signatures, index, args.threshold))
+    metrics.write_columns(rows, args.out)
+    if args.index:
+        index.save(args.index)
+    duplicates = sum(1 for row in rows if row['duplicate_of'] is not None)
+    print(f"{duplicates} of {len(rows)} maps are near-duplicates; written to '{args.out}' in {time.time() - start:.1f}s.", file=sys.stderr)
+
+def import_xlsx(args):
+    from xlsx_import import convert_archive
+    start = time.time()
+    converted = convert_archive(args.inputs, args.out_dir, max_workers=args.workers, force=args.force)
+    print(f"Converted {len(converted)} of {len(args.inputs)} workbooks into '{args.out_dir}' in {time.time() - start:.1f}s.", file=sys.stderr)
+
+def parse_size(spec):
+    width, _, height = spec.partition('x')
+    return int(width), int(height or width)
+
+def serve(args):
+    import asyncio
+    from pool_service import MapPoolService
+    service = MapPoolService(depth=args.depth, workers=args.workers, refill_concurrency=args.refill_concurrency, base_seed=args.base_seed)
+    try:
+        asyncio.run(service.serve(args.host, args.port, warm=[parse_size(size) for size in args.warm]))
+    except KeyboardInterrupt:
+        pass
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='game_gen')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', help='generate maps without any GUI')
+    gen.add_argument('--seeds', required=True, help='seeds, e.g. 42-44 or 1,5,10-12')
+    gen.add_argument('--width', type=int, default=50)
+    gen.add_argument('--height', type=int, default=50)
+    gen.add_argument('--format', default='bin', choices=sorted(EXPORTERS))
+    gen.add_argument('--out-dir', default='maps')
+    gen.add_argument('--prefetch', type=int, default=0, help='maps to generate ahead in worker processes (0 = in process)')
+    gen.add_argument('--workers', type=int, default=None)
+    gen.add_argument('--set', action='append', default=[], metavar='FIELD=VALUE', help='override a GenerationConfig field')
+    gen.add_argument('--hazards', action='store_true', help='place sawblades and lava snakes')
+    gen.add_argument('--tile-size', type=int, default=None, help='generate each map in tiles of this size (for very large maps)')
+    gen.add_argument('--margin', type=int, default=8, help='cells around each tile that its lava and forests may spill into')
+    gen.add_argument('--quiet', action='store_true')
+    gen.set_defaults(func=generate)
+
+    sheet = subparsers.add_parser('contact-sheet', help='render many maps as thumbnails on one PNG')
+    source = sheet.add_mutually_exclusive_group(required=True)
+    source.add_argument('--seeds', help='generate these seeds, e.g. 42-141')
+    source.add_argument('--inputs', nargs='+', help='serialized .bin maps (or exported .xlsx) to render')
+    sheet.add_argument('--width', type=int, default=50, help='map width in cells (the largest, for --inputs)')
+    sheet.add_argument('--height', type=int, default=50, help='map height in cells (the largest, for --inputs)')
+    sheet.add_argument('--columns', type=int, default=10)
+    sheet.add_argument('--tile-size', type=int, default=2, help='pixels per cell')
+    sheet.add_argument('--out', default='contact_sheet.png')
+    sheet.add_argument('--prefetch', type=int, default=0)
+    sheet.add_argument('--workers', type=int, default=None)
+    sheet.add_argument('--set', action='append', default=[], metavar='FIELD=VALUE', help='override a GenerationConfig field')
+    sheet.add_argument('--hazards', action='store_true', help='place sawblades and lava snakes')
+    sheet.set_defaults(func=contact_sheet)
+
+    glitch = subparsers.add_parser('glitches', help='measure how much corner clips and shrinewarp momentum shorten routes')
+    source = glitch.add_mutually_exclusive_group(required=True)
+    source.add_argument('--seeds', help='generate and analyze these seeds, e.g. 1-500')
+    source.add_argument('--inputs', nargs='+', help='serialized .bin maps (or exported .xlsx) to analyze')
+    glitch.add_argument('--width', type=int, default=50)
+    glitch.add_argument('--height', type=int, default=50)
+    glitch.add_argument('--out', default='glitches.csv', help='.csv, or .parquet if pyarrow is installed')
+    glitch.add_argument('--workers', type=int, default=None)
+    glitch.add_argument('--set', action='append', default=[], metavar='FIELD=VALUE', help='override a GenerationConfig field')
+    glitch.add_argument('--hazards', action='store_true', help='place sawblades and lava snakes')
+    glitch.set_defaults(func=glitches)
+
+    stat = subparsers.add_parser('stats', help='summarize metrics over a corpus with histograms and quantiles')
+    source = stat.add_mutually_exclusive_group(required=True)
+    source.add_argument('--seeds', help='generate and measure these seeds, e.g. 1-10000')
+    source.add_argument('--inputs', nargs='+', help='serialized .bin maps (or exported .xlsx) to measure')
+    stat.add_argument('--width', type=int, default=50)
+    stat.add_argument('--height', type=int, default=50)
+    stat.add_argument('--out', default='corpus_stats.csv', help='one row per metric; histograms go to <out>_histograms')
+    stat.add_argument('--rows', default=None, help='also stream one row per map to this .csv or .parquet file')
+    stat.add_argument('--workers', type=int, default=None)
+    stat.add_argument('--set', action='append', default=[], metavar='FIELD=VALUE', help='override a GenerationConfig field')
+    stat.add_argument('--hazards', action='store_true', help='place sawblades and lava snakes')
+    stat.set_defaults(func=stats)
+
+    dup = subparsers.add_parser('dedupe', help='find near-duplicate layouts by MinHash fingerprint')
+    source = dup.add_mutually_exclusive_group(required=True)
+    source.add_argument('--seeds', help='generate and fingerprint these seeds, e.g. 1-10000')
+    source.add_argument('--inputs', nargs='+', help='serialized .bin maps (or exported .xlsx) to fingerprint')
+    dup.add_argument('--width', type=int, default=50)
+    dup.add_argument('--height', type=int, default=50)
+    dup.add_argument('--threshold', type=float, default=0.8, help='estimated similarity at which maps count as duplicates')
+    dup.add_argument('--index', default=None, help='similarity index file to extend across runs')
+    dup.add_argument('--out', default='duplicates.csv')
+    dup.add_argument('--workers', type=int, default=None)
+    dup.add_argument('--set', action='append', default=[], metavar='FIELD=VALUE', help='override a GenerationConfig field')
+    dup.add_argument('--hazards', action='store_true', help='place sawblades and lava snakes')
+    dup.set_defaults(func=dedupe)
+
+    xlsx = subparsers.add_parser('import-xlsx', help='convert exported .xlsx maps back into .bin maps')
+    xlsx.add_argument('--inputs', nargs='+', required=True, help='workbooks written by the xlsx exporter')
+    xlsx.add_argument('--out-dir', default='maps')
+    xlsx.add_argument('--workers', type=int, default=None)
+    xlsx.add_argument('--force', action='store_true', help='replace .bin files already in --out-dir')
+    xlsx.set_defaults(func=import_xlsx)
+
+    pool = subparsers.add_parser('serve', help='serve pre-generated maps from a warm pool over local HTTP')
+    pool.add_argument('--host', default='127.0.0.1')
+    pool.add_argument('--port', type=int, default=8765)
+    pool.add_argument('--depth', type=int, default=8, help='maps kept ready per (size, config)')
+    pool.add_argument('--workers', type=int, default=None)
+    pool.add_argument('--refill-concurrency', type=int, default=2, help='maps generated at once per pool')
+    pool.add_argument('--base-seed', type=int, default=None, help='repeat an earlier run (default: random)')
+    pool.add_argument('--warm', action='append', default=[], metavar='WIDTHxHEIGHT', help='start filling this pool immediately')
+    pool.set_defaults(func=serve)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
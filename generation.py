@@ -0,0 +1,52 @@
+import contextlib
+import io
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from map import Map
+from serialization import map_to_bytes, map_from_bytes
+
+def generate_seeded_map(seed, width, height, config=None, quiet=True):
+    random.seed(seed)
+    game_map = Map(width, height, config)
+    if quiet:
+        with contextlib.redirect_stdout(io.StringIO()):
+            game_map.generate_map()
+    else:
+        game_map.generate_map()
+    return game_map
+
+def generate_map_bytes(task):
+    seed, width, height, config = task
+    return map_to_bytes(generate_seeded_map(seed, width, height, config))
+
+def bounded_map(executor, fn, iterable, window):
+    # like executor.map, but pulls from iterable lazily and keeps at most `window` tasks in flight
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def iter_maps(seeds, width, height, config=None, prefetch=0, serialized=False, max_workers=None):
+    # seeds may be any iterable, including an unbounded one; only `prefetch` maps are held ahead of the consumer
+    if prefetch <= 0:
+        for seed in seeds:
+            game_map = generate_seeded_map(seed, width, height, config)
+            yield map_to_bytes(game_map) if serialized else game_map
+        return
+
+    tasks = ((seed, width, height, config) for seed in seeds)
+    executor = ProcessPoolExecutor(max_workers=max_workers or prefetch)
+    try:
+        for data in bounded_map(executor, generate_map_bytes, tasks, prefetch):
+            yield data if serialized else map_from_bytes(data, config)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,208 @@
+import heapq
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from support_classes import *
+from derived import NEIGHBOR_OFFSETS
+from generation import bounded_map
+import metrics
+
+# Glitch impact analysis (see the GLITCHES section of `rules`).  Each map gets an index of every usable corner
+# clip and every shrinewarp-momentum landing cell, then shortest paths between points of interest are measured
+# with and without each glitch.  Costs are in half-turns, since a turn moves up to 2 spaces: a step is 1, a corner
+# clip takes the whole turn (2), a shrine warp takes 4 turns (8).  Results are reported in turns.
+#
+# The player is assumed to carry the boots, shield and cloak, so only trees (and walls) block; pass
+# blocking_terrain_types to model an earlier point in the run.
+
+STEP_COST = 1
+CLIP_COST = 2
+WARP_COST = 8
+MOMENTUM_OFFSET = 3
+
+POINT_OF_INTEREST_CONTENTS = [
+    CellContents.SHRINE, CellContents.SEAL, CellContents.BOSS, CellContents.GEM, CellContents.ITEM,
+    CellContents.DESERT_CLOAK, CellContents.WATER_BOOTS, CellContents.FIRE_SHIELD, CellContents.BOW,
+    CellContents.BLESSING, CellContents.AXE,
+]
+OCCUPIED_CONTENTS = [CellContents.OGRE, CellContents.BOSS] # a corner clip cannot land on these
+
+# variant: (corner clips, shrine warps, warp momentum)
+VARIANTS = {
+    'walk': (False, False, False),
+    'warp': (False, True, False),
+    'corner_clip': (True, False, False),
+    'shrinewarp': (False, True, True),
+    'all': (True, True, True),
+}
+# (glitch variant, the variant it is measured against); shrinewarp needs the Blessing, so it is compared with plain warps
+COMPARISONS = [('corner_clip', 'walk'), ('shrinewarp', 'warp'), ('all', 'warp')]
+
+class GlitchIndex:
+    def __init__(self, game_map, blocking_terrain_types=(TerrType.TREE,)):
+        self.game_map = game_map
+        self.blocking_terrain_types = set(blocking_terrain_types)
+        self.steps = self.index_steps()
+        self.corner_clips = self.index_corner_clips()
+        self.shrines = self.find_contents([CellContents.SHRINE])
+        self.warp_landings = self.index_warp_landings()
+        self.points_of_interest = self.find_contents(POINT_OF_INTEREST_CONTENTS)
+        self.start = metrics.spawn_shrine(self.shrines)
+        bosses = self.find_contents([CellContents.BOSS])
+        self.boss = bosses[0] if bosses else None
+        self.extra_edges = {}
+
+    def cell_id(self, coord):
+        return coord.y * self.game_map.width + coord.x
+
+    def passable(self, coord):
+        return self.game_map.is_valid_coordinates(coord) and self.game_map.get_cell(coord.x, coord.y) not in self.blocking_terrain_types
+
+    def find_contents(self, contents_types):
+        game_map = self.game_map
+        return [Coordinates(x, y) for y in range(game_map.height) for x in range(game_map.width) if game_map.get_cell_contents(x, y) in contents_types]
+
+    def index_steps(self):
+        # walking neighbours of every cell, by cell id
+        game_map = self.game_map
+        steps = [[] for _ in range(game_map.width * game_map.height)]
+        for y in range(game_map.height):
+            for x in range(game_map.width):
+                current = Coordinates(x, y)
+                if not self.passable(current):
+                    continue
+                for dx, dy in NEIGHBOR_OFFSETS:
+                    neighbor = Coordinates(x + dx, y + dy)
+                    if self.passable(neighbor) and not game_map.is_wall(current, neighbor):
+                        steps[self.cell_id(current)].append(self.cell_id(neighbor))
+        return steps
+
+    def index_corner_clips(self):
+        # (position, corner tile) pairs: standing diagonally outside a wall corner, with walls on both edges of the
+        # corner tile that face you, you can clip into that tile if it is free
+        game_map = self.game_map
+        clips = []
+        for y in range(game_map.height):
+            for x in range(game_map.width):
+                position = Coordinates(x, y)
+                if not self.passable(position):
+                    continue
+                for dx in [-1, 1]:
+                    for dy in [-1, 1]:
+                        corner = Coordinates(x + dx, y + dy)
+                        if not self.passable(corner) or game_map.get_cell_contents(corner.x, corner.y) in OCCUPIED_CONTENTS:
+                            continue
+                        if game_map.is_wall(corner, Coordinates(x + dx, y)) and game_map.is_wall(corner, Coordinates(x, y + dy)):
+                            clips.append((position, corner))
+        return clips
+
+    def index_warp_landings(self):
+        # where momentum through a warp to each shrine can land you
+        landings = {}
+        for shrine in self.shrines:
+            offsets = [Coordinates(shrine.x + dx * MOMENTUM_OFFSET, shrine.y + dy * MOMENTUM_OFFSET) for dx, dy in NEIGHBOR_OFFSETS]
+            landings[shrine] = [c for c in offsets if self.passable(c)]
+        return landings
+
+    def edges_for(self, variant):
+        # non-walking moves the variant allows, by cell id: {from: [(to, cost)]}
+        if variant not in self.extra_edges:
+            clips, warps, momentum = VARIANTS[variant]
+            edges = {}
+            if clips:
+                for position, corner in self.corner_clips:
+                    edges.setdefault(self.cell_id(position), []).append((self.cell_id(corner), CLIP_COST))
+            if warps:
+                for source in self.shrines:
+                    for target in self.shrines:
+                        if target == source:
+                            continue
+                        edges.setdefault(self.cell_id(source), []).append((self.cell_id(target), WARP_COST))
+                        if momentum:
+                            for landing in self.warp_landings[target]:
+                                edges.setdefault(self.cell_id(source), []).append((self.cell_id(landing), WARP_COST))
+            self.extra_edges[variant] = edges
+        return self.extra_edges[variant]
+
+    def shortest_paths(self, source, variant):
+        # Dijkstra from source; returns {cell id: cost in half-turns} for every reachable cell
+        edges = self.edges_for(variant)
+        source_id = self.cell_id(source)
+        best = {source_id: 0}
+        heap = [(0, source_id)]
+        while heap:
+            cost, cell = heapq.heappop(heap)
+            if cost > best[cell]:
+                continue
+            moves = [(n, STEP_COST) for n in self.steps[cell]] + edges.get(cell, [])
+            for neighbor, move_cost in moves:
+                if cost + move_cost < best.get(neighbor, float('inf')):
+                    best[neighbor] = cost + move_cost
+                    heapq.heappush(heap, (cost + move_cost, neighbor))
+        return best
+
+    def point_distances(self, variant):
+        # [i][j]: half-turns from point of interest i to point of interest j
+        targets = [self.cell_id(c) for c in self.points_of_interest]
+        distances = []
+        for source in self.points_of_interest:
+            best = self.shortest_paths(source, variant)
+            distances.append([best.get(t, float('inf')) for t in targets])
+        return distances
+
+def glitch_impact(game_map, blocking_terrain_types=(TerrType.TREE,)):
+    index = GlitchIndex(game_map, blocking_terrain_types)
+    row = {
+        'corner_clips': len(index.corner_clips),
+        'warp_landings': sum(len(landings) for landings in index.warp_landings.values()),
+        'points_of_interest': len(index.points_of_interest),
+    }
+    distances = {variant: index.point_distances(variant) for variant in VARIANTS}
+    count = len(index.points_of_interest)
+    for glitch, baseline in COMPARISONS:
+        savings = []
+        newly_reachable = 0
+        reachable_pairs = 0
+        for i in range(count):
+            for j in range(count):
+                if i == j:
+                    continue
+                before, after = distances[baseline][i][j], distances[glitch][i][j]
+                if before == float('inf'):
+                    newly_reachable += after != float('inf')
+                    continue
+                reachable_pairs += 1
+                if after < before:
+                    savings.append((before - after) / 2)
+        row['{}_pairs_shortened'.format(glitch)] = len(savings)
+        row['{}_share_shortened'.format(glitch)] = len(savings) / reachable_pairs if reachable_pairs else None
+        row['{}_mean_saving'.format(glitch)] = sum(savings) / len(savings) if savings else None
+        row['{}_max_saving'.format(glitch)] = max(savings) if savings else None
+        row['{}_newly_reachable'.format(glitch)] = newly_reachable
+    # the headline route: spawn shrine to the boss
+    for variant in VARIANTS:
+        cost = None
+        if index.start is not None and index.boss is not None:
+            cost = index.shortest_paths(index.start, variant).get(index.cell_id(index.boss))
+        row['start_to_boss_{}'.format(variant)] = cost / 2 if cost is not None else None
+    return row
+
+def analyze_seed(task):
+    return metrics.seed_row(glitch_impact, task)
+
+def analyze_file(filename):
+    return metrics.file_row(glitch_impact, filename)
+
+def analyze_corpus(tasks, filename, analyze=analyze_seed, max_workers=None):
+    # tasks are (seed, width, height, config) for analyze_seed or .bin filenames for analyze_file
+    rows = []
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for row in bounded_map(executor, analyze, tasks, 4 * workers):
+            rows.append(row)
+            if row['error']:
+                print('Map {} failed: {}'.format(row.get('seed', row.get('file')), row['error']), file=sys.stderr)
+    metrics.write_columns(rows, filename)
+    print(f"Wrote glitch impact for {len(rows)} maps to '{filename}'.")
+    return rows
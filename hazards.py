@@ -0,0 +1,90 @@
+from support_classes import *
+from derived import DerivedCache, NEIGHBOR_OFFSETS
+
+# Lookup tables for the moving and aiming hazards in `rules`, so a search or simulation asks "is there a
+# sawblade here at time t?" or "which snakes can breathe on this cell?" with a dictionary lookup.
+#
+# A sawblade's path lists the cells it visits over one period; it moves one step per turn and wraps round, so
+# at time t it is on path[t % period].  A lava snake aims along a row or column at a player within SNAKE_RANGE
+# cells and breathes there next turn; its line of fire stops at walls and trees.
+
+SNAKE_RANGE = 5
+SAWBLADE_TERRAIN = [TerrType.GRASS, TerrType.DESERT, TerrType.BUILDING, TerrType.CASTLE, TerrType.ROAD]
+
+def back_and_forth(cells):
+    # a corridor run out and back: [a, b, c, d] -> [a, b, c, d, c, b]
+    return list(cells) + list(reversed(cells[1:-1]))
+
+def rectangle_loop(min_x, min_y, max_x, max_y):
+    # the border cells of a rectangle, clockwise from the bottom-left corner (inclusive bounds)
+    loop = [Coordinates(min_x, y) for y in range(min_y, max_y + 1)]
+    loop += [Coordinates(x, max_y) for x in range(min_x + 1, max_x + 1)]
+    loop += [Coordinates(max_x, y) for y in range(max_y - 1, min_y - 1, -1)]
+    loop += [Coordinates(x, min_y) for x in range(max_x - 1, min_x, -1)]
+    return loop
+
+class HazardTables(DerivedCache):
+    # registered through Map.hazard_tables(); rebuilt whenever a hazard, or a wall or tree near one, changes
+    def rebuild(self):
+        game_map = self.game_map
+        width = game_map.width
+
+        # sawblades: where each one is at t mod its period, and which blades pass each cell and when
+        self.sawblade_cells = [[c.y * width + c.x for c in path] for path in game_map.sawblades]
+        self.sawblade_passes = {}  # cell id -> [(blade, period, bitmask of t mod period)]
+        for blade, cells in enumerate(self.sawblade_cells):
+            masks = {}
+            for t, cell in enumerate(cells):
+                masks[cell] = masks.get(cell, 0) | (1 << t)
+            for cell, mask in masks.items():
+                self.sawblade_passes.setdefault(cell, []).append((blade, len(cells), mask))
+
+        # lava snakes: one bitmap per snake and direction (bit k - 1 set if the cell k away is in the line of fire),
+        # and the reverse lookup from a cell to the (snake, direction, distance) that threaten it
+        self.snake_rays = []
+        self.snake_threats = {}  # cell id -> [(snake, direction, distance)]
+        for snake, position in enumerate(game_map.lava_snakes):
+            rays = []
+            for direction, (dx, dy) in enumerate(NEIGHBOR_OFFSETS):
+                bitmap = 0
+                current = position
+                for distance in range(1, SNAKE_RANGE + 1):
+                    target = Coordinates(current.x + dx, current.y + dy)
+                    if not game_map.is_valid_coordinates(target) or game_map.is_wall(current, target) or game_map.get_cell(target.x, target.y) == TerrType.TREE:
+                        break
+                    bitmap |= 1 << (distance - 1)
+                    self.snake_threats.setdefault(target.y * width + target.x, []).append((snake, direction, distance))
+                    current = target
+                rays.append(bitmap)
+            self.snake_rays.append(rays)
+
+    def sawblade_position(self, blade, t):
+        cell = self.sawblade_cells[blade][t % len(self.sawblade_cells[blade])]
+        return Coordinates(cell % self.game_map.width, cell // self.game_map.width)
+
+    def sawblade_move(self, blade, t):
+        # (from, to) for the step the blade takes into turn t, e.g. for the direction of its knockback
+        return self.sawblade_position(blade, t - 1), self.sawblade_position(blade, t)
+
+    def sawblades_at(self, x, y, t):
+        self.refresh()
+        return [blade for blade, period, mask in self.sawblade_passes.get(y * self.game_map.width + x, ()) if mask >> (t % period) & 1]
+
+    def has_sawblade(self, x, y, t):
+        self.refresh()
+        return any(mask >> (t % period) & 1 for blade, period, mask in self.sawblade_passes.get(y * self.game_map.width + x, ()))
+
+    def snake_threats_at(self, x, y):
+        # [(snake, direction, distance)] for every snake that can aim at this cell
+        self.refresh()
+        return self.snake_threats.get(y * self.game_map.width + x, [])
+
+    def in_line_of_fire(self, snake, direction, x, y):
+        # would snake's breath, aimed in direction, hit this cell?
+        self.refresh()
+        position = self.game_map.lava_snakes[snake]
+        dx, dy = NEIGHBOR_OFFSETS[direction]
+        distance = (x - position.x) * dx + (y - position.y) * dy
+        if distance < 1 or distance > SNAKE_RANGE or (x, y) != (position.x + dx * distance, position.y + dy * distance):
+            return False
+        return bool(self.snake_rays[snake][direction] >> (distance - 1) & 1)
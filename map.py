@@ -1,25 +1,102 @@
-import xlsxwriter
 from enum import Enum
 import math
 import random
 import os
 from support_classes import *
 from vaults import vaults
+from config import GenerationConfig
+from transaction import Transaction
+from derived import DistanceToTerrainCache, OccupancyIndex, ReachabilityCache, IslandCache
+from hazards import HazardTables, SAWBLADE_TERRAIN, back_and_forth, rectangle_loop
 import itertools
+from collections import deque
+
+BUILDING_BLOCKING_TERRAIN = [TerrType.BUILDING, TerrType.CASTLE, TerrType.WATER]
 
 class Map:
-    def __init__(self, width, height):
+    def __init__(self, width, height, config=None):
         self.width = width
         self.height = height
+        self.config = config if config is not None else GenerationConfig()
         self.cells = [[TerrType.GRASS for _ in range(width)] for _ in range(height)]
         self.room_numbers = [[0 for _ in range(width)] for _ in range(height)]
         self.cell_contents = [[CellContents.EMPTY for _ in range(width)] for _ in range(height)]
         self.next_room_number = 1
         self.doors = []
         self.forced_walls = []  # walls in addition to the usual ones around buildings or rooms
+        self.door_edges = set()  # both orientations of every door and forced wall, for constant-time lookups
+        self.forced_wall_edges = set()
+        self.retry_counts = {}  # stage name -> number of rejected attempts, for tuning
+        self.derived_caches = []  # see derived.py; told about every cell, room, door and wall change
+        self.journal = None  # undo entries while a transaction is open, see transaction.py
+        self.sawblades = []  # each a list of the cells the blade visits over one period, see hazards.py
+        self.lava_snakes = []
+        self.hazards = None
+        self.kept_caches = {}  # reachability caches, kept registered once something has asked for them
+
+    def record_retry(self, stage):
+        self.retry_counts[stage] = self.retry_counts.get(stage, 0) + 1
+
+    def register_cache(self, cache):
+        cache.attach(self)
+        self.derived_caches.append(cache)
+        return cache
+
+    def unregister_cache(self, cache):
+        self.derived_caches.remove(cache)
+
+    def mark_dirty(self, x, y):
+        for cache in self.derived_caches:
+            cache.mark_dirty(x, y)
+
+    def index_edges(self):
+        # rebuild the lookup sets after self.doors / self.forced_walls were assigned directly (e.g. by a loader)
+        self.door_edges = {e for c1, c2 in self.doors for e in ((c1, c2), (c2, c1))}
+        self.forced_wall_edges = {e for c1, c2 in self.forced_walls for e in ((c1, c2), (c2, c1))}
+        for cache in self.derived_caches:
+            cache.attach(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def undo(self, journal):
+        # apply the journal's inverse edits newest first; the undo itself is not journaled
+        saved_journal = self.journal
+        self.journal = None
+        for entry in reversed(journal):
+            kind = entry[0]
+            if kind == 'cell':
+                self.set_cell(entry[1], entry[2], entry[3])
+            elif kind == 'contents':
+                self.set_cell_contents(entry[1], entry[2], entry[3])
+            elif kind == 'room':
+                self.set_room_number(entry[1], entry[2], entry[3])
+            elif kind == 'next_room':
+                self.next_room_number = entry[1]
+            elif kind == 'sawblade':
+                for coord in self.sawblades.pop():
+                    self.mark_dirty(coord.x, coord.y)
+            elif kind == 'lava_snake':
+                coord = self.lava_snakes.pop()
+                self.mark_dirty(coord.x, coord.y)
+            elif kind in ('door', 'wall'):
+                edges, edge_set = (self.doors, self.door_edges) if kind == 'door' else (self.forced_walls, self.forced_wall_edges)
+                coord1, coord2 = edges.pop()
+                edge_set.difference_update(((coord1, coord2), (coord2, coord1)))
+                if self.derived_caches:
+                    self.mark_dirty(coord1.x, coord1.y)
+                    self.mark_dirty(coord2.x, coord2.y)
+            else:
+                raise ValueError("Invalid journal entry: {}".format(entry))
+        del journal[:]
+        self.journal = saved_journal
 
     def set_cell(self, x, y, value):
         if 0 <= x < self.width and 0 <= y < self.height:
+            if self.journal is not None:
+                self.journal.append(('cell', x, y, self.cells[y][x]))
+            if self.derived_caches and self.cells[y][x] != value:
+                self.mark_dirty(x, y)
             self.cells[y][x] = value
 
     def get_cell(self, x, y):
@@ -29,6 +106,10 @@ class Map:
     
     def set_cell_contents(self, x, y, value):
         if 0 <= x < self.width and 0 <= y < self.height:
+            if self.journal is not None:
+                self.journal.append(('contents', x, y, self.cell_contents[y][x]))
+            if self.derived_caches and self.cell_contents[y][x] != value:
+                self.mark_dirty(x, y)
             self.cell_contents[y][x] = value
     
     def get_cell_contents(self, x, y):
@@ -43,6 +124,10 @@ class Map:
     
     def set_room_number(self, x, y, room_number):
         if 0 <= x < self.width and 0 <= y < self.height:
+            if self.journal is not None:
+                self.journal.append(('room', x, y, self.room_numbers[y][x]))
+            if self.derived_caches and self.room_numbers[y][x] != room_number:
+                self.mark_dirty(x, y)
             self.room_numbers[y][x] = room_number
     
     def get_room_contents(self, room_number):
@@ -54,14 +139,29 @@ class Map:
         return contents
 
     def add_door(self, coord1, coord2):
+        # True if there is a door between the two cells afterwards; off-map and forced-wall edges are refused
         if self.is_valid_coordinates(coord1) and self.is_valid_coordinates(coord2) and not self.is_forced_wall(coord1, coord2):
             if not self.is_door(coord1, coord2):
                 self.doors.append((coord1, coord2))
+                self.door_edges.update(((coord1, coord2), (coord2, coord1)))
+                if self.journal is not None:
+                    self.journal.append(('door',))
+                if self.derived_caches:
+                    self.mark_dirty(coord1.x, coord1.y)
+                    self.mark_dirty(coord2.x, coord2.y)
+            return True
+        return False
     
     def add_forced_wall(self, coord1, coord2):
         if self.is_valid_coordinates(coord1) and self.is_valid_coordinates(coord2):
             if not self.is_forced_wall(coord1, coord2):
                 self.forced_walls.append((coord1, coord2))
+                self.forced_wall_edges.update(((coord1, coord2), (coord2, coord1)))
+                if self.journal is not None:
+                    self.journal.append(('wall',))
+                if self.derived_caches:
+                    self.mark_dirty(coord1.x, coord1.y)
+                    self.mark_dirty(coord2.x, coord2.y)
             assert not self.is_door(coord1, coord2), "Forced wall cannot be a door: {} to {}".format(coord1, coord2)
 
     def add_room(self, contents, terr_type=TerrType.BUILDING):
@@ -69,13 +169,51 @@ class Map:
             if self.is_valid_coordinates(coord):
                 self.set_room_number(coord.x, coord.y, self.next_room_number)
                 self.set_cell(coord.x, coord.y, terr_type)
+        if self.journal is not None:
+            self.journal.append(('next_room', self.next_room_number))
         self.next_room_number += 1
 
+    def add_sawblade(self, path):
+        # path: the cells the blade visits over one period, in order, each a step from the last (wrapping round)
+        for i, coord in enumerate(path):
+            following = path[(i + 1) % len(path)]
+            if not self.is_valid_coordinates(coord) or (len(path) > 1 and (coord.get_distance(following) != 1 or self.is_wall(coord, following))):
+                raise ValueError("A sawblade path must be a loop of neighbouring cells with no walls between them")
+        if self.journal is not None:
+            self.journal.append(('sawblade',))
+        self.sawblades.append(list(path))
+        self.set_cell_contents(path[0].x, path[0].y, CellContents.SAWBLADE)
+        for coord in path:
+            self.mark_dirty(coord.x, coord.y)
+
+    def add_lava_snake(self, coord):
+        if self.get_cell(coord.x, coord.y) != TerrType.LAVA:
+            raise ValueError("Lava snakes must spawn in lava, not at {}".format(coord))
+        if self.journal is not None:
+            self.journal.append(('lava_snake',))
+        self.lava_snakes.append(coord)
+        self.set_cell_contents(coord.x, coord.y, CellContents.LAVA_SNAKE)
+        self.mark_dirty(coord.x, coord.y)
+
+    def reachable_set(self, blocking_terrain_types):
+        # cells reachable from (0, 0) through doors, from a ReachabilityCache kept up to date as the map changes
+        key = ('reachable', tuple(blocking_terrain_types))
+        if key not in self.kept_caches:
+            self.kept_caches[key] = self.register_cache(ReachabilityCache(Coordinates(0, 0), blocking_terrain_types))
+        return self.kept_caches[key].get()
+
+    def hazard_tables(self):
+        # sawblade and lava snake lookups (hazards.HazardTables), kept up to date as the map changes
+        if self.hazards is None:
+            self.hazards = self.register_cache(HazardTables())
+        self.hazards.refresh()
+        return self.hazards
+
     def is_door(self, coord1, coord2):
-        return (coord1, coord2) in self.doors or (coord2, coord1) in self.doors
+        return (coord1, coord2) in self.door_edges
 
     def is_forced_wall(self, coord1, coord2):
-        return (coord1, coord2) in self.forced_walls or (coord2, coord1) in self.forced_walls
+        return (coord1, coord2) in self.forced_wall_edges
     
     def is_wall(self, coord1, coord2):
         if self.is_forced_wall(coord1, coord2):
@@ -121,24 +259,30 @@ class Map:
         return random.randint(min_y, max_y)
     
     def split_into_continuous_regions(self, area):
+        # regions, and the cells within each, come out in flood order; on_stack mirrors the stack for O(1) lookups
+        area_set = set(area)
         visited = set()
         regions = []
         for i in area:
             if i not in visited:
                 stack = [i]
+                on_stack = {i}
                 region = []
                 while stack:
                     current = stack.pop()
+                    on_stack.remove(current)
                     assert current not in visited
                     visited.add(current)
                     region.append(current)
                     for neighbor in current.get_neighboring_coordinates():
-                        if self.is_valid_coordinates(neighbor) and neighbor not in visited and neighbor not in stack and neighbor in area:
+                        if self.is_valid_coordinates(neighbor) and neighbor not in visited and neighbor not in on_stack and neighbor in area_set:
                             stack.append(neighbor)
+                            on_stack.add(neighbor)
                 regions.append(region)
         return regions
 
-    def flood_fill(self, start, blocking_terrain_types, blocked_walls=False):
+    def flood_fill(self, start, blocking_terrain_types, blocked_walls=False, within=None):
+        # within: optionally, a set of (x, y) the fill may not leave
         if not self.is_valid_coordinates(start):
             return []
         
@@ -156,24 +300,28 @@ class Map:
 
             for neighbor in current.get_neighboring_coordinates():
                 if self.is_valid_coordinates(neighbor) and self.get_cell(neighbor.x, neighbor.y) not in blocking_terrain_types:
+                    if within is not None and (neighbor.x, neighbor.y) not in within:
+                        continue
                     if not blocked_walls or not self.is_wall(current, neighbor):
                         stack.append(neighbor)
 
         return island if island else []
     
-    def reachable_coordinates(self):
+    def reachable_coordinates(self, verbose=True):
         reachable_terrains = [t for t in TerrType if t.clear_terrain]
         possible_blocking_terrains = [TerrType.LAVA, TerrType.WATER, TerrType.TREE, TerrType.DESERT]
         blocking_terrain_combinations = [tuple(list(subset)) for r in range(len(possible_blocking_terrains) + 1) for subset in itertools.combinations(possible_blocking_terrains, r)]
         results = {}
         for combo in blocking_terrain_combinations:
             items = tuple([b for b in possible_blocking_terrains if b not in combo])
-            island = self.flood_fill(Coordinates(0, 0), combo, blocked_walls=True)
+            island = list(self.reachable_set(combo))
             results[items] = {
                 'all' : island,
                 'clear' : [c for c in island if self.get_cell(c.x, c.y) in reachable_terrains],
             }
         for items in results.keys():
+            if not verbose:
+                break
             print('With items {}: {} reachable cells of which {} are clear'.format(
                 items, 
                 len(results[items]['all']),
@@ -252,6 +400,7 @@ class Map:
         return(len(river_coords))
 
     def generate_rivers(self):
+        config = self.config
         # set the river up to curve through the map
         river_checkpoints = [
             Coordinates(self.random_x_value(0.2, 0.3), self.height - 1),
@@ -268,41 +417,64 @@ class Map:
             self.draw_river(
                 river_checkpoints[i],
                 river_checkpoints[i+1], 
-                meander_coeff=0.5, 
-                widen_iterations=2, 
-                widen_coeff=0.15
+                meander_coeff=config.river_meander_coeff,
+                widen_iterations=config.river_widen_iterations,
+                widen_coeff=config.river_widen_coeff
             )
         for i in range(len(tributary_checkpoints) - 1):
             self.draw_river(
                 tributary_checkpoints[i],
                 tributary_checkpoints[i+1], 
-                meander_coeff=0.5, 
-                widen_iterations=2, 
-                widen_coeff=0.08
+                meander_coeff=config.tributary_meander_coeff,
+                widen_iterations=config.tributary_widen_iterations,
+                widen_coeff=config.tributary_widen_coeff
             )
-        # find large blocks of water (4x4 or larger)
+        # find open water: every cell whose 3x3 block reaching down and left is all water.  The summed-area table
+        # is built once, so candidate blocks are re-read cell by cell in case an earlier island took part of them.
+        water = self.summed_area_table([TerrType.WATER])
+        land_distance = self.register_cache(DistanceToTerrainCache([TerrType.GRASS]))
+        for y in range(2, self.height):
+            for x in range(2, self.width):
+                if self.window_count(water, x - 2, y - 2, x + 1, y + 1) < 9:
+                    continue
+                if any(self.cells[y_temp][x_temp] != TerrType.WATER for y_temp in range(y-2, y+1) for x_temp in range(x-2, x+1)):
+                    continue
+                island_squares = [Coordinates(x, y)]
+                in_island = {Coordinates(x, y)}
+                stack = [Coordinates(x, y)]
+                while stack:
+                    current = stack.pop()
+                    for neighbor in current.get_neighboring_coordinates():
+                        # land only moves once the island is placed, so distances hold for the whole growth
+                        if self.is_valid_coordinates(neighbor) and neighbor not in in_island and land_distance.get(neighbor.x, neighbor.y) >= config.island_min_distance_to_land and random.random() < config.island_growth_probability:
+                            island_squares.append(neighbor)
+                            in_island.add(neighbor)
+                            stack.append(neighbor)
+                for square in island_squares:
+                    self.set_cell(square.x, square.y, TerrType.GRASS)
+        self.unregister_cache(land_distance)
+
+    def summed_area_table(self, terrain_types):
+        # table[y][x] counts the cells of terrain_types with coordinates below (x, y)
+        terrain_types = set(terrain_types)
+        table = [[0] * (self.width + 1)]
         for y in range(self.height):
+            above = table[-1]
+            row = [0]
+            running = 0
             for x in range(self.width):
-                all_water = True
-                for y_temp in range(y-2, y+1):
-                    for x_temp in range(x-2, x+1):
-                        if (not self.is_valid_coordinates(Coordinates(x_temp, y_temp))) or (self.get_cell(x_temp, y_temp) != TerrType.WATER):
-                            all_water = False
-                if all_water:
-                    island_squares = [Coordinates(x, y)]
-                    stack = [Coordinates(x, y)]
-                    while stack:
-                        current = stack.pop()
-                        for neighbor in current.get_neighboring_coordinates():
-                            dist_to_land = self.closest_terrain(neighbor, TerrType.GRASS)[0]
-                            if self.is_valid_coordinates(neighbor) and neighbor not in island_squares and dist_to_land >= 3 and random.random() < 0.8:
-                                island_squares.append(neighbor)
-                                stack.append(neighbor)
-                    for square in island_squares:
-                        if self.is_valid_coordinates(square):
-                            self.set_cell(square.x, square.y, TerrType.GRASS)
+                running += self.cells[y][x] in terrain_types
+                row.append(above[x + 1] + running)
+            table.append(row)
+        return table
+
+    def window_count(self, table, min_x, min_y, max_x, max_y):
+        # cells counted in the half-open window [min_x, max_x) x [min_y, max_y)
+        return table[max_y][max_x] - table[min_y][max_x] - table[max_y][min_x] + table[min_y][min_x]
 
     def find_closest_distance(self, first_group, second_group):
+        if len(first_group) * len(second_group) > self.width * self.height and all(self.is_valid_coordinates(c) for c in itertools.chain(first_group, second_group)):
+            return self.find_closest_distance_on_grid(first_group, second_group)
         closest_distance = float('inf')
         closest_start = None
         closest_end = None
@@ -315,12 +487,34 @@ class Map:
                     closest_end = coord2
         return [closest_distance, closest_start, closest_end]
 
+    def find_closest_distance_on_grid(self, first_group, second_group):
+        # same answer as the pairwise search (first closest pair in group order), via a distance map of second_group
+        if not first_group or not second_group:
+            return [float('inf'), None, None]
+        distances = [[float('inf')] * self.width for _ in range(self.height)]
+        queue = deque()
+        for c in second_group:
+            if distances[c.y][c.x] != 0:
+                distances[c.y][c.x] = 0
+                queue.append(c)
+        while queue:
+            current = queue.popleft()
+            for n in current.get_neighboring_coordinates():
+                if self.is_valid_coordinates(n) and distances[n.y][n.x] > distances[current.y][current.x] + 1:
+                    distances[n.y][n.x] = distances[current.y][current.x] + 1
+                    queue.append(n)
+        closest_distance = min(distances[c.y][c.x] for c in first_group)
+        closest_start = next(c for c in first_group if distances[c.y][c.x] == closest_distance)
+        closest_end = next(c for c in second_group if c.get_distance(closest_start) == closest_distance)
+        return [closest_distance, closest_start, closest_end]
+
     def generate_desert(self, center, size, subcenters=0):
-        marked_cells = self.draw_random_spread(center, size, 0.8, [TerrType.GRASS])
+        spread_probability = self.config.desert_spread_probability
+        marked_cells = self.draw_random_spread(center, size, spread_probability, [TerrType.GRASS])
         
         for i in range(subcenters):
             subcenter = random.choice(center.get_coordinates_in_range(size-1, exact=True))
-            sub_marked_cells = self.draw_random_spread(subcenter, size // 2, 0.8, [TerrType.GRASS])
+            sub_marked_cells = self.draw_random_spread(subcenter, size // 2, spread_probability, [TerrType.GRASS])
             marked_cells.update(sub_marked_cells)
 
         for coord in marked_cells:
@@ -328,6 +522,7 @@ class Map:
                 self.set_cell(coord.x, coord.y, TerrType.DESERT)
 
     def generate_deserts(self):
+        config = self.config
         # one big desert, near an edge and not near the top right/bottom left corners
         large_desert_center = random.choice([
             Coordinates(self.random_x_value(0, 0.1), self.random_y_value(0.5, 1)),
@@ -335,37 +530,51 @@ class Map:
             Coordinates(self.random_x_value(0.5, 1.0), self.random_y_value(0, 0.1)),
             Coordinates(self.random_x_value(0, 0.5), self.random_y_value(0.9, 1.0)),
         ])
-        self.generate_desert(large_desert_center, size=random.randint(14, 16), subcenters=random.randint(1, 3))
+        self.generate_desert(
+            large_desert_center,
+            size=random.randint(config.large_desert_size_min, config.large_desert_size_max),
+            subcenters=random.randint(config.large_desert_subcenters_min, config.large_desert_subcenters_max)
+        )
 
-        for i in range(random.randint(1, 3)):
+        for i in range(random.randint(config.small_desert_count_min, config.small_desert_count_max)):
             small_desert_center = Coordinates(
                 self.random_x_value(0.0, 1.0),  
                 self.random_y_value(0.0, 1.0)
             )
             while small_desert_center.get_distance(Coordinates(0,0)) < 10:
+                self.record_retry('small_desert_center')
                 small_desert_center = Coordinates(
                     self.random_x_value(0.0, 1.0),  
                     self.random_y_value(0.0, 1.0)
                 )
-            self.generate_desert(small_desert_center, size=random.randint(9,11), subcenters = random.randint(0,1))
+            self.generate_desert(small_desert_center, size=random.randint(config.small_desert_size_min, config.small_desert_size_max), subcenters = random.randint(0,1))
 
     def generate_bridges(self):
-        islands = self.split_map_by_terrain([TerrType.WATER])
-        islands = [island for island in islands if random.random() * 20 <= len(island)]  # filter out most small islands
-        num_bridges = random.randint(1, 3)
+        # split_map_by_terrain floods from every open cell, which is quadratic in the island sizes.  Here each cell
+        # stands for its island, found once by an IslandCache, and only the cells that are picked are flooded
+        # (within the island as it was, so bridges drawn since do not join islands).  The flood order is the same,
+        # and it matters: find_closest_distance takes the first closest pair, which sets the bridge ends.
+        split = IslandCache([TerrType.WATER])
+        split.attach(self)  # not registered: a one-off split, not kept up to date
+        starts = [Coordinates(x, y) for y in range(self.height) for x in range(self.width) if split.labels[y][x] is not None]
+        starts = [start for start in starts if random.random() * 20 <= len(split.islands[split.labels[start.y][start.x]])]  # filter out most small islands
+        num_bridges = random.randint(self.config.bridge_count_min, self.config.bridge_count_max)
         bridge_locs = []
         iterations = 0
         while num_bridges > 0:
             iterations += 1
+            if iterations > 1:
+                self.record_retry('bridge')
             if iterations > 100:
                 print("Too many iterations, stopping bridge generation.")
                 break
-            start_island = random.choice(islands)
-            end_island = random.choice(islands)
+            start_island = random.choice(starts)
+            end_island = random.choice(starts)
             if start_island == end_island:
                 continue
+            start_island, end_island = [self.flood_fill(c, [TerrType.WATER], within=split.islands[split.labels[c.y][c.x]]) for c in (start_island, end_island)]
             [closest_distance, start_coord, end_coord] = self.find_closest_distance(start_island, end_island)
-            if closest_distance > 5:
+            if closest_distance > self.config.bridge_max_length:
                 continue
             if closest_distance <= 1:
                 continue
@@ -383,15 +592,17 @@ class Map:
     def add_door_from_new_room(self, new_room_contents, old_room_contents):
         door_added = False
         random.shuffle(new_room_contents)
+        new_room_set = set(new_room_contents)
+        old_room_set = set(old_room_contents)
         for door_point in new_room_contents:
             if door_added and random.random() < 0.9: # usually only one door
                 continue
             neighbors = door_point.get_neighboring_coordinates()
             for n in neighbors:
-                if n in old_room_contents or (old_room_contents == [] and n not in new_room_contents):  # if the old room is empty, we can add a door to any neighbor
-                    self.doors.append((door_point, n))
-                    door_added = True
-                    break
+                if n in old_room_set or (not old_room_set and n not in new_room_set):  # if the old room is empty, we can add a door to any neighbor
+                    if self.add_door(door_point, n):
+                        door_added = True
+                        break
 
         if not door_added: # this can happen if a building is weirdly multi-segmented
             indoor_links = []
@@ -399,23 +610,31 @@ class Map:
             for door_point in new_room_contents:
                 neighbors = door_point.get_neighboring_coordinates()
                 for n in neighbors:
-                    if n not in new_room_contents:
+                    if n not in new_room_set:
                         if self.get_cell(n.x, n.y) in [TerrType.CASTLE, TerrType.BUILDING]:
                             indoor_links.append((door_point, n))
                         else:
                             outdoor_links.append((door_point, n))
             if len(indoor_links):
                 door_point, n = random.choice(indoor_links)
-                self.doors.append((door_point, n))
-                door_added = True
+                door_added = self.add_door(door_point, n)
             else:
                 assert(False) # I think this should never happen, but if it does we need to figure out why.
         
         return door_added
 
     def split_building_into_rooms(self, building_contents, terr_type=TerrType.BUILDING):
+        # rooms are split depth-first from an explicit stack (no recursion limit on big castles), in the same
+        # order as the old recursive version, so a seed still gives the same rooms
+        pending = [building_contents]
+        while pending:
+            pieces = self.split_room(pending.pop(), terr_type)
+            pending.extend(reversed(pieces))
+
+    def split_room(self, building_contents, terr_type):
+        # one split of one room; returns the pieces to consider splitting further (none if the room stays whole)
         if 1 + (random.random() * 4) + (random.random() * random.random() * 20) > len(building_contents): # we want to allow large rooms but make them rare
-            return
+            return []
         
         # we have a couple different ways of splitting.
         split_type = random.choice(['x', 'y', 'fill'])
@@ -423,35 +642,38 @@ class Map:
             min_y = min([c.y for c in building_contents])
             max_y = max([c.y for c in building_contents])
             if min_y == max_y:
-                return
+                return []
             y_split = random.choice(range(min_y, max_y)) # this can give min and not max, but we will include this row in the bottom.
             new_contents = [c for c in building_contents if c.y <= y_split]
         elif split_type == 'x':
             min_x = min([c.x for c in building_contents])
             max_x = max([c.x for c in building_contents])
             if min_x == max_x:
-                return
+                return []
             x_split = random.choice(range(min_x, max_x))
             new_contents = [c for c in building_contents if c.x <= x_split]
         elif split_type == 'fill':
+            building_set = set(building_contents)
             start_point = random.choice(building_contents)
             new_contents = [start_point]
+            new_set = {start_point}
             desired_size = math.floor(len(building_contents) * random.random() * 0.6) + 1
             while len(new_contents) < desired_size:
                 focus = random.choice(new_contents)
                 neighbors = focus.get_neighboring_coordinates()
                 for i in neighbors:
-                    if i in building_contents and i not in new_contents and random.random() < 0.5:
+                    if i in building_set and i not in new_set and random.random() < 0.5:
                         new_contents.append(i)
+                        new_set.add(i)
         else:
             raise ValueError("Invalid split type: {}".format(split_type))
         
-        old_contents = [c for c in building_contents if c not in new_contents]
+        new_set = set(new_contents)
+        old_contents = [c for c in building_contents if c not in new_set]
 
         old_rooms = self.split_into_continuous_regions(old_contents)
-        for i in old_rooms:
-            if i != old_rooms[0]: # that keeps the previous id
-                self.add_room(i, terr_type=terr_type)
+        for i in old_rooms[1:]: # the first keeps the previous id
+            self.add_room(i, terr_type=terr_type)
 
         new_rooms = self.split_into_continuous_regions(new_contents)
         for i in new_rooms:
@@ -460,10 +682,7 @@ class Map:
                 for o in old_rooms:
                     self.add_door_from_new_room(i, o)      
 
-        for i in old_rooms:
-            self.split_building_into_rooms(i, terr_type=terr_type)
-        for i in new_rooms:
-            self.split_building_into_rooms(i, terr_type=terr_type)
+        return old_rooms + new_rooms
 
     def get_gate_position(self, start, size):
         if size%2 == 0:
@@ -513,9 +732,9 @@ class Map:
             gate_y = min([c.y for c in contents if c.x == gate_x_start])
             print(f"Adding gate at ({gate_x_start}, {gate_y}) to ({gate_x_end}, {gate_y})")
             for x in range(gate_x_start, gate_x_end):
-                self.doors.append((Coordinates(x, gate_y), Coordinates(x, gate_y - 1)))
+                self.add_door(Coordinates(x, gate_y), Coordinates(x, gate_y - 1))
             for x in range(gate_x_start, gate_x_end - 1): # keep the castle from splitting just inside the gate
-                self.doors.append((Coordinates(x, gate_y), Coordinates(x + 1, gate_y)))
+                self.add_door(Coordinates(x, gate_y), Coordinates(x + 1, gate_y))
 
             boss_y_max = max([c.y for c in contents if c.x == gate_x_start]) - 2 # above the gate, with a bit of space to put the entrance opposite.
             boss_y_min = boss_y_max - boss_room_size + 1
@@ -528,19 +747,19 @@ class Map:
                         boss_contents.append(Coordinates(x, y))
                         contents.remove(Coordinates(x, y))
             self.add_room(boss_contents, terr_type=TerrType.CASTLE)
-            self.doors.append((
+            self.add_door(
                 Coordinates(boss_x_min + 2, boss_y_max),
                 Coordinates(boss_x_min + 2, boss_y_max + 1),
-            ))
+            )
 
         else: # gate on left
             [gate_y_start, gate_y_end] = self.get_gate_position(castle_y_min, castle_y_size)
             gate_x = min([c.x for c in contents if c.y == gate_y_start])
             print(f"Adding gate at ({gate_x}, {gate_y_start}) to ({gate_x}, {gate_y_end})")
             for y in range(gate_y_start, gate_y_end):
-                self.doors.append((Coordinates(gate_x, y), Coordinates(gate_x - 1, y)))
+                self.add_door(Coordinates(gate_x, y), Coordinates(gate_x - 1, y))
             for y in range(gate_y_start, gate_y_end - 1): # keep the castle from splitting just inside the gate
-                self.doors.append((Coordinates(gate_x, y), Coordinates(gate_x, y + 1)))
+                self.add_door(Coordinates(gate_x, y), Coordinates(gate_x, y + 1))
 
             boss_x_max = max([c.x for c in contents if c.y == gate_y_start]) - 2 # right of the gate, with a bit of space to put the entrance opposite.
             boss_x_min = boss_x_max - boss_room_size + 1
@@ -553,10 +772,10 @@ class Map:
                         boss_contents.append(Coordinates(x, y))
                         contents.remove(Coordinates(x, y))
             self.add_room(boss_contents, terr_type=TerrType.CASTLE)
-            self.doors.append((
+            self.add_door(
                 Coordinates(boss_x_max, boss_y_min + 2),
                 Coordinates(boss_x_max + 1, boss_y_min + 2),
-            ))
+            )
         
         # the only way into the boss room is through that door.
         boss_door_count = 0
@@ -578,10 +797,19 @@ class Map:
         self.add_room(contents, terr_type=TerrType.CASTLE)
         self.split_building_into_rooms(contents, terr_type=TerrType.CASTLE)
 
-    def find_spot_for_building(self, base_x_size, base_y_size):
+    def find_spot_for_building(self, base_x_size, base_y_size, occupancy=None):
+        # one random guess; occupancy (an OccupancyIndex) makes the test O(1) instead of checking every cell.  The
+        # guesses never touch the top or right edge (only OccupancyIndex.random_anchor does), as seeded maps depend
+        # on these ranges.
+        if base_x_size >= self.width or base_y_size >= self.height:
+            return None
         for x in random.sample(range(self.width - base_x_size), 1):
             for y in random.sample(range(self.height - base_y_size), 1):
-                if all(self.get_cell(x + dx, y + dy) not in [TerrType.BUILDING, TerrType.CASTLE, TerrType.WATER] for dx in range(base_x_size) for dy in range(base_y_size)):
+                if occupancy is not None:
+                    fits = occupancy.is_free(x, y, base_x_size, base_y_size)
+                else:
+                    fits = all(self.get_cell(x + dx, y + dy) not in BUILDING_BLOCKING_TERRAIN for dx in range(base_x_size) for dy in range(base_y_size))
+                if fits:
                     return Coordinates(x, y)
 
     def take_bite(self, start_coord, x_size, y_size, x_corner, y_corner, bite_size):
@@ -608,12 +836,27 @@ class Map:
             if room_number > 0: # we can have an outdoor area that is unreachable because of being blocked off by rooms missing doros.  This should resolve itself when the rooms get doors.
                 self.add_door_from_new_room(self.get_room_contents(room_number), [])
 
-    def generate_building(self):
+    def generate_building(self, occupancy=None):
+        if occupancy is None:
+            occupancy = OccupancyIndex(BUILDING_BLOCKING_TERRAIN)
+            occupancy.attach(self)
+        if not occupancy.anchor_count(1, 1):
+            print('No free spot left for a building')
+            return None
+        max_size = self.config.building_max_size
         start_coord = None
+        misses = 0
         while start_coord is None:
-            base_x_size = random.randint(1, 8)
-            base_y_size = random.randint(1, 8)
-            start_coord = self.find_spot_for_building(base_x_size, base_y_size)
+            base_x_size = random.randint(1, max_size)
+            base_y_size = random.randint(1, max_size)
+            if misses < 100:
+                start_coord = self.find_spot_for_building(base_x_size, base_y_size, occupancy)
+            else:
+                # crowded map: stop guessing and pick from the spots that really fit this size (a 1x1 always does)
+                start_coord = occupancy.random_anchor(base_x_size, base_y_size)
+            if start_coord is None:
+                self.record_retry('building_spot')
+                misses += 1
         
         contents = []
         for y in range(start_coord.y, start_coord.y + base_y_size):
@@ -652,6 +895,8 @@ class Map:
         elif num_bites == 4:
             num_doors = random.choice([1,2,3,4])
         
+        # a building against the map edge or water may have fewer usable sides than it wants doors
+        num_doors = min(num_doors, sum(1 for side in sides if self.door_side_usable(contents, side)))
         doors_made = 0
         while doors_made < num_doors:
             side = random.choice(sides)
@@ -677,30 +922,69 @@ class Map:
                 outside = Coordinates(inside.x + 1, inside.y)
 
             if self.is_valid_coordinates(outside) and self.get_cell(outside.x, outside.y) not in [TerrType.WATER]:
-                self.doors.append((inside, outside))
+                self.add_door(inside, outside)
                 doors_made += 1
                 sides.remove(side)
+            else:
+                self.record_retry('building_door')
 
         self.split_building_into_rooms(contents)
         return(len(contents))
 
-    def generate_buildings(self):
+    def door_side_usable(self, contents, side):
+        offset = {'top': (0, 1), 'bottom': (0, -1), 'left': (-1, 0), 'right': (1, 0)}[side]
+        if side in ['top', 'bottom']:
+            edge = (max if side == 'top' else min)(coord.y for coord in contents)
+            valid = [coord for coord in contents if coord.y == edge]
+        else:
+            edge = (max if side == 'right' else min)(coord.x for coord in contents)
+            valid = [coord for coord in contents if coord.x == edge]
+        for inside in valid:
+            outside = Coordinates(inside.x + offset[0], inside.y + offset[1])
+            if self.is_valid_coordinates(outside) and self.get_cell(outside.x, outside.y) not in [TerrType.WATER]:
+                return True
+        return False
+
+    def generate_buildings(self, desired_size=None):
         total_size = 0
-        desired_size = self.width * self.height // 20 * (1 + random.random())  # 5-10% of the map
+        if desired_size is None:
+            config = self.config
+            density = config.building_density_min + (config.building_density_max - config.building_density_min) * random.random()
+            desired_size = self.width * self.height * density
+        occupancy = self.register_cache(OccupancyIndex(BUILDING_BLOCKING_TERRAIN))
         while total_size < desired_size:
-            total_size += self.generate_building()
+            size = self.generate_building(occupancy)
+            if size is None:
+                print('Stopped placing buildings at {} of {} cells'.format(total_size, round(desired_size)))
+                break
+            total_size += size
+        self.unregister_cache(occupancy)
 
-    def generate_lava(self):
-        desired_lava_count = self.width * self.height // 100 * (3 + random.random())  # 3-4% of the map
+    def generate_lava(self, bounds=None, desired_lava_count=None):
+        # bounds (min_x, min_y, max_x, max_y), exclusive of the max, confine the lava; by default it fills the
+        # bottom-right quarter of the map up to a share of the whole map's area
+        config = self.config
+        if desired_lava_count is None:
+            density = config.lava_density_min + (config.lava_density_max - config.lava_density_min) * random.random()
+            desired_lava_count = self.width * self.height * density
+        if bounds is None:
+            min_x, min_y, max_x, max_y = self.width // 2, self.height // 2, self.width, self.height
+        else:
+            min_x, min_y, max_x, max_y = bounds
         lava_count = 0
+        stalled = 0
         while lava_count < desired_lava_count:
-            start = Coordinates(self.random_x_value(0.5, 1.0), self.random_y_value(0.5, 1.0))
+            previous_lava_count = lava_count
+            if bounds is None:
+                start = Coordinates(self.random_x_value(0.5, 1.0), self.random_y_value(0.5, 1.0))
+            else:
+                start = Coordinates(random.randint(min_x, max_x - 1), random.randint(min_y, max_y - 1))
             end = random.choice(self.valid_coordinates_in_range(start, 10, exact=False))
-            lava_count += self.draw_river(start, end, set_terrain=TerrType.LAVA, meander_coeff=0.2, widen_iterations=0, widen_coeff=0, skip_terrains=[TerrType.WATER, TerrType.LAVA, TerrType.BUILDING, TerrType.CASTLE])
+            lava_count += self.draw_river(start, end, set_terrain=TerrType.LAVA, meander_coeff=config.lava_meander_coeff, widen_iterations=0, widen_coeff=0, skip_terrains=[TerrType.WATER, TerrType.LAVA, TerrType.BUILDING, TerrType.CASTLE])
             
-            for y in range(self.height // 2, self.height):
-                for x in range(self.width // 2, self.width):
-                    if random.random() < 0.02 and self.get_cell(x, y) in [TerrType.GRASS, TerrType.DESERT]:
+            for y in range(min_y, max_y):
+                for x in range(min_x, max_x):
+                    if random.random() < config.lava_speckle_probability and self.get_cell(x, y) in [TerrType.GRASS, TerrType.DESERT]:
                         self.set_cell(x, y, TerrType.LAVA)
                         lava_count += 1
                         # lava streaks
@@ -711,17 +995,36 @@ class Map:
                                 if self.is_valid_coordinates(next_neighbor) and self.get_cell(next_neighbor.x, next_neighbor.y) == TerrType.GRASS and random.random() < 0.5:
                                     lava_count += 1
                                     self.set_cell(next_neighbor.x, next_neighbor.y, TerrType.LAVA)
+            if lava_count == previous_lava_count:
+                self.record_retry('lava')
+                stalled += 1
+                if stalled > 100: # nothing left that can turn to lava
+                    break
         
-    def generate_forests(self):
-        num_forests = random.randint(3, 5)
+    def generate_forests(self, bounds=None, num_forests=None):
+        # bounds (min_x, min_y, max_x, max_y), exclusive of the max, confine the forest centres
+        config = self.config
+        if num_forests is None:
+            num_forests = random.randint(config.forest_count_min, config.forest_count_max)
         for _ in range(num_forests):
             center = None
+            tries = 0
             while center is None or self.get_cell(center.x, center.y) != TerrType.GRASS:
-                center = Coordinates(
-                    self.random_x_value(0.1, 0.9),
-                    self.random_y_value(0.1, 0.9)
-                )
-            base_size = random.randint(3, 6)
+                if center is not None:
+                    self.record_retry('forest_center')
+                    tries += 1
+                    if tries > 1000: # no grass left to grow a forest on
+                        break
+                if bounds is None:
+                    center = Coordinates(
+                        self.random_x_value(0.1, 0.9),
+                        self.random_y_value(0.1, 0.9)
+                    )
+                else:
+                    center = Coordinates(random.randint(bounds[0], bounds[2] - 1), random.randint(bounds[1], bounds[3] - 1))
+            if self.get_cell(center.x, center.y) != TerrType.GRASS:
+                continue
+            base_size = random.randint(config.forest_size_min, config.forest_size_max)
             for c in self.valid_coordinates_in_range(center, base_size * 2, exact=False):
                 if self.get_cell(c.x, c.y) == TerrType.GRASS and random.random() < (1 - (c.get_distance(center) / (base_size * 2))):
                     self.set_cell(c.x, c.y, TerrType.TREE)
@@ -732,10 +1035,11 @@ class Map:
                     if self.get_cell(c.x, c.y) == TerrType.GRASS and random.random() < 0.5:
                         self.set_cell(c.x, c.y, TerrType.TREE)
 
-    def scatter_trees(self):
-        for y in range(self.height):
-            for x in range(self.width):
-                if self.get_cell(x, y) == TerrType.GRASS and random.random() < 0.01:
+    def scatter_trees(self, bounds=None):
+        min_x, min_y, max_x, max_y = bounds if bounds is not None else (0, 0, self.width, self.height)
+        for y in range(min_y, max_y):
+            for x in range(min_x, max_x):
+                if self.get_cell(x, y) == TerrType.GRASS and random.random() < self.config.tree_scatter_probability:
                     self.set_cell(x, y, TerrType.TREE)
 
     def place_items(self):
@@ -766,6 +1070,8 @@ class Map:
             if self.get_cell(x, y).clear_terrain and self.get_cell_contents(x, y) == CellContents.EMPTY and self.find_closest_distance([new_loc], item_locations)[0] >= min_spread :
                 item_locations.append(new_loc)
                 items_placed += 1
+            else:
+                self.record_retry('item_location')
             tries += 1
             if tries > 1000:
                 raise("Too many tries to place items, check the map size or item count.")
@@ -793,7 +1099,69 @@ class Map:
         for v in vaults_to_place:
             location = v.find_location_func(self)
             if location is not None:
-                v.place_func(self, location)
+                with self.transaction() as trial: # a rejected vault leaves no trace on the map
+                    v.place_func(self, location)
+                    if v.validate_func is not None and not v.validate_func(self, location):
+                        trial.rollback()
+                        self.record_retry('vault')
+
+    def find_sawblade_corridor(self):
+        # a straight run of free floor for a blade to go back and forth along
+        config = self.config
+        start = Coordinates(random.randrange(self.width), random.randrange(self.height))
+        dx, dy = random.choice([(1, 0), (0, 1)])
+        length = random.randint(config.sawblade_corridor_min, config.sawblade_corridor_max)
+        cells = [Coordinates(start.x + dx * i, start.y + dy * i) for i in range(length)]
+        for i, cell in enumerate(cells):
+            if not self.is_valid_coordinates(cell) or self.get_cell(cell.x, cell.y) not in SAWBLADE_TERRAIN or self.get_cell_contents(cell.x, cell.y) != CellContents.EMPTY:
+                return None
+            if i > 0 and self.is_wall(cells[i - 1], cell):
+                return None
+        return back_and_forth(cells)
+
+    def find_sawblade_loop(self):
+        # a rectangle inside one room for a blade to circle
+        config = self.config
+        x_size = random.randint(config.sawblade_loop_size_min, config.sawblade_loop_size_max)
+        y_size = random.randint(config.sawblade_loop_size_min, config.sawblade_loop_size_max)
+        if x_size >= self.width or y_size >= self.height:
+            return None
+        min_x = random.randrange(self.width - x_size + 1)
+        min_y = random.randrange(self.height - y_size + 1)
+        loop = rectangle_loop(min_x, min_y, min_x + x_size - 1, min_y + y_size - 1)
+        room = self.get_room_number(min_x, min_y)
+        for cell in loop:
+            if self.get_room_number(cell.x, cell.y) != room or self.get_cell(cell.x, cell.y) not in SAWBLADE_TERRAIN or self.get_cell_contents(cell.x, cell.y) != CellContents.EMPTY:
+                return None
+        for i, cell in enumerate(loop):
+            if self.is_forced_wall(cell, loop[(i + 1) % len(loop)]):
+                return None
+        return loop
+
+    def place_hazards(self):
+        config = self.config
+        num_snakes = random.randint(config.lava_snake_count_min, config.lava_snake_count_max)
+        for _ in range(num_snakes):
+            lava = [Coordinates(x, y) for y in range(self.height) for x in range(self.width) if self.cells[y][x] == TerrType.LAVA and self.cell_contents[y][x] == CellContents.EMPTY]
+            if not lava:
+                print('No free lava left for a lava snake')
+                break
+            self.add_lava_snake(random.choice(lava))
+
+        num_sawblades = random.randint(config.sawblade_count_min, config.sawblade_count_max)
+        for _ in range(num_sawblades):
+            path = None
+            tries = 0
+            while path is None and tries < 100:
+                tries += 1
+                path = self.find_sawblade_loop() if random.random() < 0.5 else self.find_sawblade_corridor()
+                if path is None:
+                    self.record_retry('sawblade')
+            if path is None:
+                print('No room found for a sawblade')
+                break
+            self.add_sawblade(path)
+        print('Placed {} lava snakes and {} sawblades'.format(len(self.lava_snakes), len(self.sawblades)))
 
     def generate_map(self):
         self.generate_rivers()
@@ -807,58 +1175,14 @@ class Map:
         self.scatter_trees()
         self.place_vaults()
         self.place_items()
+        if self.config.hazards:
+            self.place_hazards()
         #self.evaluate_item_usefulness()
 
     def export_to_excel(self, filename):
-        workbook = xlsxwriter.Workbook(filename)
-        worksheet = workbook.add_worksheet()
-        worksheet.set_column(0, self.width - 1, 3)
-
-        # Create a format cache to avoid duplicate formats
-        format_cache = {}
+        from excel_export import export_to_excel # xlsxwriter is only needed when we actually write a workbook
+        export_to_excel(self, filename)
 
-        for alt_y in range(self.height): # we want low y to show up at the bottom...
-            y = self.height - 1 - alt_y
-            for x in range(self.width):
-                 # Determine borders
-                borders = {}
-                # Check up
-                if y < self.height - 1:
-                    if self.is_wall(Coordinates(x, y), Coordinates(x, y + 1)):
-                        borders['top'] = 2 # thick
-                if y > 0:
-                    if self.is_wall(Coordinates(x, y), Coordinates(x, y - 1)):
-                        borders['bottom'] = 2
-                if x > 0:
-                    if self.is_wall(Coordinates(x, y), Coordinates(x - 1, y)):
-                        borders['left'] = 2
-                if x < self.width - 1:
-                    if self.is_wall(Coordinates(x, y), Coordinates(x + 1, y)):
-                        borders['right'] = 2
-                # Build format key
-                border_key = (borders.get('top', 0), borders.get('bottom', 0),
-                            borders.get('left', 0), borders.get('right', 0))
-            
-                cell_type = self.get_cell(x, y)
-                cell_contents = self.get_cell_contents(x, y)
-                contents_key = cell_contents.label
-                fmt_key = (cell_type.color, border_key, contents_key)
-                if fmt_key not in format_cache:
-                    fmt_dict = {'bg_color': cell_type.color}
-                    if borders.get('top'): fmt_dict['top'] = borders['top']
-                    if borders.get('bottom'): fmt_dict['bottom'] = borders['bottom']
-                    if borders.get('left'): fmt_dict['left'] = borders['left']
-                    if borders.get('right'): fmt_dict['right'] = borders['right']
-                    fmt_dict['align'] = 'center'
-                    fmt_dict['valign'] = 'vcenter'
-                    fmt_dict['font_color'] = cell_contents.color
-                    format_cache[fmt_key] = workbook.add_format(fmt_dict)
-                cell_format = format_cache[fmt_key]
-            
-                worksheet.write(alt_y, x, cell_contents.symbol, cell_format)
-
-        workbook.close()
-    
     def gen_name(self):
         return('{} the {} {} of {} {} {}'.format(
             random.choice(['Against', 'Assault', 'Assail', 'Attack']),
@@ -879,6 +1203,7 @@ if __name__ == "__main__":
         game_map.generate_map()
         name = "game_map_{}.xlsx".format(i + 1)
         game_map.export_to_excel(name)
-        os.startfile(name)
+        if hasattr(os, 'startfile'): # Windows only
+            os.startfile(name)
         print(f"Map generated and exported to '{name}' with dimensions {map_width}x{map_height}.")
     input("Press Enter to exit...")
\ No newline at end of file
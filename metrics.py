@@ -0,0 +1,175 @@
+import csv
+from collections import deque
+from support_classes import *
+from generation import generate_seeded_map
+from serialization import load_map
+
+ITEM_CONTENTS = [CellContents.DESERT_CLOAK, CellContents.WATER_BOOTS, CellContents.FIRE_SHIELD, CellContents.AXE, CellContents.BOW, CellContents.BLESSING]
+
+# stages that call Map.record_retry
+RETRY_STAGES = ['small_desert_center', 'bridge', 'building_spot', 'building_door', 'forest_center', 'item_location', 'vault', 'lava', 'sawblade']
+
+def items_key(items):
+    if not items:
+        return 'none'
+    return '_'.join(t.label.lower() for t in items)
+
+def terrain_shares(game_map):
+    counts = {t: 0 for t in TerrType}
+    for row in game_map.cells:
+        for cell in row:
+            counts[cell] += 1
+    area = game_map.width * game_map.height
+    return {'share_{}'.format(t.label.lower()): counts[t] / area for t in TerrType}
+
+def reachability(game_map):
+    # clear cells reachable from the start shrine, for each of the 16 sets of terrain-crossing items
+    reachable = game_map.reachable_coordinates(verbose=False)
+    return {'reach_clear_{}'.format(items_key(items)): len(result['clear']) for items, result in reachable.items()}
+
+def spawn_shrine(shrines):
+    # you spawn at the bottom-left shrine
+    return min(shrines, key=lambda c: (c.x + c.y, c.y, c.x)) if shrines else None
+
+def start_shrine(game_map):
+    return spawn_shrine([Coordinates(x, y) for y in range(game_map.height) for x in range(game_map.width) if game_map.get_cell_contents(x, y) == CellContents.SHRINE])
+
+def start_distances(game_map):
+    # walking distance (cells) from the start shrine to each item, the gems and the boss; only walls and trees
+    # block, as for a player who already holds the terrain items.  None when out of reach.
+    start = start_shrine(game_map)
+    if start is None:
+        return {}
+    distances = {start: 0}
+    queue = deque([start])
+    while queue:
+        current = queue.popleft()
+        for neighbor in current.get_neighboring_coordinates():
+            if neighbor not in distances and game_map.is_valid_coordinates(neighbor) and game_map.get_cell(neighbor.x, neighbor.y) != TerrType.TREE and not game_map.is_wall(current, neighbor):
+                distances[neighbor] = distances[current] + 1
+                queue.append(neighbor)
+    found = {}
+    for y in range(game_map.height):
+        for x in range(game_map.width):
+            found.setdefault(game_map.get_cell_contents(x, y), []).append(distances.get(Coordinates(x, y)))
+    row = {}
+    for contents in ITEM_CONTENTS + [CellContents.BOSS]:
+        reachable = [d for d in found.get(contents, []) if d is not None]
+        row['dist_{}'.format(contents.label.lower())] = min(reachable) if reachable else None
+    gems = [d for d in found.get(CellContents.GEM, []) if d is not None]
+    row['gems_reachable'] = len(gems)
+    row['dist_gem_mean'] = sum(gems) / len(gems) if gems else None
+    row['dist_gem_max'] = max(gems) if gems else None
+    return row
+
+def map_metrics(game_map):
+    row = {}
+    row.update(terrain_shares(game_map))
+    row.update(reachability(game_map))
+    row.update(start_distances(game_map))
+    row['room_count'] = game_map.next_room_number - 1
+    row['door_count'] = len(game_map.doors)
+    row['sawblade_count'] = len(game_map.sawblades)
+    row['lava_snake_count'] = len(game_map.lava_snakes)
+    for stage in RETRY_STAGES:
+        row['retries_{}'.format(stage)] = game_map.retry_counts.get(stage, 0)
+    return row
+
+def seed_row(measure, task):
+    # one result row for a generated map: its seed and size, then measure(game_map) or the error it raised
+    seed, width, height, config = task
+    row = {'seed': seed, 'width': width, 'height': height}
+    try:
+        row.update(measure(generate_seeded_map(seed, width, height, config)))
+        row['error'] = ''
+    except Exception as e:  # one broken map should show up in the results, not stop the corpus
+        row['error'] = repr(e)
+    return row
+
+def file_row(measure, filename):
+    # the same for a saved .bin (or exported .xlsx) map
+    row = {'file': filename}
+    try:
+        game_map = load_map(filename)
+        row.update({'width': game_map.width, 'height': game_map.height})
+        row.update(measure(game_map))
+        row['error'] = ''
+    except Exception as e:
+        row['error'] = repr(e)
+    return row
+
+def write_columns(rows, filename):
+    # rows may have different keys (e.g. failed maps have no metrics); missing values are left blank
+    columns = {}
+    for row in rows:
+        for key in row:
+            columns.setdefault(key, None)
+    names = list(columns)
+    if filename.endswith('.parquet'):
+        import pyarrow
+        import pyarrow.parquet
+        table = pyarrow.table({name: [row.get(name) for row in rows] for name in names})
+        pyarrow.parquet.write_table(table, filename)
+    else:
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=names)
+            writer.writeheader()
+            writer.writerows(rows)
+
+class ColumnWriter:
+    # write_columns for a stream of rows.  The columns are fixed by the first row without an error (failed rows
+    # before it are held back until then) and Parquet goes out in row groups of batch_size rows.
+    def __init__(self, filename, batch_size=1024):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.parquet = filename.endswith('.parquet')
+        self.names = None
+        self.pending = []
+        self.file = None
+        self.writer = None
+
+    def write(self, row):
+        self.pending.append(row)
+        if self.names is None:
+            if row.get('error'):
+                return
+            self.open(list(row), row)
+        if not self.parquet or len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def open(self, names, sample):
+        self.names = names
+        if self.parquet:
+            import pyarrow
+            import pyarrow.parquet
+            types = {str: pyarrow.string(), int: pyarrow.int64(), bool: pyarrow.bool_()}
+            self.schema = pyarrow.schema([(name, types.get(type(sample.get(name)), pyarrow.float64())) for name in names])
+            self.writer = pyarrow.parquet.ParquetWriter(self.filename, self.schema)
+        else:
+            self.file = open(self.filename, 'w', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=names, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.parquet:
+            import pyarrow
+            self.writer.write_table(pyarrow.Table.from_pylist([{name: row.get(name) for name in self.names} for row in self.pending], schema=self.schema))
+        else:
+            self.writer.writerows(self.pending)
+        self.pending = []
+
+    def close(self):
+        if self.names is None:
+            # every map failed
+            names = {}
+            for row in self.pending:
+                for key in row:
+                    names.setdefault(key, None)
+            self.open(list(names), self.pending[0] if self.pending else {})
+        self.flush()
+        if self.parquet:
+            self.writer.close()
+        else:
+            self.file.close()
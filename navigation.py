@@ -0,0 +1,198 @@
+from collections import deque
+
+from support_classes import *
+from derived import NEIGHBOR_OFFSETS
+
+# Precomputed enemy navigation, following the ENEMIES section of `rules`.
+#
+# Ogres: next to the player (with no wall between) they attack; within AGGRO_RANGE spaces (Manhattan) they step to
+# the neighbouring cell on a shortest route to the player, ties going to the lowest y, then lowest x; otherwise
+# they stay still.  Ogres cannot enter water or lava, and nobody walks through trees or walls.  The route may be
+# much longer than the distance when walls are in the way, so the search runs until every cell in range has one.
+#
+# The Boss behaves as an Ogre while the player is inside his 5x5 room, and otherwise walks back to its centre.
+#
+# Each action is one byte: IDLE, ATTACK, or 1-4 for a step along NEIGHBOR_OFFSETS[code - 1].
+
+AGGRO_RANGE = 5
+BOSS_ROOM_RADIUS = 2
+ENEMY_BLOCKING_TERRAIN = [TerrType.WATER, TerrType.LAVA, TerrType.TREE]
+
+IDLE = 0
+ATTACK = 5
+
+def step_code(dx, dy):
+    return NEIGHBOR_OFFSETS.index((dx, dy)) + 1
+
+def apply_action(position, code):
+    # where an enemy at position ends its turn
+    if code in [IDLE, ATTACK]:
+        return position
+    dx, dy = NEIGHBOR_OFFSETS[code - 1]
+    return Coordinates(position.x + dx, position.y + dy)
+
+class OgreNavigation:
+    # one table per player cell, built on first use: the action of an ogre standing anywhere in the
+    # (2 * aggro_range + 1)-square window centred on the player
+    def __init__(self, game_map, aggro_range=AGGRO_RANGE):
+        self.game_map = game_map
+        self.aggro_range = aggro_range
+        self.span = 2 * aggro_range + 1
+        self.steps = self.index_steps()
+        self.tables = [None] * (game_map.width * game_map.height)
+
+    def cell_id(self, x, y):
+        return y * self.game_map.width + x
+
+    def walkable(self, x, y):
+        game_map = self.game_map
+        return 0 <= x < game_map.width and 0 <= y < game_map.height and game_map.get_cell(x, y) not in ENEMY_BLOCKING_TERRAIN
+
+    def open_edge(self, x, y, nx, ny):
+        return not self.game_map.is_wall(Coordinates(x, y), Coordinates(nx, ny))
+
+    def index_steps(self):
+        # cells an enemy can step to from each cell, by cell id, as (x, y)
+        game_map = self.game_map
+        steps = [[] for _ in range(game_map.width * game_map.height)]
+        for y in range(game_map.height):
+            for x in range(game_map.width):
+                if not self.walkable(x, y):
+                    continue
+                for dx, dy in NEIGHBOR_OFFSETS:
+                    if self.walkable(x + dx, y + dy) and self.open_edge(x, y, x + dx, y + dy):
+                        steps[self.cell_id(x, y)].append((x + dx, y + dy))
+        return steps
+
+    def window_cells(self, player):
+        for y in range(player.y - self.aggro_range, player.y + self.aggro_range + 1):
+            for x in range(player.x - self.aggro_range, player.x + self.aggro_range + 1):
+                if abs(x - player.x) + abs(y - player.y) <= self.aggro_range:
+                    yield x, y
+
+    def build_table(self, player):
+        # route lengths to the player (1 = close enough to attack), then the best step from each cell in range
+        game_map = self.game_map
+        distances = {}
+        queue = deque()
+        for dx, dy in NEIGHBOR_OFFSETS:
+            nx, ny = player.x + dx, player.y + dy
+            if self.walkable(nx, ny) and self.open_edge(player.x, player.y, nx, ny):
+                distances[(nx, ny)] = 1
+                queue.append((nx, ny))
+        # stop once every walkable cell in range has its distance and so do all cells one step nearer than the
+        # farthest of them, which is all a best step needs
+        targets = {(x, y) for x, y in self.window_cells(player) if self.walkable(x, y)}
+        targets.discard((player.x, player.y))
+        pending = len(targets - distances.keys())
+        farthest = max((distances[c] for c in targets if c in distances), default=0)
+        while queue:
+            x, y = queue.popleft()
+            if not pending and distances[(x, y)] >= farthest:
+                break
+            for n in self.steps[self.cell_id(x, y)]:
+                if n not in distances and n != (player.x, player.y):
+                    distances[n] = distances[(x, y)] + 1
+                    queue.append(n)
+                    if n in targets:
+                        pending -= 1
+                        farthest = distances[n]
+
+        table = bytearray(self.span * self.span)
+        for wy in range(self.span):
+            y = player.y + wy - self.aggro_range
+            for wx in range(self.span):
+                x = player.x + wx - self.aggro_range
+                if abs(x - player.x) + abs(y - player.y) > self.aggro_range or (x, y) not in distances:
+                    continue
+                if distances[(x, y)] == 1:
+                    table[wy * self.span + wx] = ATTACK
+                    continue
+                best = min((distances[n], n[1], n[0]) for n in self.steps[self.cell_id(x, y)] if n in distances)
+                table[wy * self.span + wx] = step_code(best[2] - x, best[1] - y)
+        return bytes(table)
+
+    def table_for(self, player):
+        index = self.cell_id(player.x, player.y)
+        if self.tables[index] is None:
+            self.tables[index] = self.build_table(player)
+        return self.tables[index]
+
+    def precompute(self):
+        for y in range(self.game_map.height):
+            for x in range(self.game_map.width):
+                self.table_for(Coordinates(x, y))
+
+    def action(self, ogre, player):
+        wx, wy = ogre.x - player.x + self.aggro_range, ogre.y - player.y + self.aggro_range
+        if not (0 <= wx < self.span and 0 <= wy < self.span):
+            return IDLE
+        return self.table_for(player)[wy * self.span + wx]
+
+    def aggro_cells(self, ogre):
+        # player cells that wake an ogre standing at this spot
+        r = self.aggro_range
+        return [
+            Coordinates(ogre.x + dx, ogre.y + dy)
+            for dy in range(-r, r + 1) for dx in range(-r, r + 1)
+            if abs(dx) + abs(dy) <= r and self.game_map.is_valid_coordinates(Coordinates(ogre.x + dx, ogre.y + dy))
+        ]
+
+class BossNavigation:
+    def __init__(self, game_map, ogre_navigation, boss):
+        self.game_map = game_map
+        self.ogre_navigation = ogre_navigation
+        self.center = boss # generate_castle spawns him in the middle of his room
+        self.room = {
+            Coordinates(boss.x + dx, boss.y + dy)
+            for dx in range(-BOSS_ROOM_RADIUS, BOSS_ROOM_RADIUS + 1) for dy in range(-BOSS_ROOM_RADIUS, BOSS_ROOM_RADIUS + 1)
+        }
+        self.home_steps = self.build_home_steps()
+
+    def build_home_steps(self):
+        # the way back to the centre from anywhere he can walk, e.g. after being knocked out of the room
+        navigation = self.ogre_navigation
+        distances = {(self.center.x, self.center.y): 0}
+        queue = deque([(self.center.x, self.center.y)])
+        while queue:
+            x, y = queue.popleft()
+            for n in navigation.steps[navigation.cell_id(x, y)]:
+                # steps are symmetric (same walls and terrain both ways), so outgoing edges work in reverse
+                if n not in distances:
+                    distances[n] = distances[(x, y)] + 1
+                    queue.append(n)
+        home_steps = bytearray(self.game_map.width * self.game_map.height)
+        for (x, y), distance in distances.items():
+            if distance == 0:
+                continue
+            best = min((distances[n], n[1], n[0]) for n in navigation.steps[navigation.cell_id(x, y)] if n in distances)
+            home_steps[navigation.cell_id(x, y)] = step_code(best[2] - x, best[1] - y)
+        return bytes(home_steps)
+
+    def action(self, boss, player):
+        if player in self.room:
+            return self.ogre_navigation.action(boss, player)
+        return self.home_steps[self.ogre_navigation.cell_id(boss.x, boss.y)]
+
+class NavigationTables:
+    # navigation for every enemy on the map; ogres share one table since they all follow the same rules
+    def __init__(self, game_map, precompute=False):
+        self.game_map = game_map
+        self.ogre = OgreNavigation(game_map)
+        self.ogres = []
+        self.boss = None
+        for y in range(game_map.height):
+            for x in range(game_map.width):
+                contents = game_map.get_cell_contents(x, y)
+                if contents == CellContents.OGRE:
+                    self.ogres.append(Coordinates(x, y))
+                elif contents == CellContents.BOSS:
+                    self.boss = BossNavigation(game_map, self.ogre, Coordinates(x, y))
+        if precompute:
+            self.ogre.precompute()
+
+    def ogre_action(self, ogre, player):
+        return self.ogre.action(ogre, player)
+
+    def boss_action(self, boss, player):
+        return self.boss.action(boss, player) if self.boss is not None else IDLE
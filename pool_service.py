@@ -0,0 +1,215 @@
+import asyncio
+import http.client
+import itertools
+import json
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+from config import GenerationConfig
+from generation import generate_map_bytes
+
+# A local HTTP service that keeps a warm pool of serialized maps for each (width, height, config) that has been
+# asked for, refilled by worker processes in the background, so interactive tools get a map without waiting
+# for generate_map.
+#
+#   GET /map?width=50&height=50[&<config field>=<value>...]  -> serialization.map_to_bytes output, seed in X-Map-Seed
+#   GET /metrics                                             -> JSON: per pool depth, generation rate, wait times
+#
+# Sawblades and lava snakes are only placed when asked for, e.g. /map?width=50&height=50&hazards=true.
+#
+# Each pool counts up from its own block of 2**32 seeds, picked by its (width, height, config), starting at
+# base_seed, which is random for each run unless given.  So pools never share maps and a restart does not hand
+# out the same maps again; the seed in X-Map-Seed still reproduces a map with generation.generate_seeded_map.
+#
+# A pool whose generation fails MAX_FAILURES times in a row (e.g. a config no map can satisfy) stops, answers
+# its waiting requests with 503 and is dropped, so it does not hold one of the max_pools slots.
+
+MAX_FAILURES = 3
+
+class PoolFailed(Exception):
+    pass
+
+def first_seed(base_seed, width, height, config):
+    key = repr((width, height, sorted(config.as_dict().items())))
+    return base_seed + (zlib.crc32(key.encode()) << 32)
+
+class MapPool:
+    def __init__(self, width, height, config, depth, base_seed):
+        self.width = width
+        self.height = height
+        self.config = config
+        self.queue = asyncio.Queue(maxsize=depth)
+        self.seeds = itertools.count(first_seed(base_seed, width, height, config))
+        self.created = time.monotonic()
+        self.generated = 0
+        self.generation_seconds = 0.0
+        self.served = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.refill_tasks = []
+        self.failures = 0  # in a row; reset by every map that generates
+        self.error = None
+
+    def start(self, executor, concurrency):
+        for _ in range(concurrency):
+            self.refill_tasks.append(asyncio.ensure_future(self.refill(executor)))
+
+    async def refill(self, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            seed = next(self.seeds)
+            start = time.monotonic()
+            try:
+                data = await loop.run_in_executor(executor, generate_map_bytes, (seed, self.width, self.height, self.config))
+            except Exception as e:
+                self.failures += 1
+                print('Map pool {}x{} failed on seed {}: {!r}'.format(self.width, self.height, seed, e), file=sys.stderr)
+                if self.failures >= MAX_FAILURES:
+                    self.fail(repr(e))
+                    return
+                continue
+            self.failures = 0
+            self.generated += 1
+            self.generation_seconds += time.monotonic() - start
+            await self.queue.put((seed, data))
+
+    def fail(self, error):
+        self.error = error
+        self.stop()
+        # wake anyone already waiting in get(); each of them passes the marker on to the next
+        if not self.queue.full():
+            self.queue.put_nowait((None, None))
+
+    async def get(self):
+        if self.error is not None:
+            raise PoolFailed(self.error)
+        start = time.monotonic()
+        seed, data = await self.queue.get()
+        if seed is None:
+            self.queue.put_nowait((None, None))
+            raise PoolFailed(self.error)
+        wait = time.monotonic() - start
+        self.served += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        return seed, data
+
+    def metrics(self):
+        uptime = time.monotonic() - self.created
+        return {
+            'width': self.width,
+            'height': self.height,
+            'config': {k: v for k, v in self.config.as_dict().items() if v != getattr(GenerationConfig, k)},
+            'depth': self.queue.qsize(),
+            'capacity': self.queue.maxsize,
+            'generated': self.generated,
+            'generation_rate_per_minute': 60 * self.generated / uptime if uptime else 0.0,
+            'mean_generation_seconds': self.generation_seconds / self.generated if self.generated else None,
+            'served': self.served,
+            'mean_wait_ms': 1000 * self.total_wait / self.served if self.served else None,
+            'max_wait_ms': 1000 * self.max_wait,
+            'failures': self.failures,
+            'error': self.error,
+        }
+
+    def stop(self):
+        for task in self.refill_tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+
+class MapPoolService:
+    def __init__(self, depth=8, workers=None, refill_concurrency=2, base_seed=None, max_pools=16):
+        self.depth = depth
+        self.refill_concurrency = refill_concurrency
+        self.base_seed = base_seed if base_seed is not None else random.SystemRandom().randrange(2 ** 32)
+        self.max_pools = max_pools
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.pools = {}
+
+    def get_pool(self, width, height, config):
+        key = (width, height, config)
+        if key in self.pools and self.pools[key].error is not None:
+            del self.pools[key]
+        if key not in self.pools:
+            if len(self.pools) >= self.max_pools:
+                raise ValueError("Too many distinct map pools (max {})".format(self.max_pools))
+            pool = MapPool(width, height, config, self.depth, self.base_seed)
+            pool.start(self.executor, self.refill_concurrency)
+            self.pools[key] = pool
+        return self.pools[key]
+
+    def metrics(self):
+        return {'pools': [pool.metrics() for pool in self.pools.values()]}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass  # headers are not needed
+            if len(request_line) < 2 or request_line[0] != 'GET':
+                await self.respond(writer, 405, b'Only GET is supported\n', 'text/plain')
+                return
+            url = urlsplit(request_line[1])
+            if url.path == '/map':
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                width = int(query.pop('width', 50))
+                height = int(query.pop('height', 50))
+                config = GenerationConfig.from_strings(query)
+                pool = self.get_pool(width, height, config)
+                try:
+                    seed, data = await pool.get()
+                except PoolFailed as e:
+                    if self.pools.get((width, height, config)) is pool:
+                        del self.pools[(width, height, config)]
+                    await self.respond(writer, 503, 'Map generation keeps failing: {}\n'.format(e).encode(), 'text/plain')
+                    return
+                await self.respond(writer, 200, data, 'application/octet-stream', {'X-Map-Seed': str(seed)})
+            elif url.path == '/metrics':
+                await self.respond(writer, 200, json.dumps(self.metrics(), indent=2).encode(), 'application/json')
+            else:
+                await self.respond(writer, 404, b'Not found\n', 'text/plain')
+        except ValueError as e:
+            await self.respond(writer, 400, '{}\n'.format(e).encode(), 'text/plain')
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, body, content_type, headers=None):
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable'}[status]
+        lines = ['HTTP/1.1 {} {}'.format(status, reason), 'Content-Type: {}'.format(content_type), 'Content-Length: {}'.format(len(body)), 'Connection: close']
+        for name, value in (headers or {}).items():
+            lines.append('{}: {}'.format(name, value))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8765, warm=()):
+        for width, height in warm:
+            self.get_pool(width, height, GenerationConfig())
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Map pool service listening on http://{host}:{port} (base seed {self.base_seed})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for pool in self.pools.values():
+                pool.stop()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+def fetch_map(width=50, height=50, host='127.0.0.1', port=8765, **overrides):
+    # client helper for tools: returns (seed, Map)
+    from serialization import map_from_bytes
+    query = urlencode(dict(width=width, height=height, **overrides))
+    connection = http.client.HTTPConnection(host, port)
+    try:
+        connection.request('GET', '/map?' + query)
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise ValueError(body.decode(errors='replace').strip())
+        config = GenerationConfig.from_strings({k: str(v) for k, v in overrides.items()})
+        return int(response.getheader('X-Map-Seed')), map_from_bytes(body, config)
+    finally:
+        connection.close()
@@ -0,0 +1,165 @@
+import struct
+import zlib
+
+from support_classes import *
+from derived import WallMaskCache
+
+# Raster previews without any imaging library.  Every cell is drawn by blitting a pre-rendered tile sprite for
+# its (terrain, contents, walls) combination, so a map costs one dictionary lookup per cell plus a join per
+# pixel row.  Images are written as 8-bit RGB PNG using zlib.
+
+WALL_COLOR = (0, 0, 0)
+BACKGROUND_COLOR = (255, 255, 255)
+
+# 5x5 glyphs standing in for the CellContents symbols used in the xlsx export
+GLYPHS = {
+    '⛤': ['..#..', '#####', '.#.#.', '.###.', '#...#'],
+    '☠': ['.###.', '#.#.#', '#####', '.###.', '.#.#.'],
+    '◆': ['..#..', '.###.', '#####', '.###.', '..#..'],
+    '★': ['..#..', '..#..', '#####', '.###.', '#...#'],
+    '?': ['.###.', '#...#', '..##.', '.....', '..#..'],
+    '👹': ['#...#', '.###.', '#.#.#', '#####', '#.#.#'],
+    'Ϟ': ['...##', '..##.', '.####', '.##..', '##...'],
+    '✹': ['#.#.#', '.###.', '##.##', '.###.', '#.#.#'],
+    '∿': ['.....', '.#...', '#.#.#', '...#.', '.....'],
+}
+
+def hex_to_rgb(color):
+    color = color.lstrip('#')
+    return (int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16))
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+def encode_png(width, height, rows, level=6):
+    # rows: iterable of byte strings of width * 3 RGB bytes; height may be None when only the rows know it
+    compressor = zlib.compressobj(level)
+    compressed = []
+    row_count = 0
+    for row in rows:
+        compressed.append(compressor.compress(b'\x00' + row))  # filter type 0 (none) on every row
+        row_count += 1
+    compressed.append(compressor.flush())
+    if height is not None and row_count != height:
+        raise ValueError("Expected {} rows, got {}".format(height, row_count))
+    header = struct.pack('>IIBBBBB', width, row_count, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + _chunk(b'IHDR', header) + _chunk(b'IDAT', b''.join(compressed)) + _chunk(b'IEND', b'')
+
+def write_png(filename, width, height, rows, level=6):
+    data = encode_png(width, height, rows, level)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def write_png_array(filename, pixels, level=6):
+    # pixels: a (height, width, 3) uint8 array, e.g. from NumPy; each row is copied out once via tobytes()
+    height, width = pixels.shape[0], pixels.shape[1]
+    write_png(filename, width, height, (pixels[y].tobytes() for y in range(height)), level)
+
+class TileRenderer:
+    def __init__(self, tile_size):
+        self.tile_size = tile_size
+        self.sprites = {}
+
+    def glyph_pixels(self, symbol):
+        # which pixels of the tile the contents glyph covers
+        size = self.tile_size
+        if size < 3:
+            return {(x, y) for x in range(size) for y in range(size)}
+        if size < 6:
+            middle = size // 2
+            return {(middle, middle), (middle - 1, middle), (middle, middle - 1), (middle - 1, middle - 1)} if size % 2 == 0 else {(middle, middle)}
+        glyph = GLYPHS.get(symbol, GLYPHS['?'])
+        inner = size - 2 * max(1, size // 6)
+        offset = (size - inner) // 2
+        return {(offset + x, offset + y) for x in range(inner) for y in range(inner) if glyph[y * 5 // inner][x * 5 // inner] == '#'}
+
+    def sprite(self, terrain, contents, wall_mask):
+        key = (terrain, contents, wall_mask)
+        if key not in self.sprites:
+            size = self.tile_size
+            pixels = [[hex_to_rgb(terrain.color)] * size for _ in range(size)]
+            if contents.color is not None and contents.symbol:
+                glyph_color = hex_to_rgb(contents.color)
+                for x, y in self.glyph_pixels(contents.symbol):
+                    pixels[y][x] = glyph_color
+            if size >= 4:
+                thickness = max(1, size // 8)
+                for i in range(size):
+                    for t in range(thickness):
+                        if wall_mask & WallMaskCache.TOP:  # sprite row 0 is the top of the cell (higher y)
+                            pixels[t][i] = WALL_COLOR
+                        if wall_mask & WallMaskCache.BOTTOM:
+                            pixels[size - 1 - t][i] = WALL_COLOR
+                        if wall_mask & WallMaskCache.LEFT:
+                            pixels[i][t] = WALL_COLOR
+                        if wall_mask & WallMaskCache.RIGHT:
+                            pixels[i][size - 1 - t] = WALL_COLOR
+            self.sprites[key] = [bytes(channel for pixel in row for channel in pixel) for row in pixels]
+        return self.sprites[key]
+
+    def cell_sprites(self, game_map):
+        # sprites for each map row, top row (highest y) first, matching the xlsx layout
+        walls = WallMaskCache() if self.tile_size >= 4 else None
+        if walls is not None:
+            walls.attach(game_map)
+        for alt_y in range(game_map.height):
+            y = game_map.height - 1 - alt_y
+            terrain_row = game_map.cells[y]
+            contents_row = game_map.cell_contents[y]
+            mask_row = walls.masks[y] if walls is not None else [0] * game_map.width
+            yield [self.sprite(terrain_row[x], contents_row[x], mask_row[x]) for x in range(game_map.width)]
+
+    def rows(self, game_map):
+        for sprites in self.cell_sprites(game_map):
+            for i in range(self.tile_size):
+                yield b''.join(sprite[i] for sprite in sprites)
+
+_renderers = {}
+
+def get_renderer(tile_size):
+    if tile_size not in _renderers:
+        _renderers[tile_size] = TileRenderer(tile_size)
+    return _renderers[tile_size]
+
+def render_map_png(game_map, tile_size=8):
+    renderer = get_renderer(tile_size)
+    return encode_png(game_map.width * tile_size, game_map.height * tile_size, renderer.rows(game_map))
+
+def export_png(game_map, filename, tile_size=8):
+    with open(filename, 'wb') as f:
+        f.write(render_map_png(game_map, tile_size))
+
+def contact_sheet_rows(maps, columns, cell_width, cell_height, tile_size, padding):
+    # maps is consumed `columns` at a time, so only one band of maps is in memory at once;
+    # cell_width / cell_height are the largest map dimensions, in cells, on the sheet
+    renderer = get_renderer(tile_size)
+    background = bytes(BACKGROUND_COLOR)
+    pixel_width, pixel_height = cell_width * tile_size, cell_height * tile_size
+    sheet_width = columns * pixel_width + (columns + 1) * padding
+    gap = background * padding
+    empty = background * pixel_width
+    iterator = iter(maps)
+    yield from (background * sheet_width for _ in range(padding))
+    while True:
+        band = [m for _, m in zip(range(columns), iterator)]
+        if not band:
+            return
+        for m in band:
+            if m.width > cell_width or m.height > cell_height:
+                raise ValueError("Map of {}x{} does not fit a {}x{} contact sheet cell".format(m.width, m.height, cell_width, cell_height))
+        band_rows = [renderer.rows(m) for m in band]
+        for y in range(pixel_height):
+            parts = [gap]
+            for rows in band_rows:
+                row = next(rows, b'')
+                parts.append(row + background * (pixel_width - len(row) // 3))
+                parts.append(gap)
+            for _ in range(columns - len(band)):
+                parts.append(empty)
+                parts.append(gap)
+            yield b''.join(parts)
+        yield from (background * sheet_width for _ in range(padding))
+
+def write_contact_sheet(maps, filename, map_width, map_height, columns=10, tile_size=2, padding=4):
+    sheet_width = columns * map_width * tile_size + (columns + 1) * padding
+    write_png(filename, sheet_width, None, contact_sheet_rows(maps, columns, map_width, map_height, tile_size, padding))
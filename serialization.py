@@ -0,0 +1,140 @@
+import struct
+import sys
+import zlib
+from array import array
+
+from support_classes import *
+from map import Map
+
+# Compact binary form of a finished Map: a fixed header, then one byte per cell for terrain and contents,
+# a uint32 per cell for room numbers, and int32 quadruples (x1, y1, x2, y2) for doors and forced walls.
+# Version 2 adds int32 hazards: the sawblade count, then each path as its length and (x, y) pairs, then the
+# lava snake count and their (x, y) pairs.  Version 3 puts the number of hazard ints in front of them and adds
+# Map.retry_counts at the end: a uint32 stage count, then per stage a uint8 name length, the name (UTF-8) and a
+# uint32 count.  Version 1 and 2 maps still load, without hazards or retry counts respectively.
+MAGIC = b'GGMP'
+VERSION = 3
+HEADER = struct.Struct('<4sBBIIIII')  # magic, version, compressed, width, height, next_room_number, door count, wall count
+TERRAIN_CODES = list(TerrType)
+CONTENTS_CODES = list(CellContents)
+TERRAIN_INDEX = {t: i for i, t in enumerate(TERRAIN_CODES)}
+CONTENTS_INDEX = {c: i for i, c in enumerate(CONTENTS_CODES)}
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def _edges_to_array(edges):
+    values = array('i')
+    for coord1, coord2 in edges:
+        values.extend((coord1.x, coord1.y, coord2.x, coord2.y))
+    return _little_endian(values)
+
+def _array_to_edges(values):
+    return [(Coordinates(values[i], values[i + 1]), Coordinates(values[i + 2], values[i + 3])) for i in range(0, len(values), 4)]
+
+def _hazards_to_array(game_map):
+    values = array('i', [len(game_map.sawblades)])
+    for path in game_map.sawblades:
+        values.append(len(path))
+        for coord in path:
+            values.extend((coord.x, coord.y))
+    values.append(len(game_map.lava_snakes))
+    for coord in game_map.lava_snakes:
+        values.extend((coord.x, coord.y))
+    return _little_endian(values)
+
+def _array_to_hazards(values):
+    sawblades = []
+    offset = 1
+    for _ in range(values[0]):
+        length = values[offset]
+        sawblades.append([Coordinates(values[offset + 1 + 2 * i], values[offset + 2 + 2 * i]) for i in range(length)])
+        offset += 1 + 2 * length
+    lava_snakes = [Coordinates(values[offset + 1 + 2 * i], values[offset + 2 + 2 * i]) for i in range(values[offset])]
+    return sawblades, lava_snakes
+
+def _retries_to_bytes(retry_counts):
+    parts = [struct.pack('<I', len(retry_counts))]
+    for stage, count in retry_counts.items():
+        name = stage.encode('utf-8')
+        parts.append(struct.pack('<B', len(name)) + name + struct.pack('<I', count))
+    return b''.join(parts)
+
+def _bytes_to_retries(data):
+    retry_counts = {}
+    (stage_count,) = struct.unpack_from('<I', data, 0)
+    offset = 4
+    for _ in range(stage_count):
+        length = data[offset]
+        stage = bytes(data[offset + 1:offset + 1 + length]).decode('utf-8')
+        (retry_counts[stage],) = struct.unpack_from('<I', data, offset + 1 + length)
+        offset += 5 + length
+    return retry_counts
+
+def map_to_bytes(game_map, compress=True):
+    terrain = bytes(TERRAIN_INDEX[cell] for row in game_map.cells for cell in row)
+    contents = bytes(CONTENTS_INDEX[cell] for row in game_map.cell_contents for cell in row)
+    rooms = _little_endian(array('I', (room for row in game_map.room_numbers for room in row)))
+    hazards = _hazards_to_array(game_map)
+    body = b''.join([
+        terrain, contents, rooms.tobytes(), _edges_to_array(game_map.doors).tobytes(), _edges_to_array(game_map.forced_walls).tobytes(),
+        struct.pack('<I', len(hazards)), hazards.tobytes(), _retries_to_bytes(game_map.retry_counts),
+    ])
+    if compress:
+        body = zlib.compress(body, 6)
+    header = HEADER.pack(MAGIC, VERSION, int(compress), game_map.width, game_map.height, game_map.next_room_number, len(game_map.doors), len(game_map.forced_walls))
+    return header + body
+
+def map_from_bytes(data, config=None):
+    magic, version, compressed, width, height, next_room_number, door_count, wall_count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a serialized map")
+    if version not in (1, 2, VERSION):
+        raise ValueError("Unsupported map format version: {}".format(version))
+    body = data[HEADER.size:]
+    if compressed:
+        body = zlib.decompress(body)
+    area = width * height
+    offset = 0
+    terrain = body[offset:offset + area]
+    offset += area
+    contents = body[offset:offset + area]
+    offset += area
+    rooms = _little_endian(array('I', body[offset:offset + area * 4]))
+    offset += area * 4
+    doors = _little_endian(array('i', body[offset:offset + door_count * 16]))
+    offset += door_count * 16
+    walls = _little_endian(array('i', body[offset:offset + wall_count * 16]))
+    offset += wall_count * 16
+
+    game_map = Map(width, height, config)
+    game_map.cells = [[TERRAIN_CODES[terrain[y * width + x]] for x in range(width)] for y in range(height)]
+    game_map.cell_contents = [[CONTENTS_CODES[contents[y * width + x]] for x in range(width)] for y in range(height)]
+    game_map.room_numbers = [list(rooms[y * width:(y + 1) * width]) for y in range(height)]
+    game_map.next_room_number = next_room_number
+    game_map.doors = _array_to_edges(doors)
+    game_map.forced_walls = _array_to_edges(walls)
+    game_map.index_edges()
+    if version == 2:
+        game_map.sawblades, game_map.lava_snakes = _array_to_hazards(_little_endian(array('i', body[offset:])))
+    elif version >= 3:
+        (hazard_count,) = struct.unpack_from('<I', body, offset)
+        offset += 4
+        game_map.sawblades, game_map.lava_snakes = _array_to_hazards(_little_endian(array('i', body[offset:offset + hazard_count * 4])))
+        offset += hazard_count * 4
+        game_map.retry_counts = _bytes_to_retries(body[offset:])
+    return game_map
+
+def save_map(game_map, filename):
+    with open(filename, 'wb') as f:
+        f.write(map_to_bytes(game_map))
+
+def load_map(filename, config=None):
+    if filename.endswith('.xlsx'):
+        # archived export_to_excel workbooks load directly, so they fit any pipeline that takes .bin files
+        from xlsx_import import import_from_excel
+        return import_from_excel(filename, config)
+    with open(filename, 'rb') as f:
+        return map_from_bytes(f.read(), config)
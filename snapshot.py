@@ -0,0 +1,213 @@
+import contextlib
+import itertools
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from support_classes import *
+from derived import NEIGHBOR_OFFSETS
+from map import Map
+from serialization import TERRAIN_CODES, TERRAIN_INDEX, CONTENTS_CODES, CONTENTS_INDEX, _hazards_to_array, _array_to_hazards, _little_endian
+
+# Read-only Map snapshots in shared memory, for analysis spread over worker processes.  One block holds a small
+# header, then per cell: terrain (uint8), contents (uint8), an edge mask (uint8: bits 0-3 doors, bits 4-7 forced
+# walls, in NEIGHBOR_OFFSETS order) and the room number (uint32), followed by the door, wall and hazard lists so
+# the map can be rebuilt exactly.  Workers read straight out of the block; pickling a snapshot only sends its
+# name, so passing one to a task costs the same for a 50x50 map as for a 2000x2000 one.
+#
+# The process that created a snapshot owns it and unlinks it in close(); the memory itself goes away once the
+# last process that attached has exited or closed it.  A worker keeps only the snapshot it used last: attaching
+# to another closes the old one, so a long-lived executor reused across snapshots holds at most one block per
+# worker, and release_attached() drops that too.  snapshot_pool() does all of this around an executor.
+
+SNAPSHOT_MAGIC = b'GGSS'
+SNAPSHOT_HEADER = struct.Struct('<4sIIIIII')  # magic, width, height, next_room_number, door count, wall count, hazard ints
+DOOR_SHIFT, WALL_SHIFT = 0, 4
+
+def edge_bit(coord1, coord2):
+    return NEIGHBOR_OFFSETS.index((coord2.x - coord1.x, coord2.y - coord1.y))
+
+class MapSnapshot:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        magic, width, height, next_room_number, door_count, wall_count, hazard_count = SNAPSHOT_HEADER.unpack_from(shm.buf, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not a map snapshot: {}".format(shm.name))
+        self.width = width
+        self.height = height
+        self.next_room_number = next_room_number
+        area = width * height
+        offset = SNAPSHOT_HEADER.size
+        buf = self.buf = shm.buf.toreadonly()  # every view is read-only; create() writes through shm.buf
+        self.terrain = buf[offset:offset + area]
+        offset += area
+        self.contents = buf[offset:offset + area]
+        offset += area
+        self.edge_masks = buf[offset:offset + area]
+        offset += area
+        offset += -offset % 4
+        self.rooms = buf[offset:offset + area * 4].cast('I')
+        offset += area * 4
+        self.door_values = buf[offset:offset + door_count * 16].cast('i')
+        offset += door_count * 16
+        self.wall_values = buf[offset:offset + wall_count * 16].cast('i')
+        offset += wall_count * 16
+        self.hazard_values = buf[offset:offset + hazard_count * 4].cast('i')
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @classmethod
+    def create(cls, game_map):
+        width, height = game_map.width, game_map.height
+        area = width * height
+        hazards = _hazards_to_array(game_map)
+        edge_masks = bytearray(area)
+        for edges, shift in [(game_map.doors, DOOR_SHIFT), (game_map.forced_walls, WALL_SHIFT)]:
+            for coord1, coord2 in edges:
+                edge_masks[coord1.y * width + coord1.x] |= 1 << (edge_bit(coord1, coord2) + shift)
+                edge_masks[coord2.y * width + coord2.x] |= 1 << (edge_bit(coord2, coord1) + shift)
+        padding = -(SNAPSHOT_HEADER.size + 3 * area) % 4
+        size = SNAPSHOT_HEADER.size + 3 * area + padding + 4 * area + 16 * (len(game_map.doors) + len(game_map.forced_walls)) + 4 * len(hazards)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        parts = [
+            SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, width, height, game_map.next_room_number, len(game_map.doors), len(game_map.forced_walls), len(hazards)),
+            bytes(TERRAIN_INDEX[cell] for row in game_map.cells for cell in row),
+            bytes(CONTENTS_INDEX[cell] for row in game_map.cell_contents for cell in row),
+            bytes(edge_masks),
+            bytes(padding),
+            array('I', (room for row in game_map.room_numbers for room in row)).tobytes(),
+            array('i', (v for coord1, coord2 in game_map.doors for v in (coord1.x, coord1.y, coord2.x, coord2.y))).tobytes(),
+            array('i', (v for coord1, coord2 in game_map.forced_walls for v in (coord1.x, coord1.y, coord2.x, coord2.y))).tobytes(),
+            hazards.tobytes(),
+        ]
+        offset = 0
+        for part in parts:
+            shm.buf[offset:offset + len(part)] = part
+            offset += len(part)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        # one attachment per process, however many tasks receive the snapshot, and only for the latest snapshot
+        if name not in _attached:
+            release_attached()
+            _attached[name] = cls(shared_memory.SharedMemory(name=name), owner=False)
+        return _attached[name]
+
+    def __reduce__(self):
+        return (MapSnapshot.attach, (self.name,))
+
+    def close(self):
+        for view in [self.terrain, self.contents, self.edge_masks, self.rooms, self.door_values, self.wall_values, self.hazard_values, self.buf]:
+            view.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        _attached.pop(self.name, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # the read side of Map
+    def get_cell(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return TERRAIN_CODES[self.terrain[y * self.width + x]]
+        return None
+
+    def get_cell_contents(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return CONTENTS_CODES[self.contents[y * self.width + x]]
+        return None
+
+    def get_room_number(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.rooms[y * self.width + x]
+        return None
+
+    def has_edge(self, coord1, coord2, shift):
+        if not self.is_valid_coordinates(coord1) or coord1.get_distance(coord2) != 1:
+            return False
+        return bool(self.edge_masks[coord1.y * self.width + coord1.x] >> (edge_bit(coord1, coord2) + shift) & 1)
+
+    def is_door(self, coord1, coord2):
+        return self.has_edge(coord1, coord2, DOOR_SHIFT)
+
+    def is_forced_wall(self, coord1, coord2):
+        return self.has_edge(coord1, coord2, WALL_SHIFT)
+
+    def reachable_set(self, blocking_terrain_types):
+        # Map keeps a ReachabilityCache for this; a snapshot never changes, so it just floods
+        return set(self.flood_fill(Coordinates(0, 0), blocking_terrain_types, blocked_walls=True))
+
+    # read-only algorithms that only use the accessors above
+    is_wall = Map.is_wall
+    is_valid_coordinates = Map.is_valid_coordinates
+    flood_fill = Map.flood_fill
+    reachable_coordinates = Map.reachable_coordinates
+
+    def to_map(self, config=None):
+        # a private, mutable copy
+        game_map = Map(self.width, self.height, config)
+        width = self.width
+        game_map.cells = [[TERRAIN_CODES[code] for code in self.terrain[y * width:(y + 1) * width]] for y in range(self.height)]
+        game_map.cell_contents = [[CONTENTS_CODES[code] for code in self.contents[y * width:(y + 1) * width]] for y in range(self.height)]
+        game_map.room_numbers = [list(self.rooms[y * width:(y + 1) * width]) for y in range(self.height)]
+        game_map.next_room_number = self.next_room_number
+        for values, edges in [(self.door_values, game_map.doors), (self.wall_values, game_map.forced_walls)]:
+            for i in range(0, len(values), 4):
+                edges.append((Coordinates(values[i], values[i + 1]), Coordinates(values[i + 2], values[i + 3])))
+        game_map.index_edges()
+        if len(self.hazard_values):
+            game_map.sawblades, game_map.lava_snakes = _array_to_hazards(_little_endian(array('i', self.hazard_values.tobytes())))
+        return game_map
+
+_attached = {}
+
+def release_attached(_=None):
+    # closes this process's attachments; also usable as a task, to release a worker's
+    for snapshot in list(_attached.values()):
+        snapshot.close()
+
+@contextlib.contextmanager
+def snapshot_pool(game_map, max_workers=None, executor=None):
+    # yields (snapshot, executor); submit tasks that take the snapshot as an argument.  Workers attach on their
+    # first task, and the block is unlinked once the pool has shut down.  An executor passed in is reused and
+    # left running, so wait for the snapshot's tasks before leaving the block; its workers let go of the
+    # snapshot when they next attach to another one.
+    snapshot = MapSnapshot.create(game_map)
+    try:
+        if executor is not None:
+            yield snapshot, executor
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                yield snapshot, executor
+    finally:
+        snapshot.close()
+
+def _reachable_for(task):
+    snapshot, blocking = task
+    island = snapshot.flood_fill(Coordinates(0, 0), blocking, blocked_walls=True)
+    return blocking, island
+
+def parallel_reachable_coordinates(game_map, max_workers=None):
+    # Map.reachable_coordinates(verbose=False), with the 16 flood fills spread over worker processes
+    reachable_terrains = [t for t in TerrType if t.clear_terrain]
+    possible_blocking_terrains = [TerrType.LAVA, TerrType.WATER, TerrType.TREE, TerrType.DESERT]
+    combos = [tuple(subset) for r in range(len(possible_blocking_terrains) + 1) for subset in itertools.combinations(possible_blocking_terrains, r)]
+    results = {}
+    with snapshot_pool(game_map, max_workers) as (snapshot, executor):
+        for combo, island in executor.map(_reachable_for, [(snapshot, combo) for combo in combos]):
+            items = tuple(b for b in possible_blocking_terrains if b not in combo)
+            results[items] = {
+                'all': island,
+                'clear': [c for c in island if game_map.get_cell(c.x, c.y) in reachable_terrains],
+            }
+    return results
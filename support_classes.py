@@ -81,6 +81,8 @@ class CellContents(Enum):
     AXE = ("Axe", "★", "#FF8000")
     ITEM = ("Item", "?", "#FF00FF") # when we haven't decided what it is yet
     FORCE_EMPTY = ("Force Empty", '', None)  # used to force empty cells in the grid
+    SAWBLADE = ("Sawblade", "✹", "#404040") # where the blade starts; its path is in Map.sawblades
+    LAVA_SNAKE = ("Lava Snake", "∿", "#FFC000")
     
     @property
     def symbol(self):
@@ -0,0 +1,67 @@
+import itertools
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from config import GenerationConfig
+from generation import generate_seeded_map
+import metrics
+
+def grid_configs(grid, base_config=None):
+    # grid maps config field names to lists of values; yields every combination
+    base_config = base_config if base_config is not None else GenerationConfig()
+    names = sorted(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield base_config.with_overrides(**dict(zip(names, values)))
+
+def random_configs(ranges, count, base_config=None, sweep_seed=0):
+    # ranges maps field names to (low, high) tuples or to lists of choices
+    base_config = base_config if base_config is not None else GenerationConfig()
+    rng = random.Random(sweep_seed)
+    names = sorted(ranges)
+    for _ in range(count):
+        overrides = {}
+        for name in names:
+            spec = ranges[name]
+            if isinstance(spec, tuple):
+                low, high = spec
+                if isinstance(low, int) and isinstance(high, int):
+                    overrides[name] = rng.randint(low, high)
+                else:
+                    overrides[name] = rng.uniform(low, high)
+            else:
+                overrides[name] = rng.choice(spec)
+        yield base_config.with_overrides(**overrides)
+
+def run_trial(task):
+    config_index, config, seed, width, height = task
+    row = {'config_index': config_index, 'seed': seed, 'width': width, 'height': height}
+    for name, value in config.as_dict().items():
+        row['cfg_{}'.format(name)] = value
+    try:
+        game_map = generate_seeded_map(seed, width, height, config)
+        row.update(metrics.map_metrics(game_map))
+        row['error'] = ''
+    except Exception as e:  # a bad config should show up in the results, not kill the sweep
+        row['error'] = repr(e)
+    return row
+
+def run_sweep(configs, seeds, width, height, filename, max_workers=None):
+    seeds = list(seeds)
+    tasks = [(i, config, seed, width, height) for i, config in enumerate(configs) for seed in seeds]
+    rows = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for row in executor.map(run_trial, tasks):
+            rows.append(row)
+            if row['error']:
+                print('Config {} seed {} failed: {}'.format(row['config_index'], row['seed'], row['error']), file=sys.stderr)
+    metrics.write_columns(rows, filename)
+    print(f"Wrote {len(rows)} results for {len(tasks) // max(len(seeds), 1)} configs to '{filename}'.")
+    return rows
+
+if __name__ == "__main__":
+    configs = grid_configs({
+        'building_density_max': [0.08, 0.10, 0.12],
+        'forest_count_max': [4, 5, 6],
+    })
+    run_sweep(configs, range(42, 44), 50, 50, 'sweep_results.csv')
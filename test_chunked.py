@@ -0,0 +1,27 @@
+import pytest
+
+from support_classes import *
+from chunked import generate_chunked_map, tile_grid
+from serialization import map_to_bytes
+
+WIDTH = HEIGHT = 120
+TILE_SIZE = 40
+
+@pytest.mark.parametrize('seed', [3, 4])
+def test_same_map_whatever_the_worker_count(seed):
+    in_process = generate_chunked_map(seed, WIDTH, HEIGHT, tile_size=TILE_SIZE, max_workers=0)
+    assert map_to_bytes(generate_chunked_map(seed, WIDTH, HEIGHT, tile_size=TILE_SIZE, max_workers=2)) == map_to_bytes(in_process)
+
+@pytest.mark.parametrize('seed', [3, 4])
+def test_tile_seams_leave_no_closed_pockets(seed):
+    # ignoring terrain, every cell next to a seam can be walked to through doors
+    game_map = generate_chunked_map(seed, WIDTH, HEIGHT, tile_size=TILE_SIZE, max_workers=0)
+    reachable = set(game_map.flood_fill(Coordinates(0, 0), [], blocked_walls=True))
+    seam_cells = set()
+    for index, (min_x, min_y, max_x, max_y) in tile_grid(WIDTH, HEIGHT, TILE_SIZE):
+        for x in range(min_x, max_x):
+            seam_cells.update([Coordinates(x, min_y), Coordinates(x, max_y - 1)])
+        for y in range(min_y, max_y):
+            seam_cells.update([Coordinates(min_x, y), Coordinates(max_x - 1, y)])
+    assert game_map.room_numbers != [[0] * WIDTH for _ in range(HEIGHT)]
+    assert sorted(seam_cells - reachable) == []
@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from corpus_stats import CorpusSummary, QuantileSketch, QUANTILES, RELATIVE_ACCURACY
+
+def rows(count, seed=0):
+    # metric rows like map_metrics gives, with a metric that only some maps have and the odd failed map
+    rng = random.Random(seed)
+    result = []
+    for i in range(count):
+        if i % 37 == 5:
+            result.append({'seed': i, 'error': 'ValueError()'})
+            continue
+        row = {'seed': i, 'error': '', 'share_grass': rng.random(), 'room_count': rng.randint(0, 40), 'dist_gem': rng.lognormvariate(3, 1) - 5}
+        if rng.random() < 0.3:
+            row['reach_clear_axe'] = rng.randint(100, 2000)
+        result.append(row)
+    return result
+
+@pytest.mark.parametrize('values', [
+    [random.Random(1).lognormvariate(0, 2) for _ in range(5000)],
+    [random.Random(2).uniform(-100, 100) for _ in range(5000)] + [0.0] * 50,
+])
+def test_sketch_quantiles_within_relative_accuracy(values):
+    sketch = QuantileSketch()
+    for value in values:
+        sketch.add(value)
+    ordered = sorted(values)
+    for q in QUANTILES + [0.0, 1.0]:
+        true = ordered[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - true) <= RELATIVE_ACCURACY * abs(true) + 1e-12, q
+
+def test_merged_summaries_match_one_pass():
+    data = rows(600)
+    whole = CorpusSummary()
+    for row in data:
+        whole.add_row(row)
+    merged = CorpusSummary()
+    for start in range(0, len(data), 64):
+        chunk = CorpusSummary()
+        for row in data[start:start + 64]:
+            chunk.add_row(row)
+        merged.merge(chunk)
+    assert (merged.maps, merged.failed) == (whole.maps, whole.failed) == (600, 17)
+    assert merged.histogram_rows() == whole.histogram_rows()
+    expected = {row['metric']: row for row in whole.summary_rows()}
+    for row in merged.summary_rows():
+        assert row == pytest.approx(expected[row['metric']])
+    assert expected['reach_clear_axe']['count'] + expected['reach_clear_axe']['missing'] == 600 - 17
@@ -0,0 +1,136 @@
+import random
+
+import pytest
+
+from support_classes import *
+from derived import WallMaskCache, DistanceToTerrainCache, ReachabilityCache, IslandCache, OccupancyIndex
+from generation import generate_seeded_map
+from map import Map
+
+# Each cache is kept registered through a run of random edits and compared, after every few edits, with a
+# fresh copy built from scratch.
+
+BLOCKING = [TerrType.WATER, TerrType.TREE]
+
+def snapshot(cache):
+    if isinstance(cache, WallMaskCache):
+        return [list(row) for row in cache.masks]
+    if isinstance(cache, DistanceToTerrainCache):
+        return [list(row) for row in cache.distances]
+    if isinstance(cache, ReachabilityCache):
+        return set(cache.reachable)
+    # islands are compared as a partition; labels are arbitrary
+    return {frozenset(cells) for cells in cache.islands.values()}
+
+def fresh(cache_type, game_map):
+    cache = make_cache(cache_type)
+    cache.attach(game_map)
+    return cache
+
+def make_cache(cache_type):
+    if cache_type is WallMaskCache:
+        return WallMaskCache()
+    if cache_type is DistanceToTerrainCache:
+        return DistanceToTerrainCache([TerrType.WATER])
+    if cache_type is ReachabilityCache:
+        return ReachabilityCache(Coordinates(0, 0), BLOCKING)
+    return IslandCache(BLOCKING)
+
+def random_edit(game_map, rng):
+    x, y = rng.randrange(game_map.width), rng.randrange(game_map.height)
+    here = Coordinates(x, y)
+    neighbor = rng.choice(here.get_neighboring_coordinates())
+    kind = rng.random()
+    if kind < 0.5:
+        game_map.set_cell(x, y, rng.choice(list(TerrType)))
+    elif kind < 0.7:
+        game_map.set_room_number(x, y, rng.choice([0, game_map.get_room_number(neighbor.x, neighbor.y) or 0, 999]))
+    elif kind < 0.85:
+        if not game_map.is_forced_wall(here, neighbor):
+            game_map.add_door(here, neighbor)
+    elif game_map.is_valid_coordinates(neighbor) and not game_map.is_door(here, neighbor):
+        game_map.add_forced_wall(here, neighbor)
+
+@pytest.fixture
+def game_map():
+    return generate_seeded_map(5, 50, 50)
+
+@pytest.mark.parametrize('cache_type', [WallMaskCache, DistanceToTerrainCache, ReachabilityCache, IslandCache])
+def test_cache_matches_rebuild_after_edits(game_map, cache_type):
+    rng = random.Random(cache_type.__name__)
+    cache = game_map.register_cache(make_cache(cache_type))
+    for step in range(400):
+        random_edit(game_map, rng)
+        if step % 7 == 0:
+            cache.refresh()
+            assert snapshot(cache) == snapshot(fresh(cache_type, game_map)), 'diverged after edit {}'.format(step)
+
+@pytest.mark.parametrize('cache_type', [WallMaskCache, DistanceToTerrainCache, ReachabilityCache, IslandCache])
+def test_cache_matches_rebuild_after_rollback(game_map, cache_type):
+    rng = random.Random(cache_type.__name__)
+    cache = game_map.register_cache(make_cache(cache_type))
+    before = snapshot(cache)
+    with game_map.transaction() as trial:
+        for _ in range(50):
+            random_edit(game_map, rng)
+        cache.refresh()
+        trial.rollback()
+    cache.refresh()
+    assert snapshot(cache) == before
+
+def test_cache_rebuilds_after_many_edits(game_map):
+    # past a quarter of the map the cache stops tracking cells and rebuilds on the next read
+    cache = game_map.register_cache(IslandCache(BLOCKING))
+    for y in range(game_map.height):
+        for x in range(game_map.width // 2):
+            game_map.set_cell(x, y, TerrType.WATER if (x + y) % 3 else TerrType.GRASS)
+    assert cache.stale and not cache.dirty
+    cache.refresh()
+    assert snapshot(cache) == snapshot(fresh(IslandCache, game_map))
+
+def test_reachable_coordinates_follow_edits(game_map):
+    rng = random.Random(2)
+    game_map.reachable_coordinates(verbose=False)
+    for _ in range(100):
+        random_edit(game_map, rng)
+    for items, result in game_map.reachable_coordinates(verbose=False).items():
+        blocking = [t for t in [TerrType.LAVA, TerrType.WATER, TerrType.TREE, TerrType.DESERT] if t not in items]
+        assert set(result['all']) == set(game_map.flood_fill(Coordinates(0, 0), blocking, blocked_walls=True))
+
+def test_bridge_islands_match_split_map_by_terrain():
+    # generate_bridges floods only the cells it picks, within the island IslandCache found; the cells must come
+    # in the order split_map_by_terrain gives, even after a bridge joins two islands
+    rng = random.Random(3)
+    game_map = Map(14, 14)
+    for y in range(14):
+        for x in range(14):
+            if x in (5, 6) or y == 9 or rng.random() < 0.15:
+                game_map.set_cell(x, y, TerrType.WATER)
+    islands = game_map.split_map_by_terrain([TerrType.WATER])
+    split = IslandCache([TerrType.WATER])
+    split.attach(game_map)
+    starts = [Coordinates(x, y) for y in range(14) for x in range(14) if split.labels[y][x] is not None]
+    assert len(starts) == len(islands) and len(split.islands) > 2
+    game_map.draw_river(Coordinates(4, 2), Coordinates(7, 2), set_terrain=TerrType.ROAD, meander_coeff=0.0, widen_iterations=0)
+    for start, island in zip(starts, islands):
+        assert game_map.flood_fill(start, [TerrType.WATER], within=split.islands[split.labels[start.y][start.x]]) == island
+
+def test_occupancy_anchors_match_brute_force(game_map):
+    # anchors flush with the top and right edges count too
+    rng = random.Random(4)
+    occupancy = game_map.register_cache(OccupancyIndex([TerrType.WATER, TerrType.BUILDING]))
+    sizes = [(1, 1), (3, 2), (6, 6), (50, 1)]
+    for step in range(200):
+        random_edit(game_map, rng)
+        if step % 10 == 0:
+            occupancy.refresh()
+            assert occupancy.table == game_map.summed_area_table([TerrType.WATER, TerrType.BUILDING])
+            for x_size, y_size in sizes:
+                expected = [
+                    Coordinates(x, y) for y in range(game_map.height - y_size + 1) for x in range(game_map.width - x_size + 1)
+                    if all(game_map.get_cell(x + dx, y + dy) not in [TerrType.WATER, TerrType.BUILDING] for dx in range(x_size) for dy in range(y_size))
+                ]
+                assert list(occupancy.anchors(x_size, y_size)) == expected
+                assert occupancy.anchor_count(x_size, y_size) == len(expected)
+                assert (occupancy.random_anchor(x_size, y_size) in expected) if expected else occupancy.random_anchor(x_size, y_size) is None
+    assert occupancy.anchor_count(51, 1) == 0 and occupancy.random_anchor(1, 51) is None
@@ -0,0 +1,50 @@
+import pickle
+
+import pytest
+
+from support_classes import *
+from fingerprint import SimilarityIndex, fingerprint, similarity, stable_hash, group_near_duplicates
+from generation import generate_seeded_map
+from serialization import map_from_bytes, map_to_bytes
+
+@pytest.fixture(scope='module')
+def maps():
+    return [generate_seeded_map(seed, 50, 50) for seed in [1, 2, 3]]
+
+def near_copy(game_map):
+    # the same layout with a few cells changed
+    copy = map_from_bytes(map_to_bytes(game_map))
+    for x, y in [(0, 0), (20, 30), (45, 5)]:
+        copy.set_cell(x, y, TerrType.TREE)
+    return copy
+
+def test_finds_a_near_duplicate(maps):
+    index = SimilarityIndex()
+    for seed, game_map in enumerate(maps):
+        index.add(seed, fingerprint(game_map))
+    copy = fingerprint(near_copy(maps[1]))
+    matches = index.query(copy, threshold=0.8)
+    assert [key for key, score in matches] == [1]
+    assert similarity(copy, index.signatures[0]) < 0.5
+
+def test_group_near_duplicates(maps):
+    keyed = [('a', fingerprint(maps[0])), ('b', fingerprint(maps[1])), ('b2', fingerprint(near_copy(maps[1])))]
+    rows = list(group_near_duplicates(keyed))
+    assert [row['duplicate_of'] for row in rows] == [None, None, 'b']
+
+def test_hashes_are_stable():
+    # pinned, so index files keep their meaning on other interpreters
+    assert stable_hash((0, 1, 2, 3)) == 16958249009808338657
+
+def test_saved_index_round_trip(maps, tmp_path):
+    index = SimilarityIndex()
+    index.add('a', fingerprint(maps[0]))
+    filename = str(tmp_path / 'index.pickle')
+    index.save(filename)
+    loaded = SimilarityIndex.load(filename)
+    assert loaded.query(fingerprint(maps[0]))[0] == ('a', 1.0)
+    del index.version  # as written before the hashes were made stable
+    with open(filename, 'wb') as f:
+        pickle.dump(index, f)
+    with pytest.raises(ValueError):
+        SimilarityIndex.load(filename)
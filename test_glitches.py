@@ -0,0 +1,41 @@
+from support_classes import *
+from glitches import GlitchIndex, CLIP_COST, WARP_COST, MOMENTUM_OFFSET
+from map import Map
+
+def walled_room_map():
+    # a closed 2x2 building in the middle of a 6x6 field, so its corners are the only way in
+    game_map = Map(6, 6)
+    game_map.add_room([Coordinates(x, y) for x in (2, 3) for y in (2, 3)])
+    return game_map
+
+def test_corner_clips_on_a_wall_corner():
+    index = GlitchIndex(walled_room_map())
+    assert len(index.corner_clips) == 4
+    assert set(index.corner_clips) == {
+        (Coordinates(1, 1), Coordinates(2, 2)),
+        (Coordinates(4, 1), Coordinates(3, 2)),
+        (Coordinates(1, 4), Coordinates(2, 3)),
+        (Coordinates(4, 4), Coordinates(3, 3)),
+    }
+    outside, inside = Coordinates(1, 1), index.cell_id(Coordinates(3, 3))
+    assert inside not in index.shortest_paths(outside, 'walk')
+    assert index.shortest_paths(outside, 'corner_clip')[inside] == CLIP_COST + 2  # clip, then two steps inside
+
+def test_no_clip_into_occupied_or_blocked_corners():
+    game_map = walled_room_map()
+    game_map.set_cell_contents(2, 2, CellContents.OGRE)
+    game_map.set_cell(3, 3, TerrType.TREE)
+    corners = {corner for position, corner in GlitchIndex(game_map).corner_clips}
+    assert corners == {Coordinates(3, 2), Coordinates(2, 3)}
+
+def test_warp_momentum_lands_past_the_shrine():
+    game_map = Map(12, 12)
+    for x, y in [(1, 1), (6, 6)]:
+        game_map.set_cell_contents(x, y, CellContents.SHRINE)
+    game_map.set_cell(6 + MOMENTUM_OFFSET, 6, TerrType.TREE)
+    index = GlitchIndex(game_map)
+    assert index.start == Coordinates(1, 1)
+    assert Coordinates(6 + MOMENTUM_OFFSET, 6) not in index.warp_landings[Coordinates(6, 6)]
+    landing = index.cell_id(Coordinates(6, 6 + MOMENTUM_OFFSET))
+    assert index.shortest_paths(Coordinates(1, 1), 'warp')[landing] == WARP_COST + MOMENTUM_OFFSET
+    assert index.shortest_paths(Coordinates(1, 1), 'shrinewarp')[landing] == WARP_COST
@@ -0,0 +1,101 @@
+import random
+
+import pytest
+
+from support_classes import *
+from config import GenerationConfig
+from derived import NEIGHBOR_OFFSETS
+from generation import generate_seeded_map
+from hazards import SAWBLADE_TERRAIN, SNAKE_RANGE, back_and_forth, rectangle_loop
+from map import Map
+
+HAZARDS = GenerationConfig(hazards=True)
+
+def small_map():
+    # 12x12: a walled building, a forced wall, trees and a lava pool, with two blades and three snakes
+    game_map = Map(12, 12)
+    game_map.add_room([Coordinates(x, y) for x in range(6, 11) for y in range(6, 11)], terr_type=TerrType.BUILDING)
+    game_map.add_door(Coordinates(6, 8), Coordinates(5, 8))
+    game_map.add_forced_wall(Coordinates(2, 2), Coordinates(3, 2))
+    for x, y in [(4, 4), (1, 5), (9, 2)]:
+        game_map.set_cell(x, y, TerrType.TREE)
+    for x, y in [(4, 1), (5, 1), (4, 0), (1, 8), (10, 4)]:
+        game_map.set_cell(x, y, TerrType.LAVA)
+    game_map.add_sawblade(rectangle_loop(7, 7, 9, 9))
+    game_map.add_sawblade(back_and_forth([Coordinates(0, y) for y in range(0, 4)]))
+    for x, y in [(4, 1), (1, 8), (10, 4)]:
+        game_map.add_lava_snake(Coordinates(x, y))
+    return game_map
+
+def breath_reaches(game_map, snake, direction, target):
+    # walk the breath out one cell at a time
+    dx, dy = NEIGHBOR_OFFSETS[direction]
+    current = game_map.lava_snakes[snake]
+    for _ in range(SNAKE_RANGE):
+        following = Coordinates(current.x + dx, current.y + dy)
+        if not game_map.is_valid_coordinates(following) or game_map.is_wall(current, following) or game_map.get_cell(following.x, following.y) == TerrType.TREE:
+            return False
+        if following == target:
+            return True
+        current = following
+    return False
+
+def check_tables(game_map):
+    tables = game_map.hazard_tables()
+    for t in range(24):  # a multiple of both periods
+        positions = [path[t % len(path)] for path in game_map.sawblades]
+        for y in range(game_map.height):
+            for x in range(game_map.width):
+                here = Coordinates(x, y)
+                expected = [blade for blade, position in enumerate(positions) if position == here]
+                assert tables.sawblades_at(x, y, t) == expected
+                assert tables.has_sawblade(x, y, t) == bool(expected)
+    for y in range(game_map.height):
+        for x in range(game_map.width):
+            here = Coordinates(x, y)
+            threats = set()
+            for snake in range(len(game_map.lava_snakes)):
+                for direction in range(len(NEIGHBOR_OFFSETS)):
+                    reaches = breath_reaches(game_map, snake, direction, here)
+                    assert tables.in_line_of_fire(snake, direction, x, y) == reaches
+                    if reaches:
+                        threats.add((snake, direction, game_map.lava_snakes[snake].get_distance(here)))
+            assert set(tables.snake_threats_at(x, y)) == threats
+
+def test_tables_match_simulation():
+    check_tables(small_map())
+
+def test_tables_follow_edits():
+    game_map = small_map()
+    game_map.hazard_tables()
+    game_map.set_cell(4, 3, TerrType.TREE)  # cuts the first snake's breath upwards
+    game_map.add_forced_wall(Coordinates(1, 8), Coordinates(2, 8))
+    check_tables(game_map)
+
+def test_bad_hazards_are_refused():
+    game_map = small_map()
+    with pytest.raises(ValueError):
+        game_map.add_lava_snake(Coordinates(0, 11))
+    with pytest.raises(ValueError):
+        game_map.add_sawblade([Coordinates(5, 7), Coordinates(6, 7)])  # through the building wall
+
+def test_hazards_are_off_by_default():
+    game_map = generate_seeded_map(1, 50, 50)
+    assert not game_map.sawblades and not game_map.lava_snakes
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_generated_hazards_are_legal(seed):
+    game_map = generate_seeded_map(seed, 50, 50, HAZARDS)
+    plain = generate_seeded_map(seed, 50, 50)
+    assert game_map.cells == plain.cells and game_map.room_numbers == plain.room_numbers  # hazards only add contents
+    assert game_map.sawblades and game_map.lava_snakes
+    for snake in game_map.lava_snakes:
+        assert game_map.get_cell(snake.x, snake.y) == TerrType.LAVA
+        assert plain.get_cell_contents(snake.x, snake.y) == CellContents.EMPTY
+    for path in game_map.sawblades:
+        assert game_map.get_cell_contents(path[0].x, path[0].y) == CellContents.SAWBLADE
+        for i, cell in enumerate(path):
+            following = path[(i + 1) % len(path)]
+            assert game_map.get_cell(cell.x, cell.y) in SAWBLADE_TERRAIN
+            assert plain.get_cell_contents(cell.x, cell.y) == CellContents.EMPTY
+            assert cell.get_distance(following) == 1 and not game_map.is_wall(cell, following)
@@ -0,0 +1,77 @@
+import random
+from collections import deque
+
+import pytest
+
+from support_classes import *
+from generation import generate_seeded_map
+from navigation import OgreNavigation, NavigationTables, AGGRO_RANGE, ATTACK, IDLE, step_code
+
+# Each table is compared with actions worked out from a full search out from the player, however long the routes.
+
+def full_distances(nav, player):
+    distances = {}
+    queue = deque()
+    for n in [(player.x + 1, player.y), (player.x - 1, player.y), (player.x, player.y + 1), (player.x, player.y - 1)]:
+        if nav.walkable(*n) and nav.open_edge(player.x, player.y, *n):
+            distances[n] = 1
+            queue.append(n)
+    while queue:
+        cell = queue.popleft()
+        for n in nav.steps[nav.cell_id(*cell)]:
+            if n not in distances and n != (player.x, player.y):
+                distances[n] = distances[cell] + 1
+                queue.append(n)
+    return distances
+
+def expected_action(nav, distances, x, y):
+    if (x, y) not in distances:
+        return IDLE
+    if distances[(x, y)] == 1:
+        return ATTACK
+    best = min((distances[n], n[1], n[0]) for n in nav.steps[nav.cell_id(x, y)] if n in distances)
+    return step_code(best[2] - x, best[1] - y)
+
+@pytest.mark.parametrize('seed', [1, 7])
+def test_tables_follow_full_routes(seed):
+    nav = OgreNavigation(generate_seeded_map(seed, 50, 50))
+    rng = random.Random(seed)
+    long_routes = 0
+    for _ in range(40):
+        player = Coordinates(rng.randrange(50), rng.randrange(50))
+        distances = full_distances(nav, player)
+        table = nav.build_table(player)
+        for wy in range(nav.span):
+            for wx in range(nav.span):
+                x, y = player.x + wx - AGGRO_RANGE, player.y + wy - AGGRO_RANGE
+                if abs(x - player.x) + abs(y - player.y) > AGGRO_RANGE:
+                    continue
+                long_routes += distances.get((x, y), 0) > 4 * AGGRO_RANGE
+                assert table[wy * nav.span + wx] == expected_action(nav, distances, x, y), (player, x, y)
+    assert long_routes  # walled layouts, where the route is much longer than the distance, are covered
+
+def test_boss_walks_home_along_shortest_routes():
+    game_map = generate_seeded_map(1, 50, 50)
+    tables = NavigationTables(game_map)
+    boss = tables.boss
+    assert boss is not None
+    nav = tables.ogre
+    distances = {(boss.center.x, boss.center.y): 0}
+    queue = deque(distances)
+    while queue:
+        cell = queue.popleft()
+        for n in nav.steps[nav.cell_id(*cell)]:
+            if n not in distances:
+                distances[n] = distances[cell] + 1
+                queue.append(n)
+    outside = Coordinates(0, 0)
+    assert outside not in boss.room
+    for y in range(game_map.height):
+        for x in range(game_map.width):
+            action = tables.boss_action(Coordinates(x, y), outside)
+            if distances.get((x, y), 0) == 0:
+                assert action == IDLE
+                continue
+            best = min((distances[n], n[1], n[0]) for n in nav.steps[nav.cell_id(x, y)] if n in distances)
+            assert action == step_code(best[2] - x, best[1] - y), (x, y)
+            assert best[0] == distances[(x, y)] - 1
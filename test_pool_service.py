@@ -0,0 +1,60 @@
+import asyncio
+import http.client
+import threading
+
+import pytest
+
+from config import GenerationConfig
+from generation import generate_seeded_map
+from pool_service import MAX_FAILURES, MapPoolService, fetch_map, first_seed
+
+@pytest.fixture(scope='module')
+def service():
+    # the service on a free local port, its event loop in a background thread
+    service = MapPoolService(depth=1, workers=1, refill_concurrency=1, base_seed=7)
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(service.handle, '127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield service, server.sockets[0].getsockname()[1]
+
+    async def shut_down():
+        for pool in service.pools.values():
+            pool.stop()
+        server.close()
+    asyncio.run_coroutine_threadsafe(shut_down(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    service.executor.shutdown(cancel_futures=True)
+
+def get(port, path):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+def test_serves_a_seeded_map(service):
+    service, port = service
+    seed, game_map = fetch_map(50, 50, port=port)
+    first = first_seed(7, 50, 50, GenerationConfig())
+    assert first <= seed < first + MAX_FAILURES  # a seed whose generation raises is skipped
+    assert game_map.cells == generate_seeded_map(seed, 50, 50).cells
+
+def test_pools_use_different_seeds():
+    plain = first_seed(7, 50, 50, GenerationConfig())
+    for other in [first_seed(7, 60, 50, GenerationConfig()), first_seed(7, 50, 50, GenerationConfig(hazards=True)), first_seed(8, 50, 50, GenerationConfig())]:
+        assert other != plain
+
+@pytest.mark.parametrize('query', ['building_max_size=big', 'no_such_field=1', 'hazards=maybe', 'width=wide'])
+def test_rejects_bad_requests(service, query):
+    service, port = service
+    status, body = get(port, '/map?' + query)
+    assert status == 400
+    assert len(service.pools) <= 1  # no pool was started for the bad request
+
+def test_unknown_path(service):
+    service, port = service
+    assert get(port, '/nothing')[0] == 404
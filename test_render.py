@@ -0,0 +1,60 @@
+import struct
+import zlib
+
+import pytest
+
+from support_classes import *
+from map import Map
+from render import hex_to_rgb, render_map_png, write_contact_sheet, BACKGROUND_COLOR
+
+def read_png(data):
+    # (width, height, rows of RGB bytes) from an 8-bit RGB PNG with unfiltered rows
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    offset = 8
+    chunks = {}
+    while offset < len(data):
+        length, = struct.unpack_from('>I', data, offset)
+        kind = data[offset + 4:offset + 8]
+        body = data[offset + 8:offset + 8 + length]
+        assert struct.unpack_from('>I', data, offset + 8 + length)[0] == zlib.crc32(kind + body) & 0xffffffff
+        chunks[kind] = chunks.get(kind, b'') + body
+        offset += 12 + length
+    width, height, depth, color_type = struct.unpack_from('>IIBB', chunks[b'IHDR'])
+    assert (depth, color_type) == (8, 2) and b'IEND' in chunks
+    raw = zlib.decompress(chunks[b'IDAT'])
+    assert len(raw) == height * (1 + 3 * width)
+    rows = [raw[y * (1 + 3 * width) + 1:(y + 1) * (1 + 3 * width)] for y in range(height)]
+    return width, height, rows
+
+def pixel(rows, x, y):
+    return tuple(rows[y][3 * x:3 * x + 3])
+
+def small_map(width, height, terrain):
+    game_map = Map(width, height)
+    game_map.set_cell(0, 0, terrain)  # bottom-left cell, drawn in the bottom-left corner of the image
+    return game_map
+
+def test_map_png_size_and_layout():
+    width, height, rows = read_png(render_map_png(small_map(10, 6, TerrType.WATER), tile_size=8))
+    assert (width, height) == (80, 48)
+    assert pixel(rows, 3, 44) == hex_to_rgb(TerrType.WATER.color)
+    assert pixel(rows, 3, 3) == hex_to_rgb(TerrType.GRASS.color)
+
+def test_contact_sheet(tmp_path):
+    filename = str(tmp_path / 'sheet.png')
+    maps = [small_map(10, 8, TerrType.WATER), small_map(10, 8, TerrType.LAVA), small_map(6, 4, TerrType.DESERT)]
+    write_contact_sheet(maps, filename, 10, 8, columns=2, tile_size=2, padding=4)
+    with open(filename, 'rb') as f:
+        width, height, rows = read_png(f.read())
+    assert (width, height) == (2 * 20 + 3 * 4, 4 + 2 * (16 + 4))
+    assert pixel(rows, 0, 0) == BACKGROUND_COLOR
+    assert pixel(rows, 4, 4 + 15) == hex_to_rgb(TerrType.WATER.color)
+    assert pixel(rows, 4 + 20 + 4, 4 + 15) == hex_to_rgb(TerrType.LAVA.color)
+    # the smaller map sits top-left in its cell, padded with background
+    assert pixel(rows, 4, 24 + 7) == hex_to_rgb(TerrType.DESERT.color)
+    assert pixel(rows, 4, 24 + 8) == BACKGROUND_COLOR
+    assert pixel(rows, 4 + 12, 24) == BACKGROUND_COLOR
+
+def test_contact_sheet_rejects_oversized_maps(tmp_path):
+    with pytest.raises(ValueError):
+        write_contact_sheet([Map(12, 8)], str(tmp_path / 'sheet.png'), 10, 8)
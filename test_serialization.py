@@ -0,0 +1,62 @@
+import struct
+import zlib
+
+import pytest
+
+from support_classes import *
+from config import GenerationConfig
+from generation import generate_seeded_map, iter_maps
+from serialization import HEADER, MAGIC, map_to_bytes, map_from_bytes, save_map, load_map, _hazards_to_array
+
+def map_state(game_map):
+    return {
+        'size': (game_map.width, game_map.height),
+        'cells': game_map.cells,
+        'contents': game_map.cell_contents,
+        'rooms': game_map.room_numbers,
+        'next_room_number': game_map.next_room_number,
+        'doors': game_map.doors,
+        'forced_walls': game_map.forced_walls,
+        'sawblades': game_map.sawblades,
+        'lava_snakes': game_map.lava_snakes,
+        'retry_counts': game_map.retry_counts,
+    }
+
+@pytest.fixture(scope='module')
+def game_map():
+    # with hazards, so their section of the format is exercised too
+    return generate_seeded_map(1, 50, 50, GenerationConfig(hazards=True))
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_round_trip(game_map, compress):
+    loaded = map_from_bytes(map_to_bytes(game_map, compress=compress))
+    assert map_state(loaded) == map_state(game_map)
+    assert game_map.retry_counts  # the seed does retry, so the counts are really exercised
+    assert loaded.is_door(*game_map.doors[0])
+    assert loaded.is_forced_wall(*game_map.forced_walls[0])
+
+def test_save_and_load(game_map, tmp_path):
+    filename = str(tmp_path / 'map.bin')
+    save_map(game_map, filename)
+    assert map_state(load_map(filename)) == map_state(game_map)
+
+def test_prefetched_maps_match_in_process_maps():
+    in_process = [map_state(m) for m in iter_maps([3, 4], 50, 50)]
+    prefetched = [map_state(m) for m in iter_maps([3, 4], 50, 50, prefetch=1)]
+    assert prefetched == in_process
+
+def test_version_2_still_loads(game_map):
+    # version 2: hazards run to the end of the body, and there are no retry counts
+    data = map_to_bytes(game_map, compress=False)
+    magic, version, compressed, width, height, next_room_number, door_count, wall_count = HEADER.unpack_from(data, 0)
+    area = width * height
+    fixed = area * 6 + (door_count + wall_count) * 16
+    body = data[HEADER.size:HEADER.size + fixed] + _hazards_to_array(game_map).tobytes()
+    old = HEADER.pack(MAGIC, 2, 1, width, height, next_room_number, door_count, wall_count) + zlib.compress(body)
+    loaded = map_from_bytes(old)
+    expected = dict(map_state(game_map), retry_counts={})
+    assert map_state(loaded) == expected
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        map_from_bytes(struct.pack('<4sBBIIIII', b'NOPE', 3, 0, 1, 1, 1, 0, 0))
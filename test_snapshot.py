@@ -0,0 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import pytest
+
+from config import GenerationConfig
+from generation import generate_seeded_map
+import snapshot as snapshot_module
+from snapshot import MapSnapshot, snapshot_pool
+
+def attached_names(snapshot):
+    snapshot.get_cell(0, 0)
+    return sorted(snapshot_module._attached)
+
+def attached_count(_=None):
+    return len(snapshot_module._attached)
+
+@pytest.fixture(scope='module')
+def game_map():
+    # with hazards, so their section of the format is exercised too
+    return generate_seeded_map(1, 50, 50, GenerationConfig(hazards=True))
+
+def test_to_map_round_trip(game_map):
+    with MapSnapshot.create(game_map) as snapshot:
+        copy = snapshot.to_map()
+    assert copy.cells == game_map.cells
+    assert copy.cell_contents == game_map.cell_contents
+    assert copy.room_numbers == game_map.room_numbers
+    assert copy.doors == game_map.doors and copy.forced_walls == game_map.forced_walls
+    assert (copy.sawblades, copy.lava_snakes) == (game_map.sawblades, game_map.lava_snakes)
+
+def test_reused_executor_keeps_one_attachment(game_map):
+    # a long-lived worker lets go of each snapshot once it moves on to the next
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        for _ in range(3):
+            with snapshot_pool(game_map, executor=executor) as (snapshot, _):
+                assert executor.submit(attached_names, snapshot).result() == [snapshot.name]
+            with pytest.raises(FileNotFoundError):
+                shared_memory.SharedMemory(name=snapshot.name)
+        executor.submit(snapshot_module.release_attached).result()
+        assert executor.submit(attached_count).result() == 0
+
+def write_through_views(snapshot):
+    # every view a task can reach; each write should fail
+    failures = 0
+    for view in [snapshot.terrain, snapshot.contents, snapshot.edge_masks, snapshot.rooms, snapshot.door_values, snapshot.wall_values, snapshot.hazard_values]:
+        try:
+            view[0] = view[0]
+        except TypeError:
+            failures += 1
+    return failures
+
+def test_views_are_read_only(game_map):
+    with snapshot_pool(game_map, max_workers=1) as (snapshot, executor):
+        assert write_through_views(snapshot) == 7
+        assert executor.submit(write_through_views, snapshot).result() == 7
+        with pytest.raises(TypeError):
+            snapshot.terrain[0] = 0
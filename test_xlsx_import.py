@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+pytest.importorskip('xlsxwriter')
+
+from support_classes import *
+from config import GenerationConfig
+from generation import generate_seeded_map
+from xlsx_import import import_from_excel, convert_archive
+
+def edges(game_map):
+    for y in range(game_map.height):
+        for x in range(game_map.width):
+            for nx, ny in [(x + 1, y), (x, y + 1)]:
+                if nx < game_map.width and ny < game_map.height:
+                    yield Coordinates(x, y), Coordinates(nx, ny)
+
+@pytest.fixture(scope='module')
+def workbook(tmp_path_factory):
+    game_map = generate_seeded_map(2, 50, 50, GenerationConfig(hazards=True))
+    filename = str(tmp_path_factory.mktemp('xlsx') / 'game_map_2.xlsx')
+    game_map.export_to_excel(filename)
+    return game_map, filename
+
+def test_round_trip(workbook):
+    game_map, filename = workbook
+    loaded = import_from_excel(filename)
+    assert (loaded.width, loaded.height) == (game_map.width, game_map.height)
+    assert loaded.cells == game_map.cells
+    expected_contents = [[CellContents.EMPTY if c == CellContents.FORCE_EMPTY else c for c in row] for row in game_map.cell_contents]
+    assert loaded.cell_contents == expected_contents
+    assert loaded.lava_snakes == game_map.lava_snakes
+    for coord1, coord2 in edges(game_map):
+        assert loaded.is_wall(coord1, coord2) == game_map.is_wall(coord1, coord2), (coord1, coord2)
+
+def test_archive_does_not_overwrite(workbook, tmp_path):
+    game_map, filename = workbook
+    out_dir = str(tmp_path)
+    destination = os.path.join(out_dir, 'game_map_2.bin')
+    assert convert_archive([filename], out_dir, max_workers=1) == [destination]
+    with open(destination, 'wb') as f:
+        f.write(b'keep me')
+    assert convert_archive([filename], out_dir, max_workers=1) == []
+    with open(destination, 'rb') as f:
+        assert f.read() == b'keep me'
+    assert convert_archive([filename], out_dir, max_workers=1, force=True) == [destination]
+    with open(destination, 'rb') as f:
+        assert f.read() != b'keep me'
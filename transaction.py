@@ -0,0 +1,31 @@
+# Undo journal for trial edits:
+#
+#     with game_map.transaction() as trial:
+#         ...edit the map...
+#         if not acceptable:
+#             trial.rollback()
+#
+# Leaving the block normally keeps the edits; an exception rolls them back and propagates.  Every journaled
+# edit records only what it overwrote, so a rollback costs time proportional to the edits, not the map size.
+# Transactions nest: a committed inner transaction is rolled back along with its outer one.
+class Transaction:
+    def __init__(self, game_map):
+        self.game_map = game_map
+        self.journal = []
+        self.outer_journal = None
+
+    def __enter__(self):
+        self.outer_journal = self.game_map.journal
+        self.game_map.journal = self.journal
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.rollback()
+        self.game_map.journal = self.outer_journal
+        if self.outer_journal is not None:
+            self.outer_journal.extend(self.journal)
+        return False
+
+    def rollback(self):
+        self.game_map.undo(self.journal)
@@ -2,11 +2,12 @@ import random
 from support_classes import *
 
 class Vault:
-    def __init__(self, name, probability, find_location_func, place_func):
+    def __init__(self, name, probability, find_location_func, place_func, validate_func=None):
         self.name = name
         self.probability = probability
         self.find_location_func = find_location_func
         self.place_func = place_func
+        self.validate_func = validate_func # called after placing; returning False rolls the placement back
 
 def find_desert_pyramid_location(game_map):
     valid = []
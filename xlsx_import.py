@@ -0,0 +1,259 @@
+import os
+import re
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import iterparse
+
+from support_classes import *
+from map import Map
+
+# Reads workbooks written by excel_export.export_to_excel back into a Map, streaming the XML parts of the
+# xlsx with iterparse so a workbook is never held in memory as a tree.  Fill colours give the terrain, medium
+# borders the walls, and the symbol with its font colour the contents (Force Empty comes back as Empty).
+#
+# The workbook only shows where walls are, not which rooms they separate, so rooms are rebuilt (see
+# rebuild_rooms) and the open edges between them become doors.  Walls inside a room would become forced walls,
+# so Map.is_wall agrees with the workbook on every edge even where the guess about rooms is wrong.  Sawblade
+# paths are not exported, so sawblades come back as their start cells only; lava snakes are rebuilt from
+# their cells.
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+WALL_STYLES = {'medium', 'thick'}
+INDOOR_TERRAIN = [TerrType.BUILDING, TerrType.CASTLE]
+CELL_REF = re.compile(r'([A-Z]+)(\d+)')
+
+TERRAIN_BY_COLOR = {t.color.upper(): t for t in TerrType}
+CONTENTS_BY_STYLE = {}  # (symbol, font colour) -> CellContents
+CONTENTS_BY_SYMBOL = {}  # symbol -> CellContents, for symbols only one kind of contents uses
+for _contents in CellContents:
+    if _contents.symbol and _contents.color:
+        CONTENTS_BY_STYLE[(_contents.symbol, _contents.color.upper())] = _contents
+        CONTENTS_BY_SYMBOL[_contents.symbol] = _contents if _contents.symbol not in CONTENTS_BY_SYMBOL else None
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+def argb_to_hex(element):
+    # '#RRGGBB' from a <color rgb="FFRRGGBB"/>-style element; theme and indexed colours give None
+    if element is None or element.get('rgb') is None:
+        return None
+    return '#' + element.get('rgb')[-6:].upper()
+
+def read_styles(workbook):
+    # one (fill colour, font colour, (left, right, top, bottom) walls) per cell style index
+    fonts, fills, borders, styles = [], [], [], []
+    section = None
+    with workbook.open('xl/styles.xml') as f:
+        for event, element in iterparse(f, events=('start', 'end')):
+            tag = element.tag[len(MAIN_NS):]
+            if event == 'start':
+                if tag in ['fonts', 'fills', 'borders', 'cellXfs', 'cellStyleXfs']:
+                    section = tag
+                continue
+            if tag == 'font' and section == 'fonts':
+                fonts.append(argb_to_hex(element.find(MAIN_NS + 'color')))
+            elif tag == 'fill' and section == 'fills':
+                pattern = element.find(MAIN_NS + 'patternFill')
+                fills.append(argb_to_hex(pattern.find(MAIN_NS + 'fgColor')) if pattern is not None else None)
+            elif tag == 'border' and section == 'borders':
+                sides = []
+                for side in ['left', 'right', 'top', 'bottom']:
+                    edge = element.find(MAIN_NS + side)
+                    sides.append(edge is not None and edge.get('style') in WALL_STYLES)
+                borders.append(tuple(sides))
+            elif tag == 'xf' and section == 'cellXfs':
+                styles.append((int(element.get('fillId', 0)), int(element.get('fontId', 0)), int(element.get('borderId', 0))))
+            elif tag in ['fonts', 'fills', 'borders', 'cellXfs', 'cellStyleXfs']:
+                section = None
+            if tag in ['font', 'fill', 'border', 'xf']:
+                element.clear()
+    return [(fills[fill], fonts[font], borders[border]) for fill, font, border in styles]
+
+def read_shared_strings(workbook):
+    if 'xl/sharedStrings.xml' not in workbook.namelist():
+        return []
+    strings = []
+    with workbook.open('xl/sharedStrings.xml') as f:
+        for event, element in iterparse(f):
+            if element.tag == MAIN_NS + 'si':
+                strings.append(''.join(t.text or '' for t in element.iter(MAIN_NS + 't')))
+                element.clear()
+    return strings
+
+def iter_cells(workbook, sheet='xl/worksheets/sheet1.xml'):
+    # (column, row, style index, text) for every <c> in the sheet, with row and column from 0
+    with workbook.open(sheet) as f:
+        strings = None
+        for event, element in iterparse(f):
+            if element.tag != MAIN_NS + 'c':
+                if element.tag == MAIN_NS + 'row':
+                    element.clear()
+                continue
+            letters, digits = CELL_REF.match(element.get('r')).groups()
+            kind = element.get('t')
+            text = ''
+            if kind == 's':
+                if strings is None:
+                    strings = read_shared_strings(workbook)
+                text = strings[int(element.find(MAIN_NS + 'v').text)]
+            elif kind == 'inlineStr':
+                text = ''.join(t.text or '' for t in element.iter(MAIN_NS + 't'))
+            elif element.find(MAIN_NS + 'v') is not None:
+                text = element.find(MAIN_NS + 'v').text or ''
+            yield column_index(letters), int(digits) - 1, int(element.get('s', 0)), text
+
+def contents_for(symbol, color):
+    if not symbol:
+        return CellContents.EMPTY
+    contents = CONTENTS_BY_STYLE.get((symbol, color)) or CONTENTS_BY_SYMBOL.get(symbol)
+    if contents is None:
+        raise ValueError("Unknown cell contents: {!r} in colour {}".format(symbol, color))
+    return contents
+
+def import_from_excel(filename, config=None):
+    with zipfile.ZipFile(filename) as workbook:
+        styles = read_styles(workbook)
+        cells = []
+        for column, row, style, text in iter_cells(workbook):
+            fill, font, borders = styles[style]
+            if fill not in TERRAIN_BY_COLOR:
+                raise ValueError("Cell {},{} in {} has no terrain colour ({})".format(column, row, filename, fill))
+            cells.append((column, row, TERRAIN_BY_COLOR[fill], contents_for(text, font), borders))
+    if not cells:
+        raise ValueError("No cells in {}".format(filename))
+
+    width = max(c[0] for c in cells) + 1
+    height = max(c[1] for c in cells) + 1
+    if len(cells) != width * height:
+        raise ValueError("{} has {} cells, expected {}x{}".format(filename, len(cells), width, height))
+    game_map = Map(width, height, config)
+    # walls_right[y][x]: wall between (x, y) and (x + 1, y); walls_up[y][x]: between (x, y) and (x, y + 1).
+    # Each wall is drawn on both of its cells, so either border is enough.
+    walls_right = [bytearray(width) for _ in range(height)]
+    walls_up = [bytearray(width) for _ in range(height)]
+    for column, row, terrain, contents, (left, right, top, bottom) in cells:
+        x, y = column, height - 1 - row  # low y is at the bottom of the sheet
+        game_map.cells[y][x] = terrain
+        game_map.cell_contents[y][x] = contents
+        if right and x < width - 1:
+            walls_right[y][x] = 1
+        if left and x > 0:
+            walls_right[y][x - 1] = 1
+        if top and y < height - 1:
+            walls_up[y][x] = 1
+        if bottom and y > 0:
+            walls_up[y - 1][x] = 1
+
+    rebuild_rooms(game_map, walls_right, walls_up)
+    game_map.lava_snakes = [Coordinates(x, y) for y in range(height) for x in range(width) if game_map.cell_contents[y][x] == CellContents.LAVA_SNAKE]
+    return game_map
+
+def rebuild_rooms(game_map, walls_right, walls_up):
+    width, height = game_map.width, game_map.height
+    cells = game_map.cells
+
+    def is_wall(x, y, nx, ny):
+        if nx == x:
+            return walls_up[min(y, ny)][x]
+        return walls_right[y][min(x, nx)]
+
+    def flanking_walls(x, y, nx, ny):
+        # walls on the edges either side of this one along its wall line; a door is a gap in such a line
+        dx, dy = ny - y, nx - x
+        count = 0
+        for s in [-1, 1]:
+            ax, ay, bx, by = x + dx * s, y + dy * s, nx + dx * s, ny + dy * s
+            if 0 <= ax < width and 0 <= ay < height and 0 <= bx < width and 0 <= by < height and is_wall(ax, ay, bx, by):
+                count += 1
+        return count
+
+    # Walls only separate different rooms, so grow rooms by merging across open edges between cells of the same
+    # indoor terrain, never merging two groups that have a wall between them.  Edges away from any wall line
+    # merge first, then those next to one wall; a gap with walls on both sides is always taken as a door.
+    # Rooms whose whole boundary is doors cannot be told apart from one room, so some rooms come back merged.
+    parent = list(range(width * height))
+    walled = {}  # root -> cell ids on the far side of a wall from the group
+
+    def find(cell):
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    edges = [[], [], []]  # open edges by number of flanking walls
+    for y in range(height):
+        for x in range(width):
+            if cells[y][x] not in INDOOR_TERRAIN:
+                continue
+            cell = y * width + x
+            walled[cell] = []
+            for nx, ny in [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]:
+                if not (0 <= nx < width and 0 <= ny < height) or cells[ny][nx] != cells[y][x]:
+                    continue
+                if is_wall(x, y, nx, ny):
+                    walled[cell].append(ny * width + nx)
+                elif (nx, ny) > (x, y):
+                    edges[flanking_walls(x, y, nx, ny)].append((cell, ny * width + nx))
+    for tier in edges[:2]:
+        for a, b in tier:
+            root_a, root_b = find(a), find(b)
+            if root_a == root_b:
+                continue
+            if len(walled[root_a]) > len(walled[root_b]):
+                root_a, root_b = root_b, root_a
+            if any(find(c) == root_b for c in walled[root_a]) or any(find(c) == root_a for c in walled[root_b]):
+                continue
+            parent[root_a] = root_b
+            walled[root_b].extend(walled.pop(root_a))
+
+    room_numbers = game_map.room_numbers
+    room_for_root = {}
+    for y in range(height):
+        for x in range(width):
+            if cells[y][x] in INDOOR_TERRAIN:
+                room_numbers[y][x] = room_for_root.setdefault(find(y * width + x), len(room_for_root) + 1)
+    game_map.next_room_number = len(room_for_root) + 1
+
+    # doors and forced walls make is_wall match the workbook exactly
+    for y in range(height):
+        for x in range(width):
+            for nx, ny in [(x + 1, y), (x, y + 1)]:
+                if nx >= width or ny >= height:
+                    continue
+                same_room = room_numbers[y][x] == room_numbers[ny][nx]
+                wall = is_wall(x, y, nx, ny)
+                if wall and same_room:
+                    game_map.forced_walls.append((Coordinates(x, y), Coordinates(nx, ny)))
+                elif not wall and not same_room:
+                    game_map.doors.append((Coordinates(x, y), Coordinates(nx, ny)))
+    game_map.index_edges()
+
+def convert_file(task):
+    # one workbook to a .bin map; returns (source, destination, error).  An existing .bin is only replaced with force.
+    from serialization import save_map
+    filename, out_dir, force = task
+    destination = os.path.join(out_dir, os.path.splitext(os.path.basename(filename))[0] + '.bin')
+    if not force and os.path.exists(destination):
+        return filename, None, '{} already exists (use --force to replace it)'.format(destination)
+    try:
+        save_map(import_from_excel(filename), destination)
+        return filename, destination, ''
+    except Exception as e:  # one broken workbook should be reported, not stop the archive
+        return filename, None, repr(e)
+
+def convert_archive(filenames, out_dir, max_workers=None, force=False):
+    from generation import bounded_map
+    os.makedirs(out_dir, exist_ok=True)
+    workers = max_workers or os.cpu_count() or 1
+    converted = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for filename, destination, error in bounded_map(executor, convert_file, ((f, out_dir, force) for f in filenames), 4 * workers):
+            if error:
+                print('Workbook {} failed: {}'.format(filename, error), file=sys.stderr)
+            else:
+                converted.append(destination)
+    return converted